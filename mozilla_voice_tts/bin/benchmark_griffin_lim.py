@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Compare the speed and the spectral convergence of the batched torch
+Griffin-Lim with librosa."""
+
+import argparse
+import time
+
+import librosa
+import numpy as np
+import torch
+
+from mozilla_voice_tts.utils.audio import AudioProcessor
+from mozilla_voice_tts.utils.io import load_config
+
+
+def spectral_convergence(ap, wav, S):
+    S_ = np.abs(ap._stft(wav.astype(np.float32)))[:, :S.shape[1]]  # pylint: disable=protected-access
+    return np.linalg.norm(S_ - S) / np.linalg.norm(S)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--config_path', type=str, required=True,
+                        help='Config file with the audio parameters.')
+    parser.add_argument('--wav_path', type=str, required=True,
+                        help='Audio file whose spectrogram is inverted.')
+    parser.add_argument('--batch_size', type=int, default=8,
+                        help='Number of spectrograms inverted at once.')
+    parser.add_argument('--num_iters', type=int, default=None,
+                        help='Griffin-Lim iterations. Defaults to the config.')
+    parser.add_argument('--momentum', type=float, default=0.99,
+                        help='Momentum of fast Griffin-Lim.')
+    args = parser.parse_args()
+
+    C = load_config(args.config_path)
+    ap = AudioProcessor(**C.audio)
+    num_iters = args.num_iters or ap.griffin_lim_iters
+    wav = ap.load_wav(args.wav_path)
+    S = np.abs(ap._stft(wav.astype(np.float32)))  # pylint: disable=protected-access
+    # items of different lengths, as in a padded batch
+    specs = [S[:, :S.shape[1] * (idx + 1) // args.batch_size] for idx in range(args.batch_size)]
+
+    for momentum in [0.0, args.momentum]:
+        start_time = time.time()
+        wavs = [librosa.griffinlim(spec, n_iter=num_iters, hop_length=ap.hop_length, win_length=ap.win_length,
+                                   momentum=momentum, pad_mode=ap.stft_pad_mode) for spec in specs]
+        librosa_time = time.time() - start_time
+        librosa_sc = np.mean([spectral_convergence(ap, wav, spec) for wav, spec in zip(wavs, specs)])
+
+        start_time = time.time()
+        wavs = ap.griffin_lim(specs, num_iters=num_iters, momentum=momentum)
+        torch_time = time.time() - start_time
+        torch_sc = np.mean([spectral_convergence(ap, wav, spec) for wav, spec in zip(wavs, specs)])
+
+        print(f" > momentum {momentum}, {num_iters} iterations, {torch.get_num_threads()} threads:")
+        print(f" | > librosa: {librosa_time:.2f}s spectral convergence {librosa_sc:.4f}")
+        print(f" | > torch batch: {torch_time:.2f}s spectral convergence {torch_sc:.4f}")
+        print(f" | > speed up: {librosa_time / torch_time:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Compare the throughput of the PQMF filter bank implementations on long
+signals."""
+
+import argparse
+import time
+
+import torch
+
+from mozilla_voice_tts.vocoder.layers.pqmf import PQMF
+
+
+def benchmark(fn, inputs, num_runs):
+    """Return the seconds per run of ``fn(inputs)``."""
+    fn(inputs)
+    start_time = time.time()
+    for _ in range(num_runs):
+        fn(inputs)
+    return (time.time() - start_time) / num_runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--seconds', type=float, default=30.0,
+                        help='Length of the signal in seconds.')
+    parser.add_argument('--sample_rate', type=int, default=22050,
+                        help='Sample rate of the signal.')
+    parser.add_argument('--batch_size', type=int, default=1,
+                        help='Number of signals per run.')
+    parser.add_argument('--num_runs', type=int, default=10,
+                        help='Number of timed runs.')
+    args = parser.parse_args()
+
+    num_samples = int(args.seconds * args.sample_rate)
+    signal = torch.randn(args.batch_size, 1, num_samples)
+    reference = PQMF(mode='conv')
+    with torch.no_grad():
+        subbands = reference.analysis(signal)
+        reference_output = reference.synthesis(subbands)
+        for mode in ['conv', 'polyphase', 'fft']:
+            layer = PQMF(mode=mode)
+            analysis_time = benchmark(layer.analysis, signal, args.num_runs)
+            synthesis_time = benchmark(layer.synthesis, subbands, args.num_runs)
+            error = (layer.synthesis(subbands) - reference_output).abs().max().item()
+            print(f" > {mode}: analysis {num_samples * args.batch_size / analysis_time / 1e6:.1f} MSamples/sec"
+                  f" synthesis {num_samples * args.batch_size / synthesis_time / 1e6:.1f} MSamples/sec"
+                  f" max difference {error:.2e}")
+
+
+if __name__ == '__main__':
+    main()
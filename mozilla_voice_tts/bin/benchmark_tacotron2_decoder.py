@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Compare the decoder speed of Tacotron2 with and without the TorchScript
+compiled decoder step."""
+
+import argparse
+import time
+
+import torch
+
+from mozilla_voice_tts.tts.utils.generic_utils import setup_model
+from mozilla_voice_tts.tts.utils.text.symbols import make_symbols, phonemes, symbols
+from mozilla_voice_tts.utils.io import load_config
+
+
+def benchmark(model, inputs, num_runs):
+    """Return the decoder steps per second of ``model.inference()``."""
+    # warm up, also runs the TorchScript profiling passes
+    for _ in range(2):
+        model.inference(inputs)
+    num_steps = 0
+    start_time = time.time()
+    for _ in range(num_runs):
+        _, _, alignments, _ = model.inference(inputs)
+        num_steps += alignments.shape[1]
+    if inputs.is_cuda:
+        torch.cuda.synchronize()
+    return num_steps / (time.time() - start_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--config_path', type=str, required=True,
+                        help='Tacotron2 config file path.')
+    parser.add_argument('--model_path', type=str, default=None,
+                        help='Model checkpoint path. Random weights are used if not given.')
+    parser.add_argument('--text_length', type=int, default=100,
+                        help='Number of input characters.')
+    parser.add_argument('--decoder_steps', type=int, default=200,
+                        help='Number of decoder steps of each run.')
+    parser.add_argument('--num_runs', type=int, default=5,
+                        help='Number of timed runs.')
+    parser.add_argument('--use_cuda', type=bool, default=False,
+                        help='Run the model on GPU.')
+    args = parser.parse_args()
+
+    C = load_config(args.config_path)
+    if 'characters' in C.keys():
+        model_symbols, model_phonemes = make_symbols(**C.characters)
+    else:
+        model_symbols, model_phonemes = symbols, phonemes
+    num_chars = len(model_phonemes) if C.use_phonemes else len(model_symbols)
+    model = setup_model(num_chars, 0, C)
+    if args.model_path is not None:
+        cp = torch.load(args.model_path, map_location=torch.device('cpu'))
+        model.load_state_dict(cp['model'])
+        model.decoder.set_r(cp['r'])
+    model.eval()
+    if args.use_cuda:
+        model.cuda()
+    # decode a fixed number of steps
+    model.decoder.stop_threshold = 1.0
+    model.decoder.max_decoder_steps = args.decoder_steps
+
+    inputs = torch.randint(1, num_chars, (1, args.text_length)).long()
+    if args.use_cuda:
+        inputs = inputs.cuda()
+
+    with torch.no_grad():
+        eager_speed = benchmark(model, inputs, args.num_runs)
+        model.decoder.script_step()
+        scripted_speed = benchmark(model, inputs, args.num_runs)
+    print(f" > Eager decoder: {eager_speed:.1f} steps/sec")
+    print(f" > Scripted decoder: {scripted_speed:.1f} steps/sec")
+    print(f" > Speed up: {scripted_speed / eager_speed:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
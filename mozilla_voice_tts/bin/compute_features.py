@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+
+from mozilla_voice_tts.tts.datasets.feature_store import FeatureStore
+from mozilla_voice_tts.tts.datasets.preprocess import load_meta_data
+from mozilla_voice_tts.utils.io import load_config
+from mozilla_voice_tts.utils.audio import AudioProcessor
+
+
+def main():
+    """Precompute the spectrograms of the training and evaluation data."""
+    parser = argparse.ArgumentParser(
+        description="Precompute the spectrograms of a TTS dataset into a memory-mapped feature store. "
+                    "Set feature_store_path in the config to train from it.")
+    parser.add_argument("--config_path", type=str, required=True,
+                        help="TTS config file path to define the datasets and audio processing parameters.")
+    parser.add_argument("--out_path", type=str, default=None,
+                        help="folder of the feature store. Defaults to feature_store_path of the config.")
+    parser.add_argument("--num_workers", type=int, default=0,
+                        help="number of feature extraction processes. 0 computes features in the main process.")
+    parser.add_argument("--max_shard_mb", type=int, default=1024,
+                        help="size of the mel spectrogram shards in MB.")
+    parser.add_argument("--force", action="store_true",
+                        help="rebuild the store even if it is up to date.")
+    args = parser.parse_args()
+
+    c = load_config(args.config_path)
+    out_path = args.out_path or c.get('feature_store_path')
+    assert out_path is not None, " [!] Set --out_path or feature_store_path in the config."
+    compute_linear_spec = c.model.lower() == 'tacotron'
+    ap = AudioProcessor(**c.audio)
+
+    meta_data_train, meta_data_eval = load_meta_data(c.datasets)
+    wav_files = sorted({item[1] for item in meta_data_train + meta_data_eval})
+    print(f" > There are {len(wav_files)} files.")
+
+    if not args.force and FeatureStore.is_up_to_date(out_path, ap, compute_linear_spec, wav_files):
+        print(f" > Feature store {out_path} is up to date.")
+        return
+    store = FeatureStore.build(out_path, wav_files, ap,
+                               compute_linear_spec=compute_linear_spec,
+                               num_workers=args.num_workers,
+                               max_shard_bytes=args.max_shard_mb * 2**20)
+    print(f" > Feature store of {len(store)} files is saved to {out_path}")
+
+
+if __name__ == "__main__":
+    main()
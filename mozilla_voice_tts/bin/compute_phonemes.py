@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+
+from mozilla_voice_tts.tts.datasets.phoneme_cache import PhonemeCache
+from mozilla_voice_tts.tts.datasets.preprocess import load_meta_data
+from mozilla_voice_tts.utils.io import load_config
+
+
+def main():
+    """Fill the phoneme cache of the training and evaluation data."""
+    parser = argparse.ArgumentParser(
+        description="Phonemize the sentences of a TTS dataset into the phoneme cache before training.")
+    parser.add_argument("--config_path", type=str, required=True,
+                        help="TTS config file path to define the datasets, text cleaner and phoneme language.")
+    parser.add_argument("--num_workers", type=int, default=4,
+                        help="number of phonemizer processes. 0 runs the phonemizer in the main process.")
+    args = parser.parse_args()
+
+    c = load_config(args.config_path)
+    meta_data_train, meta_data_eval = load_meta_data(c.datasets)
+    texts = [item[0] for item in meta_data_train + meta_data_eval]
+    print(f" > There are {len(texts)} sentences.")
+
+    cache = PhonemeCache(c.phoneme_cache_path)
+    num_new = cache.build(texts, c.text_cleaner, c.phoneme_language,
+                          tp=c.characters if 'characters' in c.keys() else None,
+                          num_workers=args.num_workers)
+    print(f" > Phonemized {num_new} new sentences. The cache at {c.phoneme_cache_path} has {len(cache)} entries.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# Export a MelGAN or multi-band MelGAN generator to a frozen TorchScript file
+# that the server loads without the model code.
+
+import argparse
+import time
+
+import torch
+
+from mozilla_voice_tts.utils.io import load_config
+from mozilla_voice_tts.vocoder.utils.generic_utils import setup_generator
+from mozilla_voice_tts.vocoder.utils.torchscript import export_melgan
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--torch_model_path',
+                    type=str,
+                    help='Path to target torch model to be exported.')
+parser.add_argument('--config_path',
+                    type=str,
+                    help='Path to config file of torch model.')
+parser.add_argument('--output_path',
+                    type=str,
+                    help='path to TorchScript output file.')
+parser.add_argument('--inference_padding',
+                    type=int,
+                    default=2,
+                    help='number of frames of padding added to the input at either side and trimmed from the output.')
+args = parser.parse_args()
+
+# load the model
+c = load_config(args.config_path)
+model = setup_generator(c)
+checkpoint = torch.load(args.torch_model_path, map_location=torch.device('cpu'))
+model.load_state_dict(checkpoint['model'])
+model.eval()
+
+# export and compare the outputs
+scripted_model = export_melgan(model, inference_padding=args.inference_padding)
+dummy_input = torch.rand((1, c.audio['num_mels'], 200))
+with torch.no_grad():
+    model.inference_padding = args.inference_padding
+    padding = args.inference_padding * model.upsample_scale
+    start = time.time()
+    output = model.inference(dummy_input)[:, :, padding:-padding or None]
+    model_time = time.time() - start
+    start = time.time()
+    output_scripted = scripted_model.inference(dummy_input)
+    scripted_time = time.time() - start
+print(" > Max difference to the torch model: {}".format((output - output_scripted).abs().max().item()))
+print(" > Inference time torch: {:.3f}s TorchScript: {:.3f}s".format(model_time, scripted_time))
+
+torch.jit.save(scripted_model, args.output_path)
+print(" > Saved the TorchScript model to {}".format(args.output_path))
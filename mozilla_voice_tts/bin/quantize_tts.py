@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Quantize the weights of a Tacotron or Tacotron2 model to int8 for CPU
+inference. Reports the speed-up and the mel distance to the fp32 model on
+a set of sentences and saves the quantized checkpoint."""
+
+import argparse
+import sys
+import time
+
+import torch
+
+from mozilla_voice_tts.tts.utils.generic_utils import setup_model
+from mozilla_voice_tts.tts.utils.quantization import mel_distance, quantize_model
+from mozilla_voice_tts.tts.utils.synthesis import text_to_seqvec
+from mozilla_voice_tts.tts.utils.text.symbols import make_symbols, phonemes, symbols
+from mozilla_voice_tts.utils.io import load_config
+
+SENTENCES = [
+    "It took me quite a long time to develop a voice, and now that I have it I'm not going to be silent.",
+    "Be a voice, not an echo.",
+    "I'm sorry Dave. I'm afraid I can't do that.",
+    "This cake is great. It's so delicious and moist.",
+    "Prior to November 22, 1963.",
+]
+
+
+def time_inference(model, inputs):
+    """Return the seconds per output frame of ``model.inference()``."""
+    start_time = time.time()
+    _, postnet_outputs, _, _ = model.inference(inputs)
+    return (time.time() - start_time) / postnet_outputs.shape[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--config_path', type=str, required=True,
+                        help='TTS config file path.')
+    parser.add_argument('--model_path', type=str, required=True,
+                        help='fp32 model checkpoint path.')
+    parser.add_argument('--out_path', type=str, required=True,
+                        help='path of the quantized checkpoint.')
+    parser.add_argument('--sentences_path', type=str, default=None,
+                        help='text file with one test sentence per line. A fixed set is used if not given.')
+    parser.add_argument('--max_mel_distance', type=float, default=None,
+                        help='do not save the quantized model if its mean mel distance to the fp32 model is larger.')
+    args = parser.parse_args()
+
+    C = load_config(args.config_path)
+    if 'characters' in C.keys():
+        model_symbols, model_phonemes = make_symbols(**C.characters)
+    else:
+        model_symbols, model_phonemes = symbols, phonemes
+    num_chars = len(model_phonemes) if C.use_phonemes else len(model_symbols)
+    model = setup_model(num_chars, 0, C)
+    cp = torch.load(args.model_path, map_location=torch.device('cpu'))
+    assert not cp.get('quantized', False), " [!] The model is already quantized."
+    model.load_state_dict(cp['model'])
+    model.eval()
+    if 'r' in cp:
+        model.decoder.set_r(cp['r'])
+    model.decoder.record_alignments = False
+    quantized_model = quantize_model(model)
+
+    if args.sentences_path is not None:
+        with open(args.sentences_path, 'r') as f:
+            sentences = [line.strip() for line in f if line.strip()]
+    else:
+        sentences = SENTENCES
+
+    distances, speed_ups = [], []
+    for sentence in sentences:
+        inputs = torch.LongTensor(text_to_seqvec(sentence, C)).unsqueeze(0)
+        with torch.no_grad():
+            fp32_time = time_inference(model, inputs)
+            quantized_time = time_inference(quantized_model, inputs)
+        distances.append(mel_distance(model, quantized_model, inputs))
+        speed_ups.append(fp32_time / quantized_time)
+        print(f" > {sentence}\n   | > mel distance: {distances[-1]:.4f}  speed up: {speed_ups[-1]:.2f}x")
+    mean_distance = sum(distances) / len(distances)
+    print(f" > Mean mel distance: {mean_distance:.4f}")
+    print(f" > Mean speed up: {sum(speed_ups) / len(speed_ups):.2f}x")
+
+    if args.max_mel_distance is not None and mean_distance > args.max_mel_distance:
+        print(f" ! Mel distance is above {args.max_mel_distance}. The model is not saved.")
+        sys.exit(1)
+
+    cp['model'] = quantized_model.state_dict()
+    cp['quantized'] = True
+    cp['optimizer'] = None
+    torch.save(cp, args.out_path)
+    print(f" > Quantized model saved to {args.out_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -13,9 +13,11 @@ import torch
 from torch.utils.data import DataLoader
 
 from mozilla_voice_tts.tts.datasets.preprocess import load_meta_data
+from mozilla_voice_tts.tts.datasets.sampler import (BatchGroupSampler,
+                                                    BucketBatchSampler)
 from mozilla_voice_tts.tts.datasets.TTSDataset import MyDataset
 from mozilla_voice_tts.tts.layers.losses import TacotronLoss
-from mozilla_voice_tts.tts.utils.distribute import (DistributedSampler,
+from mozilla_voice_tts.tts.utils.distribute import (BalancedDistributedSampler,
                                                     apply_gradient_allreduce,
                                                     init_distributed,
                                                     reduce_tensor)
@@ -49,40 +51,83 @@ from mozilla_voice_tts.utils.training import (NoamLR, adam_weight_decay,
 use_cuda, num_gpus = setup_torch_training_env(True, False)
 
 
-def setup_loader(ap, r, is_val=False, verbose=False, speaker_mapping=None):
+def setup_dataset(ap, is_val=False, verbose=False, speaker_mapping=None):
     if is_val and not c.run_eval:
-        loader = None
-    else:
-        dataset = MyDataset(
-            r,
-            c.text_cleaner,
-            compute_linear_spec=c.model.lower() == 'tacotron',
-            meta_data=meta_data_eval if is_val else meta_data_train,
-            ap=ap,
-            tp=c.characters if 'characters' in c.keys() else None,
-            batch_group_size=0 if is_val else c.batch_group_size *
-            c.batch_size,
-            min_seq_len=c.min_seq_len,
-            max_seq_len=c.max_seq_len,
-            phoneme_cache_path=c.phoneme_cache_path,
-            use_phonemes=c.use_phonemes,
-            phoneme_language=c.phoneme_language,
-            enable_eos_bos=c.enable_eos_bos_chars,
-            verbose=verbose,
-            speaker_mapping=speaker_mapping if c.use_speaker_embedding and c.use_external_speaker_embedding_file else None)
-        sampler = DistributedSampler(dataset) if num_gpus > 1 else None
+        return None
+    return MyDataset(
+        c.r,
+        c.text_cleaner,
+        compute_linear_spec=c.model.lower() == 'tacotron',
+        meta_data=meta_data_eval if is_val else meta_data_train,
+        ap=ap,
+        tp=c.characters if 'characters' in c.keys() else None,
+        batch_group_size=0 if is_val else c.batch_group_size *
+        c.batch_size,
+        min_seq_len=c.min_seq_len,
+        max_seq_len=c.max_seq_len,
+        phoneme_cache_path=c.phoneme_cache_path,
+        use_phonemes=c.use_phonemes,
+        phoneme_language=c.phoneme_language,
+        enable_eos_bos=c.enable_eos_bos_chars,
+        feature_store_path=c.get('feature_store_path'),
+        verbose=verbose,
+        speaker_mapping=speaker_mapping if c.use_speaker_embedding and c.use_external_speaker_embedding_file else None)
+
+
+def setup_loader(dataset, r, is_val=False):
+    """Create a loader with persistent workers. Its workers hold a copy of
+    the dataset, so create a new loader when ``r`` or the batch size
+    change."""
+    if dataset is None:
+        return None
+    dataset.outputs_per_step = r
+    num_workers = c.num_val_loader_workers if is_val else c.num_loader_workers
+    if not is_val and c.get('batch_max_frames', 0) > 0:
+        # batches of similar mel lengths within a budget of frames
+        batch_sampler = BucketBatchSampler(dataset.compute_mel_lengths(),
+                                           c.batch_max_frames,
+                                           max_batch_size=c.batch_size,
+                                           num_replicas=max(num_gpus, 1),
+                                           rank=args.rank)
         loader = DataLoader(
             dataset,
-            batch_size=c.eval_batch_size if is_val else c.batch_size,
-            shuffle=False,
+            batch_sampler=batch_sampler,
             collate_fn=dataset.collate_fn,
-            drop_last=False,
-            sampler=sampler,
-            num_workers=c.num_val_loader_workers
-            if is_val else c.num_loader_workers,
+            num_workers=num_workers,
+            persistent_workers=num_workers > 0,
             pin_memory=False)
+        return loader
+    if num_gpus > 1:
+        # shuffled every epoch, with items of similar lengths on all the GPUs
+        sampler = BalancedDistributedSampler(dataset.compute_mel_lengths(),
+                                             c.eval_batch_size if is_val else c.batch_size,
+                                             num_replicas=num_gpus,
+                                             rank=args.rank,
+                                             shuffle=not is_val)
+    elif not is_val and c.batch_group_size > 0:
+        # shuffle batch groups every epoch
+        sampler = BatchGroupSampler(len(dataset), c.batch_group_size * c.batch_size)
+    else:
+        sampler = None
+    loader = DataLoader(
+        dataset,
+        batch_size=c.eval_batch_size if is_val else c.batch_size,
+        shuffle=False,
+        collate_fn=dataset.collate_fn,
+        drop_last=False,
+        sampler=sampler,
+        num_workers=num_workers,
+        persistent_workers=num_workers > 0,
+        pin_memory=False)
     return loader
 
+
+def set_loader_epoch(data_loader, epoch):
+    """Set the epoch of the samplers that shuffle every epoch."""
+    for sampler in [data_loader.sampler, data_loader.batch_sampler]:
+        if hasattr(sampler, 'set_epoch'):
+            sampler.set_epoch(epoch)
+
 def format_data(data, speaker_mapping=None):
     if speaker_mapping is None and c.use_speaker_embedding and not c.use_external_speaker_embedding_file:
         speaker_mapping = load_speaker_mapping(OUT_PATH)
@@ -135,23 +180,32 @@ def format_data(data, speaker_mapping=None):
     return text_input, text_lengths, mel_input, mel_lengths, linear_input, stop_targets, speaker_ids, speaker_embeddings, avg_text_length, avg_spec_length
 
 
-def train(model, criterion, optimizer, optimizer_st, scheduler,
+def train(data_loader, model, criterion, optimizer, optimizer_st, scheduler,
           ap, global_step, epoch, amp, speaker_mapping=None):
-    data_loader = setup_loader(ap, model.decoder.r, is_val=False,
-                               verbose=(epoch == 0), speaker_mapping=speaker_mapping)
     model.train()
     epoch_time = 0
     keep_avg = KeepAverage()
-    if use_cuda:
-        batch_n_iter = int(
-            len(data_loader.dataset) / (c.batch_size * num_gpus))
-    else:
-        batch_n_iter = int(len(data_loader.dataset) / c.batch_size)
+    set_loader_epoch(data_loader, epoch)
+    sampler_stats = {}
+    if isinstance(data_loader.batch_sampler, BucketBatchSampler):
+        sampler_stats = data_loader.batch_sampler.stats()
+        print(" | > Bucketed batches: {}, avg. batch size: {:.1f}, padding ratio: {:.3f}".format(
+            sampler_stats['num_batches'], sampler_stats['avg_batch_size'], sampler_stats['padding_ratio']))
+    elif isinstance(data_loader.sampler, BalancedDistributedSampler):
+        sampler_stats = data_loader.sampler.stats()
+    if num_gpus > 1 and 'imbalance' in sampler_stats:
+        # extra work of the slowest GPU per step
+        print(" | > Load imbalance across GPUs: {:.3f}".format(sampler_stats['imbalance']))
+    batch_n_iter = len(data_loader)
     end_time = time.time()
     c_logger.print_train_start()
     for num_iter, data in enumerate(data_loader):
         start_time = time.time()
 
+        # share of the decoder frames spent on padding, from the lengths on
+        # the CPU so that it does not wait for the GPU
+        padding_ratio = 1 - data[5].sum().item() / data[4].shape[:2].numel()
+
         # format data
         text_input, text_lengths, mel_input, mel_lengths, linear_input, stop_targets, speaker_ids, speaker_embeddings, avg_text_length, avg_spec_length = format_data(data, speaker_mapping)
         loader_time = time.time() - end_time
@@ -245,6 +299,7 @@ def train(model, criterion, optimizer, optimizer_st, scheduler,
             update_train_values['avg_' + key] = value
         update_train_values['avg_loader_time'] = loader_time
         update_train_values['avg_step_time'] = step_time
+        update_train_values['avg_padding_ratio'] = padding_ratio
         keep_avg.update_values(update_train_values)
 
         # print training progress
@@ -315,6 +370,8 @@ def train(model, criterion, optimizer, optimizer_st, scheduler,
     if args.rank == 0:
         epoch_stats = {"epoch_time": epoch_time}
         epoch_stats.update(keep_avg.avg_values)
+        if num_gpus > 1 and 'imbalance' in sampler_stats:
+            epoch_stats['load_imbalance'] = sampler_stats['imbalance']
         tb_logger.tb_train_epoch_stats(global_step, epoch_stats)
         if c.tb_model_param_stats:
             tb_logger.tb_model_weights(model, global_step)
@@ -322,8 +379,7 @@ def train(model, criterion, optimizer, optimizer_st, scheduler,
 
 
 @torch.no_grad()
-def evaluate(model, criterion, ap, global_step, epoch, speaker_mapping=None):
-    data_loader = setup_loader(ap, model.decoder.r, is_val=True, speaker_mapping=speaker_mapping)
+def evaluate(data_loader, model, criterion, ap, global_step, epoch, speaker_mapping=None):
     model.eval()
     epoch_time = 0
     keep_avg = KeepAverage()
@@ -610,6 +666,11 @@ def main(args):  # pylint: disable=redefined-outer-name
     if 'best_loss' not in locals():
         best_loss = float('inf')
 
+    # datasets are kept for the whole training
+    train_dataset = setup_dataset(ap, is_val=False, verbose=True, speaker_mapping=speaker_mapping)
+    eval_dataset = setup_dataset(ap, is_val=True, speaker_mapping=speaker_mapping)
+    train_loader, eval_loader, loader_params = None, None, None
+
     global_step = args.restore_step
     for epoch in range(0, c.epochs):
         c_logger.print_epoch_start(epoch, c.epochs)
@@ -621,10 +682,15 @@ def main(args):  # pylint: disable=redefined-outer-name
             if c.bidirectional_decoder:
                 model.decoder_backward.set_r(r)
             print("\n > Number of output frames:", model.decoder.r)
-        train_avg_loss_dict, global_step = train(model, criterion, optimizer,
+        # loaders and their workers are only replaced when r or the batch size change
+        if loader_params != (model.decoder.r, c.batch_size):
+            loader_params = (model.decoder.r, c.batch_size)
+            train_loader = setup_loader(train_dataset, model.decoder.r, is_val=False)
+            eval_loader = setup_loader(eval_dataset, model.decoder.r, is_val=True)
+        train_avg_loss_dict, global_step = train(train_loader, model, criterion, optimizer,
                                                  optimizer_st, scheduler, ap,
                                                  global_step, epoch, amp, speaker_mapping)
-        eval_avg_loss_dict = evaluate(model, criterion, ap, global_step, epoch, speaker_mapping)
+        eval_avg_loss_dict = evaluate(eval_loader, model, criterion, ap, global_step, epoch, speaker_mapping)
         c_logger.print_epoch_end(epoch, eval_avg_loss_dict)
         target_loss = train_avg_loss_dict['avg_postnet_loss']
         if c.run_eval:
@@ -21,7 +21,7 @@ from mozilla_voice_tts.utils.io import copy_config_file, load_config
 from mozilla_voice_tts.utils.radam import RAdam
 from mozilla_voice_tts.utils.tensorboard_logger import TensorboardLogger
 from mozilla_voice_tts.utils.training import setup_torch_training_env
-from mozilla_voice_tts.vocoder.datasets.gan_dataset import GANDataset
+from mozilla_voice_tts.vocoder.datasets.gan_dataset import GANDataset, GANPairSampler
 from mozilla_voice_tts.vocoder.datasets.preprocess import (load_wav_data,
                                                            load_wav_feat_data)
 # from distribute import (DistributedSampler, apply_gradient_allreduce,
@@ -51,15 +51,18 @@ def setup_loader(ap, is_val=False, verbose=False):
                              use_noise_augment=c.use_noise_augment,
                              use_cache=c.use_cache,
                              verbose=verbose)
-        dataset.shuffle_mapping()
         # sampler = DistributedSampler(dataset) if num_gpus > 1 else None
+        num_workers = c.num_val_loader_workers if is_val else c.num_loader_workers
+        # the loader is kept for the whole training, so are its workers and
+        # the feature cache of the dataset. The sampler pairs the G and D
+        # items again every epoch.
         loader = DataLoader(dataset,
                             batch_size=1 if is_val else c.batch_size,
-                            shuffle=True,
+                            shuffle=False,
                             drop_last=False,
-                            sampler=None,
-                            num_workers=c.num_val_loader_workers
-                            if is_val else c.num_loader_workers,
+                            sampler=GANPairSampler(len(dataset)),
+                            num_workers=num_workers,
+                            persistent_workers=num_workers > 0,
                             pin_memory=False)
     return loader
 
@@ -87,18 +90,13 @@ def format_data(data):
     return co, x, None, None
 
 
-def train(model_G, criterion_G, optimizer_G, model_D, criterion_D, optimizer_D,
+def train(data_loader, model_G, criterion_G, optimizer_G, model_D, criterion_D, optimizer_D,
           scheduler_G, scheduler_D, ap, global_step, epoch):
-    data_loader = setup_loader(ap, is_val=False, verbose=(epoch == 0))
     model_G.train()
     model_D.train()
     epoch_time = 0
     keep_avg = KeepAverage()
-    if use_cuda:
-        batch_n_iter = int(
-            len(data_loader.dataset) / (c.batch_size * num_gpus))
-    else:
-        batch_n_iter = int(len(data_loader.dataset) / c.batch_size)
+    batch_n_iter = len(data_loader)
     end_time = time.time()
     c_logger.print_train_start()
     for num_iter, data in enumerate(data_loader):
@@ -301,8 +299,7 @@ def train(model_G, criterion_G, optimizer_G, model_D, criterion_D, optimizer_D,
 
 
 @torch.no_grad()
-def evaluate(model_G, criterion_G, model_D, criterion_D, ap, global_step, epoch):
-    data_loader = setup_loader(ap, is_val=True, verbose=(epoch == 0))
+def evaluate(data_loader, model_G, criterion_G, model_D, criterion_D, ap, global_step):
     model_G.eval()
     model_D.eval()
     epoch_time = 0
@@ -549,15 +546,21 @@ def main(args):  # pylint: disable=redefined-outer-name
     if 'best_loss' not in locals():
         best_loss = float('inf')
 
+    train_loader = setup_loader(ap, is_val=False, verbose=True)
+    eval_loader = setup_loader(ap, is_val=True, verbose=True)
+
     global_step = args.restore_step
     for epoch in range(0, c.epochs):
         c_logger.print_epoch_start(epoch, c.epochs)
-        _, global_step = train(model_gen, criterion_gen, optimizer_gen,
+        for loader in [train_loader, eval_loader]:
+            if loader is not None:
+                loader.sampler.set_epoch(epoch)
+        _, global_step = train(train_loader, model_gen, criterion_gen, optimizer_gen,
                                model_disc, criterion_disc, optimizer_disc,
                                scheduler_gen, scheduler_disc, ap, global_step,
                                epoch)
-        eval_avg_loss_dict = evaluate(model_gen, criterion_gen, model_disc, criterion_disc, ap,
-                                      global_step, epoch)
+        eval_avg_loss_dict = evaluate(eval_loader, model_gen, criterion_gen, model_disc, criterion_disc, ap,
+                                      global_step)
         c_logger.print_epoch_end(epoch, eval_avg_loss_dict)
         target_loss = eval_avg_loss_dict[c.target_loss]
         best_loss = save_best_model(target_loss,
@@ -0,0 +1,167 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+
+class BatchScheduler(object):
+    """Queue sentences from concurrent requests and synthesize them in
+    padded batches.
+
+    A single worker thread pulls pending sentences from the queue. It waits
+    at most ``max_wait_ms`` after the first sentence arrives for more to
+    join, then runs ``synthesize_fn`` on up to ``max_batch_size`` sentences
+    at once. Each caller only gets back the results of its own sentences.
+    Sentences with and without a speaker id are synthesized in separate
+    batches.
+
+    Args:
+        synthesize_fn (callable): takes a list of sentences and a list of
+            speaker ids and returns one waveform per sentence.
+        max_batch_size (int): maximum number of sentences per batch.
+        max_wait_ms (float): maximum time to wait for a batch to fill up.
+    """
+    def __init__(self, synthesize_fn, max_batch_size=8, max_wait_ms=10):
+        assert max_batch_size > 0, " [!] max_batch_size should be a positive number."
+        self.synthesize_fn = synthesize_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = queue.Queue()
+        self._stop = threading.Event()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def submit(self, sentence, speaker_id=None):
+        """Queue a sentence and return a Future for its waveform."""
+        future = Future()
+        self.queue.put((sentence, speaker_id, future))
+        return future
+
+    def synthesize(self, sentences, speaker_id=None):
+        """Queue all the sentences of a request and block until they
+        are synthesized. Waveforms are returned in input order."""
+        futures = [self.submit(sen, speaker_id) for sen in sentences]
+        return [future.result() for future in futures]
+
+    def close(self):
+        self._stop.set()
+        self.worker.join()
+
+    def _collect_batch(self):
+        try:
+            batch = [self.queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    @staticmethod
+    def _split_batch(batch):
+        """Split a batch into the sentences with and without a speaker id,
+        since a model batch either has speaker ids for all of them or none."""
+        with_speaker = [item for item in batch if item[1] is not None]
+        without_speaker = [item for item in batch if item[1] is None]
+        return [group for group in [without_speaker, with_speaker] if group]
+
+    def _collect_batches(self):
+        return self._split_batch(self._collect_batch())
+
+    def _run(self):
+        while not self._stop.is_set():
+            for batch in self._collect_batches():
+                sentences, speaker_ids, futures = zip(*batch)
+                try:
+                    wavs = self.synthesize_fn(list(sentences), list(speaker_ids))
+                except Exception as e:  # pylint: disable=broad-except
+                    for future in futures:
+                        future.set_exception(e)
+                    continue
+                for future, wav in zip(futures, wavs):
+                    future.set_result(wav)
+
+
+class PipelineScheduler(BatchScheduler):
+    """BatchScheduler that runs the acoustic model and the vocoder as two
+    pipeline stages on separate threads.
+
+    The acoustic stage passes its outputs to the vocoder stage through a
+    queue of at most ``queue_size`` batches, so it can decode the next
+    sentences, of the same or of other requests, while the previous ones
+    are vocoded. Each stage can be given its own number of torch intra-op
+    threads. Note that the thread settings are only per stage with the
+    OpenMP backend of torch, otherwise the last setting applies to both.
+
+    Args:
+        acoustic_fn (callable): takes a list of sentences and a list of
+            speaker ids and returns one acoustic model output per sentence.
+        vocoder_fn (callable): takes a list of acoustic model outputs and
+            returns one waveform per output.
+        max_batch_size (int): maximum number of sentences per batch.
+        max_wait_ms (float): maximum time to wait for a batch to fill up.
+        queue_size (int): maximum number of batches waiting for the vocoder.
+        acoustic_threads (int): intra-op threads of the acoustic stage.
+            None keeps the default.
+        vocoder_threads (int): intra-op threads of the vocoder stage.
+            None keeps the default.
+    """
+    def __init__(self, acoustic_fn, vocoder_fn, max_batch_size=1, max_wait_ms=0,
+                 queue_size=2, acoustic_threads=None, vocoder_threads=None):
+        self.acoustic_fn = acoustic_fn
+        self.vocoder_fn = vocoder_fn
+        self.acoustic_threads = acoustic_threads
+        self.vocoder_threads = vocoder_threads
+        self.stage_queue = queue.Queue(maxsize=queue_size)
+        super(PipelineScheduler, self).__init__(None, max_batch_size, max_wait_ms)
+        self.vocoder_worker = threading.Thread(target=self._run_vocoder, daemon=True)
+        self.vocoder_worker.start()
+
+    def close(self):
+        super(PipelineScheduler, self).close()
+        self.vocoder_worker.join()
+
+    def _run(self):
+        if self.acoustic_threads is not None:
+            torch.set_num_threads(self.acoustic_threads)
+        while not self._stop.is_set():
+            for batch in self._collect_batches():
+                sentences, speaker_ids, futures = zip(*batch)
+                try:
+                    outputs = self.acoustic_fn(list(sentences), list(speaker_ids))
+                except Exception as e:  # pylint: disable=broad-except
+                    for future in futures:
+                        future.set_exception(e)
+                    continue
+                # blocks while the vocoder is behind
+                while not self._stop.is_set():
+                    try:
+                        self.stage_queue.put((outputs, futures), timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+
+    def _run_vocoder(self):
+        if self.vocoder_threads is not None:
+            torch.set_num_threads(self.vocoder_threads)
+        while not (self._stop.is_set() and self.stage_queue.empty()):
+            try:
+                outputs, futures = self.stage_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            try:
+                wavs = self.vocoder_fn(outputs)
+            except Exception as e:  # pylint: disable=broad-except
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, wav in zip(futures, wavs):
+                future.set_result(wav)
@@ -0,0 +1,268 @@
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+class _Metric(object):
+    metric_type = None
+
+    def __init__(self, name, documentation, label_name=None):
+        self.name = name
+        self.documentation = documentation
+        self.label_name = label_name
+        self.lock = threading.Lock()
+
+    def _labels(self, label):
+        if self.label_name is None:
+            return []
+        return [(self.label_name, label)]
+
+    def state(self):
+        """Return the values of the metric as a json serializable list of
+        [label, values] pairs."""
+        raise NotImplementedError
+
+    def merge_states(self, states):
+        """Return the sum of the states of several processes."""
+        raise NotImplementedError
+
+    def samples(self, state=None):
+        """Return a list of (name, labels, value) samples of ``state``,
+        by default the current state."""
+        raise NotImplementedError
+
+    def expose(self, state=None):
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} {self.metric_type}']
+        for name, labels, value in self.samples(state):
+            lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing value, optionally one per label value.
+    If ``value_fn`` is given, the value is read from it at export time."""
+    metric_type = 'counter'
+
+    def __init__(self, name, documentation, label_name=None, value_fn=None):
+        super(Counter, self).__init__(name, documentation, label_name)
+        self.values = {}
+        self.value_fn = value_fn
+
+    def inc(self, amount=1, label=None):
+        with self.lock:
+            self.values[label] = self.values.get(label, 0) + amount
+
+    def state(self):
+        if self.value_fn is not None:
+            return [[None, self.value_fn()]]
+        with self.lock:
+            return [[label, value] for label, value in self.values.items()]
+
+    def merge_states(self, states):
+        values = {}
+        for state in states:
+            for label, value in state:
+                values[label] = values.get(label, 0) + value
+        return [[label, value] for label, value in values.items()]
+
+    def samples(self, state=None):
+        state = self.state() if state is None else state
+        return [(self.name, self._labels(label), value) for label, value in state]
+
+
+class Gauge(Counter):
+    """Value that can go up and down."""
+    metric_type = 'gauge'
+
+    def dec(self, amount=1, label=None):
+        self.inc(-amount, label)
+
+    def set(self, value, label=None):
+        with self.lock:
+            self.values[label] = value
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets, optionally
+    one per label value."""
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, label_name=None, buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, label_name)
+        self.buckets = sorted(buckets)
+        self.values = {}
+
+    def observe(self, value, label=None):
+        with self.lock:
+            if label not in self.values:
+                self.values[label] = {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            values = self.values[label]
+            values['buckets'][bisect.bisect_left(self.buckets, value)] += 1
+            values['sum'] += value
+            values['count'] += 1
+
+    @contextmanager
+    def time(self, label=None):
+        start = time.time()
+        yield
+        self.observe(time.time() - start, label)
+
+    def state(self):
+        with self.lock:
+            return [[label, {'buckets': list(values['buckets']), 'sum': values['sum'], 'count': values['count']}]
+                    for label, values in self.values.items()]
+
+    def merge_states(self, states):
+        merged = {}
+        for state in states:
+            for label, values in state:
+                if label not in merged:
+                    merged[label] = {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+                merged[label]['buckets'] = [a + b for a, b in zip(merged[label]['buckets'], values['buckets'])]
+                merged[label]['sum'] += values['sum']
+                merged[label]['count'] += values['count']
+        return [[label, values] for label, values in merged.items()]
+
+    def samples(self, state=None):
+        samples = []
+        for label, values in self.state() if state is None else state:
+            labels = self._labels(label)
+            count = 0
+            for upper_bound, bucket_count in zip(self.buckets + [float('inf')], values['buckets']):
+                count += bucket_count
+                samples.append((self.name + '_bucket', labels + [('le', _format_value(upper_bound))], count))
+            samples.append((self.name + '_sum', labels, values['sum']))
+            samples.append((self.name + '_count', labels, values['count']))
+        return samples
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MetricsRegistry(object):
+    """Collection of metrics that are exported together in the Prometheus
+    text format.
+
+    Processes that serve the same app, e.g. pre-forked workers, can share
+    their metrics through a folder with ``share()``. Each of them then
+    exports the sum over all of them."""
+    def __init__(self):
+        self.metrics = []
+        self.shared_dir = None
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def snapshot(self):
+        return {metric.name: metric.state() for metric in self.metrics}
+
+    def share(self, shared_dir, interval=1.0):
+        """Write the metrics of this process to ``shared_dir`` every
+        ``interval`` seconds and export the sum of the metrics of all the
+        processes writing there. The metrics of the other processes are up
+        to ``interval`` seconds old. Counters and histograms of processes
+        that exited are kept, so they do not go down when a worker is
+        restarted, and their gauges are dropped."""
+        self.shared_dir = shared_dir
+        self.write_snapshot()
+
+        def _write_loop():
+            while True:
+                time.sleep(interval)
+                self.write_snapshot()
+
+        threading.Thread(target=_write_loop, daemon=True).start()
+
+    def write_snapshot(self):
+        path = os.path.join(self.shared_dir, f'{os.getpid()}.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+    def read_snapshots(self):
+        """Return the last snapshots of the other processes sharing the
+        metrics and whether each process is still running."""
+        snapshots = []
+        for file_name in os.listdir(self.shared_dir):
+            if not file_name.endswith('.json') or file_name == f'{os.getpid()}.json':
+                continue
+            try:
+                with open(os.path.join(self.shared_dir, file_name), 'r') as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            snapshots.append((snapshot, _is_running(int(file_name[:-len('.json')]))))
+        return snapshots
+
+    def expose(self):
+        snapshots = self.read_snapshots() if self.shared_dir is not None else []
+        lines = []
+        for metric in self.metrics:
+            states = [metric.state()]
+            states += [snapshot[metric.name] for snapshot, is_running in snapshots
+                       if metric.name in snapshot and (is_running or metric.metric_type != 'gauge')]
+            lines += metric.expose(metric.merge_states(states) if len(states) > 1 else states[0])
+        return '\n'.join(lines) + '\n'
+
+
+# objects with a timed method running, per thread
+_timed_objects = threading.local()
+
+
+def time_method(obj, method_name, timer_fn):
+    """Time every call of ``obj.method_name`` in the context returned by
+    ``timer_fn()``. Nested calls, e.g. a timed method calling another timed
+    method of the same object, are only timed once."""
+    method = getattr(obj, method_name)
+
+    @functools.wraps(method)
+    def _timed(*args, **kwargs):
+        if not hasattr(_timed_objects, 'ids'):
+            _timed_objects.ids = set()
+        if id(obj) in _timed_objects.ids:
+            return method(*args, **kwargs)
+        _timed_objects.ids.add(id(obj))
+        try:
+            with timer_fn():
+                return method(*args, **kwargs)
+        finally:
+            _timed_objects.ids.discard(id(obj))
+
+    setattr(obj, method_name, _timed)
@@ -0,0 +1,99 @@
+import os
+import signal
+import socket
+
+import torch
+from werkzeug.serving import make_server
+
+
+class PreforkServer(object):
+    """Serve a WSGI app from several forked worker processes that share a
+    listening socket.
+
+    Everything loaded before ``start()``, e.g. the model weights of a
+    ``Synthesizer``, is shared by the workers through fork copy-on-write
+    instead of being loaded once per worker. Call ``share_memory()`` on the
+    models beforehand to keep their weights in shared memory for good.
+    Each worker runs its own decoder loops, so throughput scales with the
+    number of workers while intra-op parallelism is limited to
+    ``num_threads`` per worker.
+
+    Args:
+        app: WSGI app to serve.
+        host (str): host to listen on.
+        port (int): port to listen on. 0 picks a free port.
+        num_workers (int): number of worker processes.
+        num_threads (int): torch intra-op threads per worker.
+        post_fork_fn (callable): called in each worker after it is forked,
+            e.g. to restart background threads, which do not survive fork.
+    """
+    def __init__(self, app, host, port, num_workers, num_threads=1, post_fork_fn=None):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.num_workers = num_workers
+        self.num_threads = num_threads
+        self.post_fork_fn = post_fork_fn
+        self.socket = None
+        self.worker_pids = []
+
+    def start(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(128)
+        self.port = self.socket.getsockname()[1]
+        print(f" > Serving on {self.host}:{self.port} with {self.num_workers} workers"
+              f" of {self.num_threads} threads each.")
+        for _ in range(self.num_workers):
+            self.worker_pids.append(self._spawn_worker())
+
+    def _spawn_worker(self):
+        pid = os.fork()
+        if pid != 0:
+            return pid
+        # worker process
+        exit_code = 0
+        try:
+            signal.signal(signal.SIGTERM, lambda *_: os._exit(0))
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            torch.set_num_threads(self.num_threads)
+            if self.post_fork_fn is not None:
+                self.post_fork_fn()
+            server = make_server(self.host, self.port, self.app, threaded=True, fd=self.socket.fileno())
+            server.serve_forever()
+        except Exception as e:  # pylint: disable=broad-except
+            print(f" ! Worker {os.getpid()} failed: {e}")
+            exit_code = 1
+        os._exit(exit_code)
+
+    def wait(self):
+        """Wait for the workers, restarting the ones that die, until the
+        server is interrupted."""
+        signal.signal(signal.SIGTERM, lambda *_: self.stop())
+        try:
+            while self.worker_pids:
+                pid, _ = os.wait()
+                if pid in self.worker_pids:
+                    print(f" ! Worker {pid} exited. Restarting it.")
+                    self.worker_pids[self.worker_pids.index(pid)] = self._spawn_worker()
+        except (KeyboardInterrupt, ChildProcessError):
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        worker_pids, self.worker_pids = self.worker_pids, []
+        for pid in worker_pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in worker_pids:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
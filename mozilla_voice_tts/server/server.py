@@ -1,8 +1,12 @@
 #!flask/bin/python
 import argparse
 import os
+import shutil
+import tempfile
 
-from flask import Flask, request, render_template, send_file
+import torch
+from flask import Flask, Response, jsonify, request, render_template, send_file, stream_with_context
+from mozilla_voice_tts.server.prefork import PreforkServer
 from mozilla_voice_tts.server.synthesizer import Synthesizer
 
 
@@ -20,6 +24,24 @@ def create_argparser():
     parser.add_argument('--is_wavernn_batched', type=convert_boolean, default=False, help='true to use batched WaveRNN.')
     parser.add_argument('--vocoder_config', type=str, default=None, help='path to mozilla_voice_tts.vocoder config file.')
     parser.add_argument('--vocoder_checkpoint', type=str, default=None, help='path to mozilla_voice_tts.vocoder checkpoint file.')
+    parser.add_argument('--max_batch_size', type=int, default=1, help='maximum number of sentences synthesized together across concurrent requests. 1 disables batching.')
+    parser.add_argument('--max_batch_wait_ms', type=float, default=10, help='maximum time in milliseconds to wait for a batch to fill up.')
+    parser.add_argument('--use_pipeline', type=convert_boolean, default=False, help='true to run the TTS model and the vocoder in parallel threads, so that sentences overlap across the two stages.')
+    parser.add_argument('--pipeline_queue_size', type=int, default=2, help='maximum number of batches waiting for the vocoder in pipeline mode.')
+    parser.add_argument('--acoustic_threads', type=int, default=None, help='torch intra-op threads of the TTS model in pipeline mode.')
+    parser.add_argument('--vocoder_threads', type=int, default=None, help='torch intra-op threads of the vocoder in pipeline mode.')
+    parser.add_argument('--quantize_tts', type=convert_boolean, default=False, help='quantize the weights of the TTS model to int8 for faster CPU inference.')
+    parser.add_argument('--attention_window', type=int, default=0, help='number of encoder steps the attention looks at around the alignment peak. Keeps the decoder step cost constant for long sentences. 0 attends to the whole sentence.')
+    parser.add_argument('--vocoder_chunk_size', type=int, default=0, help='number of frames the vocoder processes at once. Bounds the vocoder memory for long sentences. 0 processes whole sentences.')
+    parser.add_argument('--stream_chunk_size', type=int, default=0, help='number of frames per chunk when streaming with a MelGAN vocoder. 0 streams whole sentences.')
+    parser.add_argument('--cache_size', type=int, default=0, help='number of synthesized requests cached in memory. 0 disables the memory cache.')
+    parser.add_argument('--cache_dir', type=str, default=None, help='folder to cache synthesized requests on disk. Disabled if not set.')
+    parser.add_argument('--cache_max_disk_mb', type=int, default=1024, help='maximum size of the disk cache in MB.')
+    parser.add_argument('--encoder_cache_mb', type=int, default=0, help='memory in MB for the encoder outputs of repeated sentences. 0 disables the encoder cache.')
+    parser.add_argument('--style_wav', type=str, default=None, help='reference wav of the speaking style of GST models. Defaults to gst_style_input of the TTS config.')
+    parser.add_argument('--style_cache_size', type=int, default=0, help='number of style wavs whose mel spectrogram and GST embedding are cached. 0 disables the style cache.')
+    parser.add_argument('--workers', type=int, default=1, help='number of pre-forked worker processes sharing the model weights. 1 serves from a single process.')
+    parser.add_argument('--threads_per_worker', type=int, default=None, help='torch intra-op threads per worker process. Defaults to the number of cores divided by the number of workers.')
     parser.add_argument('--port', type=int, default=5002, help='port to listen on.')
     parser.add_argument('--use_cuda', type=convert_boolean, default=False, help='true to use CUDA.')
     parser.add_argument('--debug', type=convert_boolean, default=False, help='true to enable Flask debug mode.')
@@ -61,6 +83,11 @@ if not args.wavernn_checkpoint and os.path.isfile(wavernn_checkpoint_file):
 if not args.wavernn_config and os.path.isfile(wavernn_config_file):
     args.wavernn_config = wavernn_config_file
 
+if args.workers > 1:
+    assert not args.use_cuda, " [!] Pre-fork serving is only supported on CPU."
+    # keep the parent process from starting intra-op threads, which are not fork safe
+    torch.set_num_threads(1)
+
 synthesizer = Synthesizer(args)
 
 app = Flask(__name__)
@@ -78,8 +105,46 @@ def tts():
     return send_file(data, mimetype='audio/wav')
 
 
+@app.route('/api/tts/stream', methods=['GET'])
+def tts_stream():
+    text = request.args.get('text')
+    print(" > Model input: {}".format(text))
+    return Response(stream_with_context(synthesizer.tts_stream(text)), mimetype='audio/wav')
+
+
+@app.route('/api/cache', methods=['GET'])
+def cache_stats():
+    if synthesizer.cache is None:
+        return jsonify({})
+    return jsonify(synthesizer.cache.stats())
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(synthesizer.metrics.expose(), mimetype='text/plain; version=0.0.4')
+
+
 def main():
-    app.run(debug=args.debug, host='0.0.0.0', port=args.port)
+    if args.workers > 1:
+        # load the weights once and share them with all the workers
+        synthesizer.share_memory()
+        num_threads = args.threads_per_worker or max(1, os.cpu_count() // args.workers)
+        # every worker serves the metrics of all the workers
+        metrics_dir = tempfile.mkdtemp(prefix='tts_metrics_')
+
+        def _post_fork():
+            synthesizer.init_batch_scheduler()
+            synthesizer.metrics.share(metrics_dir)
+
+        server = PreforkServer(app, '0.0.0.0', args.port, args.workers, num_threads,
+                               post_fork_fn=_post_fork)
+        server.start()
+        try:
+            server.wait()
+        finally:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+    else:
+        app.run(debug=args.debug, host='0.0.0.0', port=args.port)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+def normalize_text(text):
+    """Normalize the text used in cache keys. Only changes that do not
+    affect the synthesized audio are made: unicode normalization and
+    collapsing whitespace."""
+    text = unicodedata.normalize('NFC', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def file_hash(path, block_size=2**20):
+    """Return the sha1 digest of a file, or None if there is no file."""
+    if path is None:
+        return None
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class SynthesisCache(object):
+    """Two tier cache of synthesized audio.
+
+    Results are kept in an in-memory LRU of ``max_items`` entries and, if
+    ``cache_dir`` is given, in files on disk. The oldest files are removed
+    once they take up more than ``max_disk_bytes``. The disk tier survives
+    restarts and can be shared between server processes.
+
+    Concurrent requests for the same key are merged, so only one of them
+    runs the synthesis and the others wait for its result.
+
+    Args:
+        max_items (int): maximum number of results kept in memory.
+        cache_dir (str): folder of the disk tier. None disables it.
+        max_disk_bytes (int): maximum size of the disk tier.
+    """
+    def __init__(self, max_items=128, cache_dir=None, max_disk_bytes=2**30):
+        self.max_items = max_items
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = OrderedDict()
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.disk_bytes = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.disk_bytes = sum(os.path.getsize(path) for path in self._disk_files())
+
+    @staticmethod
+    def make_key(text, model_id, speaker_id=None, style=None):
+        """Build a cache key from the normalized text, the identity of the
+        models and the speaker and style conditioning."""
+        key = json.dumps({'text': normalize_text(text),
+                          'model': model_id,
+                          'speaker': speaker_id,
+                          'style': style}, sort_keys=True)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def get_or_compute(self, key, compute_fn):
+        """Return the cached bytes of ``key``, or compute them with
+        ``compute_fn`` and store them."""
+        with self.lock:
+            if key in self.memory:
+                self.memory_hits += 1
+                self.memory.move_to_end(key)
+                return self.memory[key]
+            future = self.in_flight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self.in_flight[key] = future
+            else:
+                self.coalesced += 1
+        if not is_owner:
+            return future.result()
+
+        try:
+            value = self._disk_get(key)
+            if value is None:
+                with self.lock:
+                    self.misses += 1
+                value = compute_fn()
+                self._disk_put(key, value)
+            else:
+                with self.lock:
+                    self.disk_hits += 1
+            self._memory_put(key, value)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+    def stats(self):
+        with self.lock:
+            return {'memory_hits': self.memory_hits,
+                    'disk_hits': self.disk_hits,
+                    'misses': self.misses,
+                    'coalesced': self.coalesced,
+                    'memory_items': len(self.memory),
+                    'disk_bytes': self.disk_bytes}
+
+    def _memory_put(self, key, value):
+        if self.max_items <= 0:
+            return
+        with self.lock:
+            self.memory[key] = value
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_items:
+                self.memory.popitem(last=False)
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key + '.wav')
+
+    def _disk_files(self):
+        return [os.path.join(self.cache_dir, file_name)
+                for file_name in os.listdir(self.cache_dir) if file_name.endswith('.wav')]
+
+    def _disk_get(self, key):
+        if self.cache_dir is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+            # refresh the modification time used for eviction
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return value
+
+    def _disk_put(self, key, value):
+        if self.cache_dir is None or len(value) > self.max_disk_bytes:
+            return
+        # write to a temporary file first so readers never see partial files
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(value)
+        os.replace(tmp_path, self._disk_path(key))
+        with self.lock:
+            self.disk_bytes += len(value)
+            if self.disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        """Remove the least recently used files until the disk tier fits
+        into ``max_disk_bytes``."""
+        files = []
+        for path in self._disk_files():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+        self.disk_bytes = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if self.disk_bytes <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.disk_bytes -= size
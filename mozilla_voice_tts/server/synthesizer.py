@@ -1,21 +1,32 @@
 import io
+import struct
 import sys
 import time
+from contextlib import contextmanager
 
 import numpy as np
 import torch
 import pysbd
 
+from mozilla_voice_tts.server.batch_scheduler import BatchScheduler, PipelineScheduler
+from mozilla_voice_tts.server.metrics import MetricsRegistry, time_method
+from mozilla_voice_tts.server.synthesis_cache import SynthesisCache, file_hash
 from mozilla_voice_tts.utils.audio import AudioProcessor
 from mozilla_voice_tts.utils.io import load_config
+from mozilla_voice_tts.tts.layers.common_layers import OriginalAttention
 from mozilla_voice_tts.tts.utils.generic_utils import setup_model
+from mozilla_voice_tts.tts.utils.io import load_state
+from mozilla_voice_tts.tts.utils.encoder_cache import EncoderCache
+from mozilla_voice_tts.tts.utils.quantization import quantize_model
 from mozilla_voice_tts.tts.utils.speakers import load_speaker_mapping
+from mozilla_voice_tts.tts.utils.style_cache import StyleCache
 from mozilla_voice_tts.vocoder.utils.generic_utils import setup_generator
+from mozilla_voice_tts.vocoder.utils.torchscript import is_torchscript
 # pylint: disable=unused-wildcard-import
 # pylint: disable=wildcard-import
 from mozilla_voice_tts.tts.utils.synthesis import *
 
-from mozilla_voice_tts.tts.utils.text import make_symbols, phonemes, symbols
+from mozilla_voice_tts.tts.utils.text import make_symbols, phonemes, symbols, _clean_text
 
 
 class Synthesizer(object):
@@ -28,6 +39,7 @@ class Synthesizer(object):
         self.use_cuda = self.config.use_cuda
         if self.use_cuda:
             assert torch.cuda.is_available(), "CUDA is not availabe on this machine."
+        self.setup_metrics()
         self.load_tts(self.config.tts_checkpoint, self.config.tts_config,
                       self.config.use_cuda)
         if self.config.vocoder_checkpoint:
@@ -35,6 +47,96 @@ class Synthesizer(object):
         if self.config.wavernn_lib_path:
             self.load_wavernn(self.config.wavernn_lib_path, self.config.wavernn_checkpoint,
                               self.config.wavernn_config, self.config.use_cuda)
+        self.batch_scheduler = None
+        self.init_batch_scheduler()
+        # cache synthesized audio of repeated requests
+        self.cache = None
+        cache_size = getattr(self.config, 'cache_size', 0)
+        cache_dir = getattr(self.config, 'cache_dir', None)
+        if cache_size > 0 or cache_dir is not None:
+            self.cache = SynthesisCache(max_items=cache_size,
+                                        cache_dir=cache_dir,
+                                        max_disk_bytes=getattr(self.config, 'cache_max_disk_mb', 1024) * 2**20)
+            self.model_id = self.get_model_id()
+            self.metrics.counter('tts_cache_memory_hits_total', 'Requests served from the memory cache.',
+                                 value_fn=lambda: self.cache.stats()['memory_hits'])
+            self.metrics.counter('tts_cache_disk_hits_total', 'Requests served from the disk cache.',
+                                 value_fn=lambda: self.cache.stats()['disk_hits'])
+            self.metrics.counter('tts_cache_misses_total', 'Requests not found in the cache.',
+                                 value_fn=lambda: self.cache.stats()['misses'])
+            self.metrics.counter('tts_cache_coalesced_total', 'Requests merged with an identical running request.',
+                                 value_fn=lambda: self.cache.stats()['coalesced'])
+
+    def init_batch_scheduler(self):
+        """Start the scheduler that batches sentences across concurrent
+        requests, or pipelines the acoustic model and the vocoder. Needs to
+        be called again in forked processes since the scheduler threads do
+        not survive fork."""
+        max_batch_size = getattr(self.config, 'max_batch_size', 1)
+        if getattr(self.config, 'use_pipeline', False):
+            self.batch_scheduler = PipelineScheduler(self._acoustic_stage,
+                                                     self._vocoder_stage,
+                                                     max_batch_size=max_batch_size,
+                                                     max_wait_ms=getattr(self.config, 'max_batch_wait_ms', 10),
+                                                     queue_size=getattr(self.config, 'pipeline_queue_size', 2),
+                                                     acoustic_threads=getattr(self.config, 'acoustic_threads', None),
+                                                     vocoder_threads=getattr(self.config, 'vocoder_threads', None))
+        elif max_batch_size > 1:
+            self.batch_scheduler = BatchScheduler(self.tts_batch,
+                                                  max_batch_size=max_batch_size,
+                                                  max_wait_ms=getattr(self.config, 'max_batch_wait_ms', 10))
+
+    def share_memory(self):
+        """Move the model weights to shared memory, so that forked worker
+        processes use the same weights instead of copying them."""
+        for model in [self.tts_model, self.vocoder_model, self.wavernn]:
+            if model is not None:
+                model.share_memory()
+
+    def setup_metrics(self):
+        """Define the metrics served at /metrics."""
+        self.metrics = MetricsRegistry()
+        self.stage_duration = self.metrics.histogram(
+            'tts_stage_duration_seconds', 'Time spent in each synthesis stage.', label_name='stage')
+        self.request_duration = self.metrics.histogram(
+            'tts_request_duration_seconds', 'Time to synthesize a request.')
+        self.real_time_factor = self.metrics.histogram(
+            'tts_real_time_factor', 'Processing time divided by the audio duration of a request.',
+            buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+        self.decoder_steps = self.metrics.histogram(
+            'tts_decoder_steps', 'Decoder steps per sentence.',
+            buckets=(10, 25, 50, 100, 250, 500, 1000, 2000, 3000))
+        self.decoder_steps_total = self.metrics.counter(
+            'tts_decoder_steps_total', 'Decoder steps run.')
+        self.requests_total = self.metrics.counter(
+            'tts_requests_total', 'Synthesis requests received.')
+        self.audio_seconds_total = self.metrics.counter(
+            'tts_audio_seconds_total', 'Seconds of audio synthesized.')
+        self.requests_in_progress = self.metrics.gauge(
+            'tts_requests_in_progress', 'Synthesis requests currently running.')
+        self.metrics.gauge(
+            'tts_batch_queue_depth', 'Sentences waiting for the batch scheduler.',
+            value_fn=lambda: self.batch_scheduler.queue.qsize() if self.batch_scheduler is not None else 0)
+
+    @contextmanager
+    def time_stage(self, stage):
+        """Record the time spent in the given synthesis stage."""
+        start_time = time.time()
+        yield
+        if self.use_cuda:
+            # wait for the queued kernels to finish
+            torch.cuda.synchronize()
+        self.stage_duration.observe(time.time() - start_time, stage)
+
+    def _instrument_tts_model(self):
+        """Time the encoder, decoder and postnet of the TTS model."""
+        stages = [('encoder', self.tts_model.encoder, ['forward', 'inference']),
+                  ('decoder', self.tts_model.decoder, ['forward', 'inference', 'inference_batch']),
+                  ('postnet', self.tts_model.postnet, ['forward'])]
+        for stage, module, method_names in stages:
+            for method_name in method_names:
+                if hasattr(module, method_name):
+                    time_method(module, method_name, lambda stage=stage: self.time_stage(stage))
 
     @staticmethod
     def get_segmenter(lang):
@@ -67,24 +169,65 @@ class Synthesizer(object):
             num_speakers = 0
         self.tts_model = setup_model(self.input_size, num_speakers=num_speakers, c=self.tts_config)
         # load model state
-        cp = torch.load(tts_checkpoint, map_location=torch.device('cpu'))
+        cp = load_state(tts_checkpoint)
+        quantized = cp.get('quantized', False)
+        if quantized:
+            # quantized checkpoints need the layers of a quantized model
+            self.tts_model = quantize_model(self.tts_model)
         # load the model
         self.tts_model.load_state_dict(cp['model'])
+        if not quantized and getattr(self.config, 'quantize_tts', False):
+            self.tts_model = quantize_model(self.tts_model)
+            quantized = True
+        if quantized:
+            assert not use_cuda, " [!] Quantized models run on CPU only."
+            print(" > TTS model weights are quantized to int8.")
+        else:
+            # fold batch norms and remove dropout for inference
+            self.tts_model.freeze()
         if use_cuda:
             self.tts_model.cuda()
         self.tts_model.eval()
         self.tts_model.decoder.max_decoder_steps = 3000
+        # alignments are not used for serving
+        self.tts_model.decoder.record_alignments = False
         if 'r' in cp:
             self.tts_model.decoder.set_r(cp['r'])
             print(f" > model reduction factor: {cp['r']}")
+        attention_window = getattr(self.config, 'attention_window', 0)
+        if attention_window > 0 and isinstance(self.tts_model.decoder.attention, OriginalAttention):
+            # the window reaches further ahead of the alignment peak than behind it
+            self.tts_model.decoder.attention.set_local_window(
+                attention_window // 4, attention_window - attention_window // 4)
+            print(f" > local attention window: {attention_window}")
+        encoder_cache_mb = getattr(self.config, 'encoder_cache_mb', 0)
+        if encoder_cache_mb > 0:
+            # reuse the encoder outputs of repeated sentences
+            self.tts_model.encoder_cache = EncoderCache(max_bytes=encoder_cache_mb * 2**20)
+            self.metrics.counter('tts_encoder_cache_hits_total', 'Sentences whose encoder outputs were cached.',
+                                 value_fn=lambda: self.tts_model.encoder_cache.stats()['hits'])
+            self.metrics.counter('tts_encoder_cache_misses_total', 'Sentences whose encoder outputs were not cached.',
+                                 value_fn=lambda: self.tts_model.encoder_cache.stats()['misses'])
+        style_cache_size = getattr(self.config, 'style_cache_size', 0)
+        if style_cache_size > 0:
+            # reuse the mel spectrograms of style wavs and the GST embeddings
+            self.tts_model.style_cache = StyleCache(max_items=style_cache_size)
+            self.metrics.counter('tts_style_cache_hits_total', 'Style inputs whose GST embedding was cached.',
+                                 value_fn=lambda: self.tts_model.style_cache.stats()['hits'])
+            self.metrics.counter('tts_style_cache_misses_total', 'Style inputs whose GST embedding was not cached.',
+                                 value_fn=lambda: self.tts_model.style_cache.stats()['misses'])
+        self._instrument_tts_model()
 
     def load_vocoder(self, model_file, model_config, use_cuda):
+        if is_torchscript(model_file):
+            # exported by bin/convert_melgan_torchscript.py, no model code or config needed
+            self.vocoder_model = torch.jit.load(model_file, map_location="cuda" if use_cuda else "cpu")
+            self.vocoder_config = load_config(model_config) if model_config else None
+            return
         self.vocoder_config = load_config(model_config)
         self.vocoder_model = setup_generator(self.vocoder_config)
         self.vocoder_model.load_state_dict(torch.load(model_file, map_location="cpu")["model"])
         self.vocoder_model.remove_weight_norm()
-        self.vocoder_model.inference_padding = 0
-        self.vocoder_config = load_config(model_config)
 
         if use_cuda:
             self.vocoder_model.cuda()
@@ -132,62 +275,317 @@ class Synthesizer(object):
     def split_into_sentences(self, text):
         return self.seg.segment(text)
 
-    def tts(self, text, speaker_id=None):
-        start_time = time.time()
-        wavs = []
-        sens = self.split_into_sentences(text)
-        print(sens)
-        speaker_id = id_to_torch(speaker_id)
-        if speaker_id is not None and self.use_cuda:
-            speaker_id = speaker_id.cuda()
-
-        for sen in sens:
-            # preprocess the given text
-            inputs = text_to_seqvec(sen, self.tts_config)
-            inputs = numpy_to_torch(inputs, torch.long, cuda=self.use_cuda)
-            inputs = inputs.unsqueeze(0)
-            # synthesize voice
-            _, postnet_output, _, _ = run_model_torch(self.tts_model, inputs, self.tts_config, False, speaker_id, None)
-            if self.vocoder_model:
-                # use native vocoder model
-                vocoder_input = postnet_output[0].transpose(0, 1).unsqueeze(0)
-                wav = self.vocoder_model.inference(vocoder_input)
-                if self.use_cuda:
-                    wav = wav.cpu().numpy()
-                else:
-                    wav = wav.numpy()
-                wav = wav.flatten()
-            elif self.wavernn:
-                # use 3rd paty wavernn
+    def _text_to_seq(self, sentence):
+        """Convert a sentence to model input ids. Text cleaning and
+        phonemization are timed separately."""
+        if not self.use_phonemes:
+            with self.time_stage('text_cleaning'):
+                return text_to_seqvec(sentence, self.tts_config)
+        with self.time_stage('text_cleaning'):
+            clean_text = _clean_text(sentence, [self.tts_config.text_cleaner])
+        with self.time_stage('phonemization'):
+            # the text is already cleaned
+            return np.asarray(
+                phoneme_to_sequence(clean_text, [], self.tts_config.phoneme_language,
+                                    self.tts_config.enable_eos_bos_chars,
+                                    tp=self.tts_config.characters if 'characters' in self.tts_config.keys() else None),
+                dtype=np.int32)
+
+    def _observe_decoder_steps(self, postnet_outputs):
+        for postnet_output in postnet_outputs:
+            steps = postnet_output.shape[0] // self.tts_model.decoder.r
+            self.decoder_steps.observe(steps)
+            self.decoder_steps_total.inc(steps)
+
+    def _style_input(self):
+        """Return the GST style input of the model, the mel spectrogram of
+        the ``style_wav`` of the server or of the model config, a dict of
+        token weights, or None."""
+        if not self.tts_config.use_gst:
+            return None
+        style_wav = getattr(self.config, 'style_wav', None)
+        if style_wav is None:
+            style_wav = self.tts_config.gst.get('gst_style_input')
+        if style_wav is None or isinstance(style_wav, dict):
+            return style_wav
+        style_cache = self.tts_model.style_cache
+        if style_cache is None:
+            return compute_style_mel(style_wav, self.ap, cuda=self.use_cuda)
+        return style_cache.get_or_compute(style_cache.wav_key(style_wav),
+                                          lambda: compute_style_mel(style_wav, self.ap, cuda=self.use_cuda))
+
+    def _run_tts_model(self, sentences, speaker_ids):
+        """Run the TTS model on a list of sentences and return a list of
+        (T x C) postnet outputs."""
+        seqs = [self._text_to_seq(sen) for sen in sentences]
+        style_mel = self._style_input()
+        if any(speaker_id is None for speaker_id in speaker_ids) and any(speaker_id is not None for speaker_id in speaker_ids):
+            raise ValueError(" [!] A batch cannot mix sentences with and without a speaker id.")
+        if speaker_ids[0] is not None:
+            speaker_ids = numpy_to_torch(np.asarray(speaker_ids), torch.long, cuda=self.use_cuda)
+        else:
+            speaker_ids = None
+
+        if self.tts_config.model.lower() != "tacotron2" or len(seqs) == 1:
+            # Tacotron decoder only runs one sentence at a time
+            postnet_outputs = []
+            for idx, seq in enumerate(seqs):
+                inputs = numpy_to_torch(seq, torch.long, cuda=self.use_cuda).unsqueeze(0)
+                speaker_id = speaker_ids[idx:idx + 1] if speaker_ids is not None else None
+                _, postnet_output, _, _ = run_model_torch(self.tts_model, inputs, self.tts_config, False, speaker_id, style_mel)
+                postnet_outputs.append(postnet_output[0])
+            self._observe_decoder_steps(postnet_outputs)
+            return postnet_outputs
+
+        # pad the sentences into a single batch
+        text_lengths = np.array([len(seq) for seq in seqs])
+        inputs = np.zeros((len(seqs), text_lengths.max()), dtype=np.int32)
+        for idx, seq in enumerate(seqs):
+            inputs[idx, :len(seq)] = seq
+        inputs = numpy_to_torch(inputs, torch.long, cuda=self.use_cuda)
+        text_lengths = numpy_to_torch(text_lengths, torch.long, cuda=self.use_cuda)
+        _, postnet_outputs, _, _, mel_lengths = self.tts_model.inference_batch(
+            inputs, text_lengths, speaker_ids=speaker_ids, style_mel=style_mel)
+        postnet_outputs = [postnet_outputs[idx, :mel_lengths[idx]] for idx in range(len(seqs))]
+        self._observe_decoder_steps(postnet_outputs)
+        return postnet_outputs
+
+    def _vocoder_padding(self):
+        """Return the number of samples of padding the vocoder adds at
+        either side of its output. Eager models pad their input with
+        ``inference_padding`` frames, which is trimmed here as the exported
+        TorchScript vocoders do internally, so both give the same audio."""
+        if isinstance(self.vocoder_model, torch.jit.ScriptModule):
+            return 0
+        return int(self.vocoder_model.inference_padding * self.vocoder_model.upsample_scale)
+
+    def _vocode(self, postnet_outputs):
+        """Convert a list of (T x C) model outputs to waveforms."""
+        if self.vocoder_model:
+            # use native vocoder model
+            # pad the batch by repeating the last frame of the shorter items
+            mel_lengths = [postnet_output.shape[0] for postnet_output in postnet_outputs]
+            max_len = max(mel_lengths)
+            vocoder_input = torch.stack([
+                torch.nn.functional.pad(
+                    postnet_output.transpose(0, 1).unsqueeze(0),
+                    (0, max_len - postnet_output.shape[0]),
+                    'replicate')[0] for postnet_output in postnet_outputs
+            ])
+            # process long inputs in chunks to bound the vocoder memory
+            chunk_size = getattr(self.config, 'vocoder_chunk_size', 0) or None
+            wavs = self.vocoder_model.inference(vocoder_input, chunk_size=chunk_size)
+            wavs = wavs.cpu().numpy()
+            pad = self._vocoder_padding()
+            return [wavs[idx].flatten()[pad:pad + mel_len * self.ap.hop_length]
+                    for idx, mel_len in enumerate(mel_lengths)]
+
+        if self.wavernn:
+            # use 3rd paty wavernn
+            wavs = []
+            for postnet_output in postnet_outputs:
                 vocoder_input = None
                 if self.tts_config.model == "Tacotron":
                     vocoder_input = torch.FloatTensor(self.ap.out_linear_to_mel(linear_spec=postnet_output.T).T).T.unsqueeze(0)
                 else:
-                    vocoder_input = postnet_output[0].transpose(0, 1).unsqueeze(0)
+                    vocoder_input = postnet_output.transpose(0, 1).unsqueeze(0)
                 if self.use_cuda:
                     vocoder_input.cuda()
                 wav = self.wavernn.generate(vocoder_input, batched=self.config.is_wavernn_batched, target=11000, overlap=550)
-            else:
-                # use GL
-                if self.use_cuda:
-                    postnet_output = postnet_output[0].cpu()
-                else:
-                    postnet_output = postnet_output[0]
-                postnet_output = postnet_output.numpy()
-                wav = inv_spectrogram(postnet_output, self.ap, self.tts_config)
+                wavs.append(wav)
+            return wavs
+
+        # use GL, on the whole batch at once
+        return apply_griffin_lim([postnet_output.cpu().numpy() for postnet_output in postnet_outputs],
+                                 [postnet_output.shape[0] for postnet_output in postnet_outputs],
+                                 self.tts_config, self.ap)
+
+    def tts_batch(self, sentences, speaker_ids=None):
+        """Synthesize a list of sentences as a single padded batch.
+
+        Args:
+            sentences (list): sentences to synthesize.
+            speaker_ids (list): speaker id of each sentence or None.
+
+        Returns:
+            list: one silence trimmed waveform per sentence.
+        """
+        if speaker_ids is None:
+            speaker_ids = [None] * len(sentences)
+        postnet_outputs = self._acoustic_stage(sentences, speaker_ids)
+        return self._vocoder_stage(postnet_outputs)
+
+    def _acoustic_stage(self, sentences, speaker_ids):
+        return self._run_tts_model(sentences, speaker_ids)
 
-            # trim silence
-            wav = trim_silence(wav, self.ap)
+    def _vocoder_stage(self, postnet_outputs):
+        with self.time_stage('vocoder'):
+            wavs = self._vocode(postnet_outputs)
+        # trim silence
+        with self.time_stage('silence_trim'):
+            return [trim_silence(wav, self.ap) for wav in wavs]
 
+    def wav_stream_header(self):
+        """Return a 16 bit mono WAV header for a stream of unknown length."""
+        sample_rate = self.ap.sample_rate
+        # 0xFFFFFFFF is the conventional size for streams of unknown length
+        return struct.pack('<4sI4s4sIHHIIHH4sI',
+                           b'RIFF', 0xFFFFFFFF, b'WAVE',
+                           b'fmt ', 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+                           b'data', 0xFFFFFFFF)
+
+    @staticmethod
+    def wav_to_pcm(wav, normalize=True):
+        """Convert a waveform to 16 bit PCM bytes, normalized like save_wav().
+        Without normalization, the waveform is expected in [-1, 1]."""
+        wav = np.asarray(wav)
+        if normalize:
+            wav_norm = wav * (32767 / max(0.01, np.max(np.abs(wav))))
+        else:
+            wav_norm = np.clip(wav, -1.0, 1.0) * 32767
+        return wav_norm.astype(np.int16).tobytes()
+
+    def _use_incremental_stream(self):
+        return (getattr(self.config, 'stream_chunk_size', 0) > 0
+                and self.vocoder_model is not None
+                and hasattr(self.vocoder_model, 'inference_stream')
+                and hasattr(self.tts_model, 'inference_stream'))
+
+    def _tts_stream_sentence(self, sentence, speaker_id=None):
+        """Yield the waveform of a sentence in chunks while the decoder is
+        still running. Vocoder chunks are cut with enough context to match
+        vocoding the whole sentence at once."""
+        chunk_size = self.config.stream_chunk_size
+        inputs = numpy_to_torch(self._text_to_seq(sentence), torch.long, cuda=self.use_cuda).unsqueeze(0)
+        speaker_ids = None
+        if speaker_id is not None:
+            speaker_ids = numpy_to_torch(np.asarray([speaker_id]), torch.long, cuda=self.use_cuda)
+        mel_chunks = (chunk.transpose(1, 2) for chunk in self.tts_model.inference_stream(
+            inputs, chunk_size=chunk_size, speaker_ids=speaker_ids, style_mel=self._style_input()))
+        # hold back the last samples until the end, which are padding
+        pad = self._vocoder_padding()
+        buffer, start = np.zeros(0, dtype=np.float32), pad
+        for wav in self.vocoder_model.inference_stream(mel_chunks, chunk_size=chunk_size):
+            buffer = np.concatenate([buffer, wav[0].cpu().numpy().flatten()])
+            if len(buffer) > start + pad:
+                yield buffer[start:len(buffer) - pad]
+                buffer, start = buffer[len(buffer) - pad:], 0
+
+    def tts_stream(self, text, speaker_id=None):
+        """Synthesize the given text and yield a WAV stream.
+
+        The header is yielded first, then the PCM of each sentence as soon as
+        it is vocoded, so clients can start playback after the first
+        sentence. Each sentence is normalized on its own since the loudest
+        sample of the whole text is not known in advance.
+
+        If ``stream_chunk_size`` is set and a MelGAN vocoder is used, each
+        sentence is streamed in chunks of that many frames while it is being
+        decoded instead. These chunks are neither normalized nor silence
+        trimmed.
+        """
+        self.requests_total.inc()
+        self.requests_in_progress.inc()
+        try:
+            yield from self._tts_stream(text, speaker_id)
+        finally:
+            # also runs when the client disconnects and the stream is closed
+            self.requests_in_progress.dec()
+
+    def _tts_stream(self, text, speaker_id=None):
+        start_time = time.time()
+        sens = self.split_into_sentences(text)
+        print(sens)
+        yield self.wav_stream_header()
+
+        silence = np.zeros(10000, dtype=np.int16).tobytes()
+        num_samples = 0
+        if self._use_incremental_stream():
+            first_chunk = True
+            for sen in sens:
+                for wav in self._tts_stream_sentence(sen, speaker_id):
+                    if first_chunk:
+                        print(f" > Time to first audio: {time.time() - start_time}")
+                        first_chunk = False
+                    with self.time_stage('wav_encoding'):
+                        pcm = self.wav_to_pcm(wav, normalize=False)
+                    num_samples += len(wav)
+                    yield pcm
+                yield silence
+                num_samples += 10000
+            self._observe_request(start_time, num_samples / self.ap.sample_rate)
+            return
+
+        if self.batch_scheduler is not None:
+            # queue all the sentences at once and send them out in order
+            futures = [self.batch_scheduler.submit(sen, speaker_id) for sen in sens]
+            sen_wavs = (future.result() for future in futures)
+        else:
+            sen_wavs = (self.tts_batch([sen], [speaker_id])[0] for sen in sens)
+
+        for idx, wav in enumerate(sen_wavs):
+            if idx == 0:
+                print(f" > Time to first audio: {time.time() - start_time}")
+            with self.time_stage('wav_encoding'):
+                pcm = self.wav_to_pcm(wav)
+            num_samples += len(wav)
+            yield pcm
+            yield silence
+            num_samples += 10000
+        self._observe_request(start_time, num_samples / self.ap.sample_rate)
+
+    def _observe_request(self, start_time, audio_time):
+        process_time = time.time() - start_time
+        print(f" > Processing time: {process_time}")
+        self.request_duration.observe(process_time)
+        self.audio_seconds_total.inc(audio_time)
+        if audio_time > 0:
+            print(f" > Real-time factor: {process_time / audio_time}")
+            self.real_time_factor.observe(process_time / audio_time)
+
+    def get_model_id(self):
+        """Identify the loaded models by the contents of their checkpoint and
+        config files."""
+        file_names = ['tts_checkpoint', 'tts_config', 'vocoder_checkpoint', 'vocoder_config',
+                      'wavernn_checkpoint', 'wavernn_config']
+        model_id = {file_name: file_hash(getattr(self.config, file_name, None)) for file_name in file_names}
+        model_id['attention_window'] = getattr(self.config, 'attention_window', 0)
+        model_id['quantize_tts'] = getattr(self.config, 'quantize_tts', False)
+        return model_id
+
+    def tts(self, text, speaker_id=None):
+        """Synthesize the given text and return it as WAV file data. Repeated
+        requests are served from the cache if it is enabled."""
+        self.requests_total.inc()
+        self.requests_in_progress.inc()
+        try:
+            if self.cache is None:
+                return self._tts(text, speaker_id)
+            key = SynthesisCache.make_key(text, self.model_id, speaker_id)
+            data = self.cache.get_or_compute(key, lambda: self._tts(text, speaker_id).getvalue())
+            return io.BytesIO(data)
+        finally:
+            self.requests_in_progress.dec()
+
+    def _tts(self, text, speaker_id=None):
+        start_time = time.time()
+        wavs = []
+        sens = self.split_into_sentences(text)
+        print(sens)
+
+        if self.batch_scheduler is not None:
+            sen_wavs = self.batch_scheduler.synthesize(sens, speaker_id)
+        else:
+            sen_wavs = [self.tts_batch([sen], [speaker_id])[0] for sen in sens]
+
+        for wav in sen_wavs:
             wavs += list(wav)
             wavs += [0] * 10000
 
         out = io.BytesIO()
-        self.save_wav(wavs, out)
+        with self.time_stage('wav_encoding'):
+            self.save_wav(wavs, out)
 
         # compute stats
-        process_time = time.time() - start_time
-        audio_time = len(wavs) / self.tts_config.audio['sample_rate']
-        print(f" > Processing time: {process_time}")
-        print(f" > Real-time factor: {process_time / audio_time}")
+        self._observe_request(start_time, len(wavs) / self.tts_config.audio['sample_rate'])
         return out
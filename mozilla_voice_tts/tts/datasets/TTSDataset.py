@@ -1,10 +1,13 @@
 import os
 import numpy as np
-import collections
+import collections.abc
 import torch
 import random
+import soundfile as sf
 from torch.utils.data import Dataset
 
+from mozilla_voice_tts.tts.datasets.feature_store import FeatureStore
+from mozilla_voice_tts.tts.datasets.phoneme_cache import PhonemeCache
 from mozilla_voice_tts.tts.utils.text import text_to_sequence, phoneme_to_sequence, pad_with_eos_bos
 from mozilla_voice_tts.tts.utils.data import prepare_data, prepare_tensor, prepare_stop_target
 
@@ -25,6 +28,7 @@ class MyDataset(Dataset):
                  phoneme_language="en-us",
                  enable_eos_bos=False,
                  speaker_mapping=None,
+                 feature_store_path=None,
                  verbose=False):
         """
         Args:
@@ -39,10 +43,13 @@ class MyDataset(Dataset):
                 by the loader.
             max_seq_len (int): (float("inf")) maximum sequence length.
             use_phonemes (bool): (true) if true, text converted to phonemes.
-            phoneme_cache_path (str): path to cache phoneme features.
+            phoneme_cache_path (str): folder of the phoneme cache files.
             phoneme_language (str): one the languages from
                 https://github.com/bootphon/phonemizer#languages
             enable_eos_bos (bool): enable end of sentence and beginning of sentences characters.
+            feature_store_path (str): path to precomputed features. If set,
+                spectrograms are loaded from it instead of computed from the
+                wav files.
             verbose (bool): print diagnostic information.
         """
         self.batch_group_size = batch_group_size
@@ -61,13 +68,19 @@ class MyDataset(Dataset):
         self.enable_eos_bos = enable_eos_bos
         self.speaker_mapping = speaker_mapping
         self.verbose = verbose
-        if use_phonemes and not os.path.isdir(phoneme_cache_path):
-            os.makedirs(phoneme_cache_path, exist_ok=True)
+        self.mel_lengths = None
+        self.feature_store = None
+        if feature_store_path is not None:
+            self.feature_store = FeatureStore(feature_store_path)
+            self.feature_store.check(ap, compute_linear_spec)
+        self.phoneme_cache = PhonemeCache(phoneme_cache_path) if use_phonemes else None
         if self.verbose:
             print("\n > DataLoader initialization")
             print(" | > Use phonemes: {}".format(self.use_phonemes))
             if use_phonemes:
                 print("   | > phoneme language: {}".format(phoneme_language))
+            if self.feature_store is not None:
+                print(" | > Feature store: {}".format(feature_store_path))
             print(" | > Number of instances : {}".format(len(self.items)))
         self.sort_items()
 
@@ -80,7 +93,7 @@ class MyDataset(Dataset):
         data = np.load(filename).astype('float32')
         return data
 
-    def _generate_and_cache_phoneme_sequence(self, text, cache_path):
+    def _generate_and_cache_phoneme_sequence(self, text, cache_key):
         """generate a phoneme sequence from text.
         since the usage is for subsequent caching, we never add bos and
         eos chars here. Instead we add those dynamically later; based on the
@@ -90,23 +103,15 @@ class MyDataset(Dataset):
                                        enable_eos_bos=False,
                                        tp=self.tp)
         phonemes = np.asarray(phonemes, dtype=np.int32)
-        np.save(cache_path, phonemes)
+        self.phoneme_cache.put(cache_key, phonemes)
         return phonemes
 
-    def _load_or_generate_phoneme_sequence(self, wav_file, text):
-        file_name = os.path.splitext(os.path.basename(wav_file))[0]
-        cache_path = os.path.join(self.phoneme_cache_path,
-                                  file_name + '_phoneme.npy')
-        try:
-            phonemes = np.load(cache_path)
-        except FileNotFoundError:
-            phonemes = self._generate_and_cache_phoneme_sequence(text,
-                                                                 cache_path)
-        except (ValueError, IOError):
-            print(" > ERROR: failed loading phonemes for {}. "
-                  "Recomputing.".format(wav_file))
-            phonemes = self._generate_and_cache_phoneme_sequence(text,
-                                                                 cache_path)
+    def _load_or_generate_phoneme_sequence(self, idx):
+        text = self.items[idx][0]
+        cache_key = self.phoneme_keys[idx]
+        phonemes = self.phoneme_cache.get(cache_key)
+        if phonemes is None:
+            phonemes = self._generate_and_cache_phoneme_sequence(text, cache_key)
         if self.enable_eos_bos:
             phonemes = pad_with_eos_bos(phonemes, tp=self.tp)
             phonemes = np.asarray(phonemes, dtype=np.int32)
@@ -114,24 +119,31 @@ class MyDataset(Dataset):
 
     def load_data(self, idx):
         text, wav_file, speaker_name = self.items[idx]
-        wav = np.asarray(self.load_wav(wav_file), dtype=np.float32)
+        if self.feature_store is not None:
+            mel, linear = self.feature_store.load(wav_file)
+        else:
+            wav = np.asarray(self.load_wav(wav_file), dtype=np.float32)
 
         if self.use_phonemes:
-            text = self._load_or_generate_phoneme_sequence(wav_file, text)
+            text = self._load_or_generate_phoneme_sequence(idx)
         else:
             text = np.asarray(
                 text_to_sequence(text, [self.cleaners], tp=self.tp), dtype=np.int32)
 
         assert text.size > 0, self.items[idx][1]
-        assert wav.size > 0, self.items[idx][1]
 
         sample = {
             'text': text,
-            'wav': wav,
             'item_idx': self.items[idx][1],
             'speaker_name': speaker_name,
             'wav_file_name': os.path.basename(wav_file)
         }
+        if self.feature_store is not None:
+            sample['mel'] = mel
+            sample['linear'] = linear
+        else:
+            assert wav.size > 0, self.items[idx][1]
+            sample['wav'] = wav
         return sample
 
     def sort_items(self):
@@ -156,6 +168,12 @@ class MyDataset(Dataset):
                 random.shuffle(temp_items)
                 new_items[offset:end_offset] = temp_items
         self.items = new_items
+        self.mel_lengths = None
+        # phoneme cache keys of the items, computed once instead of in every batch
+        self.phoneme_keys = None
+        if self.use_phonemes:
+            self.phoneme_keys = PhonemeCache.make_keys([item[0] for item in self.items], self.cleaners,
+                                                       self.phoneme_language, self.tp)
 
         if self.verbose:
             print(" | > Max length sequence: {}".format(np.max(lengths)))
@@ -165,6 +183,20 @@ class MyDataset(Dataset):
                 self.max_seq_len, self.min_seq_len, len(ignored)))
             print(" | > Batch group size: {}.".format(self.batch_group_size))
 
+    def compute_mel_lengths(self):
+        """Return the number of mel frames of each item. They are read from
+        the feature store or estimated from the durations of the wav files,
+        without silence trimming."""
+        if self.mel_lengths is None:
+            self.mel_lengths = []
+            for _, wav_file, _ in self.items:
+                if self.feature_store is not None:
+                    self.mel_lengths.append(self.feature_store.load(wav_file)[0].shape[1])
+                else:
+                    num_samples = sf.info(wav_file).duration * self.sample_rate
+                    self.mel_lengths.append(int(num_samples) // self.ap.hop_length + 1)
+        return self.mel_lengths
+
     def __len__(self):
         return len(self.items)
 
@@ -175,13 +207,14 @@ class MyDataset(Dataset):
         r"""
             Perform preprocessing and create a final data batch:
             1. Sort batch instances by text-length
-            2. Convert Audio signal to Spectrograms.
+            2. Convert Audio signal to Spectrograms, unless they are
+               loaded from a feature store.
             3. PAD sequences wrt r.
             4. Load to Torch.
         """
 
         # Puts each data field into a tensor with outer dimension batch size
-        if isinstance(batch[0], collections.Mapping):
+        if isinstance(batch[0], collections.abc.Mapping):
 
             text_lenghts = np.array([len(d["text"]) for d in batch])
 
@@ -189,7 +222,6 @@ class MyDataset(Dataset):
             text_lenghts, ids_sorted_decreasing = torch.sort(
                 torch.LongTensor(text_lenghts), dim=0, descending=True)
 
-            wav = [batch[idx]['wav'] for idx in ids_sorted_decreasing]
             item_idxs = [
                 batch[idx]['item_idx'] for idx in ids_sorted_decreasing
             ]
@@ -204,7 +236,11 @@ class MyDataset(Dataset):
             else:
                 speaker_embedding = None
             # compute features
-            mel = [self.ap.melspectrogram(w).astype('float32') for w in wav]
+            if self.feature_store is not None:
+                mel = [batch[idx]['mel'] for idx in ids_sorted_decreasing]
+            else:
+                wav = [batch[idx]['wav'] for idx in ids_sorted_decreasing]
+                mel = [self.ap.melspectrogram(w).astype('float32') for w in wav]
 
             mel_lengths = [m.shape[1] for m in mel]
 
@@ -238,7 +274,10 @@ class MyDataset(Dataset):
 
             # compute linear spectrogram
             if self.compute_linear_spec:
-                linear = [self.ap.spectrogram(w).astype('float32') for w in wav]
+                if self.feature_store is not None:
+                    linear = [batch[idx]['linear'] for idx in ids_sorted_decreasing]
+                else:
+                    linear = [self.ap.spectrogram(w).astype('float32') for w in wav]
                 linear = prepare_tensor(linear, self.outputs_per_step)
                 linear = linear.transpose(0, 2, 1)
                 assert mel.shape[1] == linear.shape[1]
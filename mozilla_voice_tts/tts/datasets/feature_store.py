@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+from multiprocessing import Pool
+
+import numpy as np
+from tqdm import tqdm
+
+# AudioProcessor attributes that change the computed spectrograms
+FEATURE_PARAMETERS = ('sample_rate', 'num_mels', 'min_level_db', 'ref_level_db', 'fft_size',
+                      'hop_length', 'win_length', 'preemphasis', 'signal_norm', 'symmetric_norm',
+                      'max_norm', 'mel_fmin', 'mel_fmax', 'spec_gain', 'stft_pad_mode', 'clip_norm',
+                      'do_trim_silence', 'trim_db', 'do_sound_norm')
+INDEX_FILE = 'index.json'
+
+
+def item_key(wav_file):
+    """Key of a wav file in the store, its absolute path. File names are
+    not unique across the speakers of a dataset, e.g. VCTK, or across
+    datasets."""
+    return os.path.abspath(wav_file)
+
+
+def audio_signature(ap):
+    """Return the audio parameters the features of ``ap`` depend on,
+    including a hash of its mean-var statistics file."""
+    signature = {name: getattr(ap, name) for name in FEATURE_PARAMETERS}
+    signature['stats'] = None
+    if ap.stats_path:
+        with open(ap.stats_path, 'rb') as f:
+            signature['stats'] = hashlib.sha1(f.read()).hexdigest()
+    # round trip through json to compare with a loaded index
+    return json.loads(json.dumps(signature))
+
+
+class FeatureStore(object):
+    """Precomputed mel and linear spectrograms packed into memory-mapped
+    shards.
+
+    Each shard is a flat float32 file of the time-major spectrograms of
+    many utterances. ``index.json`` maps the wav file names to their shard,
+    first frame and number of frames, so loading an utterance is a slice of
+    the memory map without any copy or decoding. Mel and linear shards share
+    the same layout. Files are keyed by their absolute paths, so the store
+    needs to be rebuilt if the datasets move. Build a store with ``FeatureStore.build()`` or
+    ``bin/compute_features.py``.
+
+    Args:
+        path (str): folder of the store.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE), 'r') as f:
+            index = json.load(f)
+        self.audio = index['audio']
+        self.num_mels = index['num_mels']
+        self.linear_dim = index['linear_dim']
+        self.items = index['items']
+        self.shards = {}
+
+    def __getstate__(self):
+        # memory maps are opened again in each data loader worker
+        state = self.__dict__.copy()
+        state['shards'] = {}
+        return state
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, wav_file):
+        return item_key(wav_file) in self.items
+
+    def check(self, ap, compute_linear_spec=False):
+        """Raise an error if the store was computed with other audio
+        parameters than ``ap`` or lacks the linear spectrograms."""
+        signature = audio_signature(ap)
+        changed = [name for name in signature if signature[name] != self.audio.get(name)]
+        if changed:
+            raise RuntimeError(f" [!] Feature store {self.path} was computed with different audio "
+                               f"parameters: {', '.join(changed)}. Rebuild it with compute_features.py.")
+        if compute_linear_spec and self.linear_dim is None:
+            raise RuntimeError(f" [!] Feature store {self.path} has no linear spectrograms.")
+
+    def _shard(self, kind, idx, dim):
+        if (kind, idx) not in self.shards:
+            data = np.memmap(os.path.join(self.path, f'{kind}_{idx:05d}.bin'), dtype=np.float32, mode='r')
+            self.shards[(kind, idx)] = data.reshape(-1, dim)
+        return self.shards[(kind, idx)]
+
+    def load(self, wav_file):
+        """Return read-only views of the mel spectrogram and, if stored, the
+        linear spectrogram of a wav file. Both are [C, T] like
+        ``AudioProcessor.melspectrogram()``."""
+        shard_idx, offset, num_frames = self.items[item_key(wav_file)]
+        mel = self._shard('mel', shard_idx, self.num_mels)[offset:offset + num_frames].T
+        linear = None
+        if self.linear_dim is not None:
+            linear = self._shard('linear', shard_idx, self.linear_dim)[offset:offset + num_frames].T
+        return mel, linear
+
+    @staticmethod
+    def is_up_to_date(path, ap, compute_linear_spec=False, wav_files=None):
+        """Check that a store exists for ``ap`` and contains ``wav_files``."""
+        if not os.path.exists(os.path.join(path, INDEX_FILE)):
+            return False
+        store = FeatureStore(path)
+        try:
+            store.check(ap, compute_linear_spec)
+        except RuntimeError:
+            return False
+        return wav_files is None or all(wav_file in store for wav_file in wav_files)
+
+    @staticmethod
+    def build(path, wav_files, ap, compute_linear_spec=False, num_workers=0, max_shard_bytes=2**30):
+        """Compute the features of ``wav_files`` with ``ap`` and write them
+        to a new store at ``path``, replacing any previous one.
+
+        Args:
+            path (str): folder of the store.
+            wav_files (list): wav file paths.
+            ap (AudioProcessor): audio processor used for training.
+            compute_linear_spec (bool): also store linear spectrograms.
+            num_workers (int): feature extraction processes. 0 computes
+                the features in this process.
+            max_shard_bytes (int): size after which a new mel shard is
+                started.
+        """
+        keys = {item_key(wav_file): wav_file for wav_file in wav_files}
+        os.makedirs(path, exist_ok=True)
+        # an index is only written for complete stores
+        index_path = os.path.join(path, INDEX_FILE)
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        for file_name in os.listdir(path):
+            if file_name.endswith('.bin'):
+                os.remove(os.path.join(path, file_name))
+
+        index = {'audio': audio_signature(ap),
+                 'num_mels': ap.num_mels,
+                 'linear_dim': ap.fft_size // 2 + 1 if compute_linear_spec else None,
+                 'items': {}}
+        shard_idx, offset = 0, 0
+        mel_file, linear_file = None, None
+        tasks = [(wav_file, compute_linear_spec) for wav_file in keys.values()]
+        pool = Pool(num_workers, initializer=_init_worker, initargs=(ap,)) if num_workers > 0 else None
+        try:
+            if pool is None:
+                _init_worker(ap)
+                results = map(_compute_features, tasks)
+            else:
+                results = pool.imap(_compute_features, tasks, chunksize=16)
+            for key, (mel, linear) in tqdm(zip(keys, results), total=len(tasks)):
+                if mel_file is None or offset * ap.num_mels * 4 >= max_shard_bytes:
+                    if mel_file is not None:
+                        shard_idx, offset = shard_idx + 1, 0
+                        mel_file.close()
+                        if linear_file is not None:
+                            linear_file.close()
+                    mel_file = open(os.path.join(path, f'mel_{shard_idx:05d}.bin'), 'wb')
+                    if compute_linear_spec:
+                        linear_file = open(os.path.join(path, f'linear_{shard_idx:05d}.bin'), 'wb')
+                mel.T.astype(np.float32).tofile(mel_file)
+                if linear is not None:
+                    linear.T.astype(np.float32).tofile(linear_file)
+                num_frames = mel.shape[1]
+                index['items'][key] = [shard_idx, offset, num_frames]
+                offset += num_frames
+        finally:
+            if pool is not None:
+                pool.terminate()
+            if mel_file is not None:
+                mel_file.close()
+            if linear_file is not None:
+                linear_file.close()
+        with open(index_path, 'w') as f:
+            json.dump(index, f)
+        return FeatureStore(path)
+
+
+# audio processor of the feature extraction processes
+_worker_ap = None
+
+
+def _init_worker(ap):
+    global _worker_ap  # pylint: disable=global-statement
+    _worker_ap = ap
+
+
+def _compute_features(task):
+    wav_file, compute_linear_spec = task
+    wav = np.asarray(_worker_ap.load_wav(wav_file), dtype=np.float32)
+    mel = _worker_ap.melspectrogram(wav)
+    linear = _worker_ap.spectrogram(wav) if compute_linear_spec else None
+    return mel, linear
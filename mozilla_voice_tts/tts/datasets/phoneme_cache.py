@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+from multiprocessing import Pool
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import numpy as np
+import phonemizer
+from tqdm import tqdm
+
+from mozilla_voice_tts.tts.utils.text import _clean_text, phoneme_to_sequence
+from mozilla_voice_tts.tts.utils.text.symbols import make_symbols, phonemes
+
+DATA_FILE = 'phonemes.bin'
+INDEX_FILE = 'phonemes.idx'
+# sha1 key, offset and length of a sequence in the data file
+INDEX_DTYPE = np.dtype([('key', 'u1', (20, )), ('offset', '<i8'), ('length', '<i4')])
+OPEN_FLAGS = os.O_RDWR | os.O_CREAT | os.O_APPEND | getattr(os, 'O_BINARY', 0)
+
+
+def _lock(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+    else:
+        # lock the first byte, the whole file for the other writers
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+
+
+def _unlock(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+def _pread(fd, size, offset):
+    if hasattr(os, 'pread'):
+        return os.pread(fd, size, offset)
+    # the descriptors are not shared between threads
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, size)
+
+
+class PhonemeCache(object):
+    """Phoneme id sequences of a dataset in a single append-only file.
+
+    ``phonemes.bin`` holds the int32 sequences back to back and
+    ``phonemes.idx`` fixed size records of their key, offset and length.
+    A sequence is written before its index record, so an interrupted write
+    never leaves a record pointing at missing data, and a partial record is
+    dropped by the next write. Several processes, e.g. data loader workers,
+    can add sequences at the same time and see the sequences added by the
+    others.
+
+    Keys are hashes of the cleaned text, the language, the cleaner, the
+    phonemizer version and the phoneme set, so the same sentence in two
+    datasets is phonemized once and a phonemizer upgrade does not reuse
+    stale results.
+
+    Args:
+        path (str): folder of the cache files.
+    """
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.index = {}
+        self.index_bytes = 0
+        self.files = None
+
+    def __getstate__(self):
+        # files are opened again in each data loader worker
+        state = self.__dict__.copy()
+        state['files'] = None
+        return state
+
+    def __len__(self):
+        self._refresh()
+        return len(self.index)
+
+    def __contains__(self, key):
+        return self.get_location(key) is not None
+
+    @staticmethod
+    def make_key(text, cleaner, language, tp=None):
+        """Return the key of the phonemes of ``text``."""
+        return PhonemeCache.make_keys([text], cleaner, language, tp)[0]
+
+    @staticmethod
+    def make_keys(texts, cleaner, language, tp=None):
+        """Return the keys of the phonemes of ``texts``."""
+        _phonemes = ''.join(make_symbols(**tp)[1] if tp else phonemes)
+        keys = []
+        for text in texts:
+            key = json.dumps({'text': _clean_text(text, [cleaner]),
+                              'language': language,
+                              'cleaner': cleaner,
+                              'phonemizer': phonemizer.__version__,
+                              'phonemes': _phonemes}, sort_keys=True)
+            keys.append(hashlib.sha1(key.encode('utf-8')).digest())
+        return keys
+
+    def _open(self):
+        # descriptors shared with a forked parent would share its locks
+        if self.files is None or self.files[0] != os.getpid():
+            data_fd = os.open(os.path.join(self.path, DATA_FILE), OPEN_FLAGS, 0o644)
+            index_fd = os.open(os.path.join(self.path, INDEX_FILE), OPEN_FLAGS, 0o644)
+            self.files = (os.getpid(), data_fd, index_fd)
+        return self.files[1], self.files[2]
+
+    def _refresh(self):
+        """Read the index records added since the last refresh."""
+        _, index_fd = self._open()
+        size = os.fstat(index_fd).st_size
+        # ignore a record that is still being written
+        size -= size % INDEX_DTYPE.itemsize
+        if size <= self.index_bytes:
+            return
+        buffer = _pread(index_fd, size - self.index_bytes, self.index_bytes)
+        for record in np.frombuffer(buffer, dtype=INDEX_DTYPE):
+            self.index[record['key'].tobytes()] = (int(record['offset']), int(record['length']))
+        self.index_bytes = size
+
+    def get_location(self, key):
+        if key not in self.index:
+            self._refresh()
+        return self.index.get(key)
+
+    def get(self, key):
+        """Return the int32 phoneme ids of ``key`` or None."""
+        location = self.get_location(key)
+        if location is None:
+            return None
+        offset, length = location
+        data_fd, _ = self._open()
+        buffer = _pread(data_fd, length * 4, offset)
+        return np.frombuffer(buffer, dtype=np.int32)
+
+    def put(self, key, sequence):
+        """Append the phoneme ids of ``key``."""
+        data_fd, index_fd = self._open()
+        data = np.asarray(sequence, dtype='<i4').tobytes()
+        _lock(index_fd)
+        try:
+            # drop a partial record left by an interrupted writer
+            size = os.fstat(index_fd).st_size
+            if size % INDEX_DTYPE.itemsize:
+                os.ftruncate(index_fd, size - size % INDEX_DTYPE.itemsize)
+            self._refresh()
+            if key in self.index:
+                return
+            offset = os.fstat(data_fd).st_size
+            os.write(data_fd, data)
+            record = np.zeros(1, dtype=INDEX_DTYPE)
+            record['key'] = np.frombuffer(key, dtype=np.uint8)
+            record['offset'] = offset
+            record['length'] = len(data) // 4
+            os.write(index_fd, record.tobytes())
+            self.index[key] = (offset, len(data) // 4)
+            self.index_bytes += INDEX_DTYPE.itemsize
+        finally:
+            _unlock(index_fd)
+
+    def build(self, texts, cleaner, language, tp=None, num_workers=0):
+        """Phonemize the ``texts`` that are not in the cache yet.
+
+        Args:
+            texts (list): sentences of the dataset.
+            cleaner (str): text cleaner used for the dataset.
+            language (str): phonemizer language.
+            tp (dict): custom characters of the model config.
+            num_workers (int): phonemizer processes. 0 runs the phonemizer
+                in this process.
+        """
+        missing = {}
+        for text, key in zip(texts, self.make_keys(texts, cleaner, language, tp)):
+            if key not in self and key not in missing:
+                missing[key] = text
+        if not missing:
+            return 0
+        tasks = [(text, cleaner, language, tp) for text in missing.values()]
+        if num_workers > 0:
+            with Pool(num_workers) as pool:
+                for key, sequence in tqdm(zip(missing, pool.imap(_phonemize, tasks, chunksize=16)),
+                                          total=len(tasks)):
+                    self.put(key, sequence)
+        else:
+            for key, task in tqdm(zip(missing, tasks), total=len(tasks)):
+                self.put(key, _phonemize(task))
+        return len(missing)
+
+
+def _phonemize(task):
+    text, cleaner, language, tp = task
+    # bos and eos chars are added by the dataset depending on the config
+    return phoneme_to_sequence(text, [cleaner], language=language, enable_eos_bos=False, tp=tp)
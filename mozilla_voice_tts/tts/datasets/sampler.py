@@ -0,0 +1,146 @@
+import math
+
+import numpy as np
+from torch.utils.data.sampler import Sampler
+
+from mozilla_voice_tts.tts.utils.distribute import load_imbalance
+
+
+class BucketBatchSampler(Sampler):
+    """Batch sampler that groups items of similar length and fills each
+    batch up to a budget of padded frames.
+
+    Items are sorted by length and split into buckets of ``bucket_size``
+    neighbours. Every epoch the items are shuffled within their buckets,
+    packed into batches so that ``batch_size * max_length`` stays within
+    ``max_frames``, and the batches are shuffled. Short sentences therefore
+    make large batches, long sentences small ones, and little of each batch
+    is padding.
+
+    With several replicas, neighbouring batches run at the same step on
+    the replicas, so they do similar amounts of work, and every replica
+    gets the same number of batches. All of them shuffle with the same
+    seed, so call ``set_epoch()`` on each of them before every epoch.
+
+    Args:
+        lengths (list): number of frames of each dataset item.
+        max_frames (int): maximum number of padded frames in a batch.
+        max_batch_size (int): maximum number of items in a batch.
+        bucket_size (int): number of items shuffled together.
+        shuffle (bool): shuffle the items and batches every epoch.
+        num_replicas (int): number of distributed processes.
+        rank (int): rank of this process.
+        seed (int): random seed shared by the replicas.
+    """
+    def __init__(self, lengths, max_frames, max_batch_size=None, bucket_size=256, shuffle=True,
+                 num_replicas=1, rank=0, seed=0):
+        # pylint: disable=super-init-not-called
+        # Sampler.__init__ takes no arguments in recent torch versions
+        self.lengths = np.asarray(lengths)
+        self.max_frames = max_frames
+        self.max_batch_size = max_batch_size
+        self.bucket_size = bucket_size
+        self.shuffle = shuffle
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.epoch = 0
+        self.sorted_indices = np.argsort(self.lengths, kind='stable')
+        self.steps = None
+
+    def set_epoch(self, epoch):
+        if epoch != self.epoch:
+            self.epoch = epoch
+            self.steps = None
+
+    def make_batches(self, rng):
+        """Return the batches of all the replicas in order of length."""
+        indices = self.sorted_indices.copy()
+        if self.shuffle:
+            for start in range(0, len(indices), self.bucket_size):
+                rng.shuffle(indices[start:start + self.bucket_size])
+        batches = []
+        batch, batch_max_length = [], 0
+        for idx in indices:
+            max_length = max(batch_max_length, self.lengths[idx])
+            if batch and (max_length * (len(batch) + 1) > self.max_frames
+                          or len(batch) == self.max_batch_size):
+                batches.append(batch)
+                batch, max_length = [], self.lengths[idx]
+            batch.append(int(idx))
+            batch_max_length = max_length
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def get_steps(self):
+        """Return the batches of all the replicas at each step of the
+        current epoch."""
+        if self.steps is None:
+            rng = np.random.RandomState(self.seed + self.epoch)
+            batches = self.make_batches(rng)
+            # add extra batches to give every replica the same number
+            num_steps = int(math.ceil(len(batches) / self.num_replicas))
+            batches += [batches[-1 - i % len(batches)] for i in range(num_steps * self.num_replicas - len(batches))]
+            self.steps = [batches[step * self.num_replicas:(step + 1) * self.num_replicas]
+                          for step in range(num_steps)]
+            if self.shuffle:
+                rng.shuffle(self.steps)
+        return self.steps
+
+    def get_batches(self):
+        """Return the batches of this replica for the current epoch."""
+        return [step[self.rank] for step in self.get_steps()]
+
+    def __iter__(self):
+        return iter(self.get_batches())
+
+    def __len__(self):
+        return len(self.get_batches())
+
+    def stats(self):
+        """Return the number of batches, their average size and the ratio
+        of padding frames of this replica, and the load imbalance of the
+        replicas in padded frames, for the current epoch."""
+        batches = self.get_batches()
+        num_frames = sum(self.lengths[batch].sum() for batch in batches)
+        num_padded_frames = sum(len(batch) * self.lengths[batch].max() for batch in batches)
+        work = [[len(batch) * self.lengths[batch].max() for batch in step] for step in self.get_steps()]
+        return {'num_batches': len(batches),
+                'avg_batch_size': float(np.mean([len(batch) for batch in batches])),
+                'padding_ratio': float(1 - num_frames / num_padded_frames),
+                'imbalance': load_imbalance(work)}
+
+
+class BatchGroupSampler(Sampler):
+    """Sampler over items sorted by length that shuffles them within groups
+    of ``group_size`` every epoch, as ``MyDataset.sort_items()`` does once.
+    Batches of neighbouring items then vary between epochs while the dataset
+    and its loader workers are kept for the whole training.
+
+    Args:
+        num_items (int): number of dataset items.
+        group_size (int): number of items shuffled together. 0 keeps the
+            order of the dataset.
+        seed (int): random seed.
+    """
+    def __init__(self, num_items, group_size, seed=0):
+        # pylint: disable=super-init-not-called
+        self.num_items = num_items
+        self.group_size = group_size
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        indices = np.arange(self.num_items)
+        if self.group_size > 0:
+            rng = np.random.RandomState(self.seed + self.epoch)
+            for start in range(0, self.num_items - self.group_size + 1, self.group_size):
+                rng.shuffle(indices[start:start + self.group_size])
+        return iter(indices.tolist())
+
+    def __len__(self):
+        return self.num_items
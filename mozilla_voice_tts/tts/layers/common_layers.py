@@ -1,8 +1,29 @@
+from typing import Optional, Tuple
+
 import torch
 from torch import nn
 from torch.nn import functional as F
 
 
+def fold_batch_norm(layer, batch_norm):
+    """Fold the running statistics and the affine parameters of a batch norm
+    into the weights and bias of the conv or linear layer before it. The
+    batch norm can be removed afterwards."""
+    if not isinstance(batch_norm, nn.modules.batchnorm._BatchNorm):  # pylint: disable=protected-access
+        # already folded
+        return
+    with torch.no_grad():
+        scale = 1.0 / torch.sqrt(batch_norm.running_var + batch_norm.eps)
+        shift = -batch_norm.running_mean * scale
+        if batch_norm.affine:
+            scale = scale * batch_norm.weight
+            shift = shift * batch_norm.weight + batch_norm.bias
+        if layer.bias is not None:
+            shift = shift + layer.bias * scale
+        layer.weight.copy_(layer.weight * scale.view(-1, *([1] * (layer.weight.dim() - 1))))
+        layer.bias = nn.Parameter(shift)
+
+
 class Linear(nn.Module):
     def __init__(self,
                  in_features,
@@ -40,6 +61,10 @@ class LinearBN(nn.Module):
             self.linear_layer.weight,
             gain=torch.nn.init.calculate_gain(init_gain))
 
+    def fold_batch_norm(self):
+        fold_batch_norm(self.linear_layer, self.batch_normalization)
+        self.batch_normalization = nn.Identity()
+
     def forward(self, x):
         out = self.linear_layer(x)
         if len(out.shape) == 3:
@@ -142,6 +167,11 @@ class GravesAttention(nn.Module):
         self.attention_weights = torch.zeros(inputs.shape[0], inputs.shape[1]).to(inputs.device)
         self.mu_prev = torch.zeros(inputs.shape[0], self.K).to(inputs.device)
 
+    def select_states(self, idx):
+        """Keep only the attention states of the given batch items."""
+        self.attention_weights = self.attention_weights[idx]
+        self.mu_prev = self.mu_prev[idx]
+
     # pylint: disable=R0201
     # pylint: disable=unused-argument
     def preprocess_inputs(self, inputs):
@@ -199,7 +229,16 @@ class OriginalAttention(nn.Module):
         - https://arxiv.org/abs/1807.06736 + state masking at inference
         - Using sigmoid instead of softmax normalization
         - Attention windowing at inference time
+        - Local attention at inference time, see ``set_local_window()``
+
+    The attention states are kept as attributes by ``forward()``. ``step()``
+    is a functional version with the states passed explicitly, which can be
+    compiled with TorchScript.
     """
+    # flags that remove the code of the disabled features in TorchScript
+    __constants__ = ['location_attention', 'windowing', 'norm', 'forward_attn',
+                     'trans_agent', 'forward_attn_mask', 'local_attention']
+
     # Pylint gets confused by PyTorch conventions here
     #pylint: disable=attribute-defined-outside-init
     def __init__(self, query_dim, embedding_dim, attention_dim,
@@ -224,16 +263,32 @@ class OriginalAttention(nn.Module):
         self._mask_value = -float("inf")
         self.windowing = windowing
         self.win_idx = None
+        self.win_back = 2
+        self.win_front = 6
         self.norm = norm
         self.forward_attn = forward_attn
         self.trans_agent = trans_agent
         self.forward_attn_mask = forward_attn_mask
         self.location_attention = location_attention
-
-    def init_win_idx(self):
-        self.win_idx = -1
-        self.win_back = 2
-        self.win_front = 6
+        self.local_attention = False
+        self.local_win_back = 0
+        self.local_win_front = 0
+
+    def set_local_window(self, win_back=8, win_front=24):
+        """Enable local attention in eval mode. Energies, location features
+        and the context are only computed over the ``win_back + win_front``
+        encoder steps around the previous alignment peak, so the cost of a
+        decoder step does not grow with the input length. Attention outside
+        of the window is zero. Set both values to 0 to disable it.
+        Call it before ``Decoder.script_step()``."""
+        self.local_attention = win_back + win_front > 0
+        self.local_win_back = win_back
+        self.local_win_front = win_front
+
+    def init_win_idx(self, inputs):
+        B = inputs.size(0)
+        # window center of each item, -1 until the first step
+        self.win_idx = torch.full([B], -1, dtype=torch.long, device=inputs.device)
 
     def init_forward_attn(self, inputs):
         B = inputs.shape[0]
@@ -256,18 +311,64 @@ class OriginalAttention(nn.Module):
             self.init_location_attention(inputs)
         if self.forward_attn:
             self.init_forward_attn(inputs)
-        if self.windowing:
-            self.init_win_idx()
+        if self.windowing or self.local_attention:
+            self.init_win_idx(inputs)
+
+    def select_states(self, idx):
+        """Keep only the attention states of the given batch items."""
+        self.attention_weights = self.attention_weights[idx]
+        if self.location_attention:
+            self.attention_weights_cum = self.attention_weights_cum[idx]
+        if self.forward_attn:
+            self.alpha = self.alpha[idx]
+            self.u = self.u[idx]
+        if self.windowing or self.local_attention:
+            self.win_idx = self.win_idx[idx]
+
+    def get_states(self):
+        """Return the attention states as expected by ``step()``. States of
+        disabled features are empty tensors."""
+        empty = self.attention_weights.new_zeros(0)
+        return (self.attention_weights,
+                self.attention_weights_cum if self.location_attention else empty,
+                self.alpha if self.forward_attn else empty,
+                self.u if self.forward_attn else empty,
+                self.win_idx if self.windowing or self.local_attention else empty.long())
+
+    def set_states(self, attention_weights, attention_weights_cum, alpha, u, win_idx):
+        self.attention_weights = attention_weights
+        if self.location_attention:
+            self.attention_weights_cum = attention_weights_cum
+        if self.forward_attn:
+            self.alpha = alpha
+            self.u = u
+        if self.windowing or self.local_attention:
+            self.win_idx = win_idx
 
     def preprocess_inputs(self, inputs):
         return self.inputs_layer(inputs)
 
-    def update_location_attention(self, alignments):
-        self.attention_weights_cum += alignments
-
     def get_location_attention(self, query, processed_inputs):
-        attention_cat = torch.cat((self.attention_weights.unsqueeze(1),
-                                   self.attention_weights_cum.unsqueeze(1)),
+        energies = self._get_location_attention(query, processed_inputs,
+                                                self.attention_weights,
+                                                self.attention_weights_cum)
+        return energies, self.query_layer(query.unsqueeze(1))
+
+    def get_attention(self, query, processed_inputs):
+        return self._get_attention(query, processed_inputs), self.query_layer(query.unsqueeze(1))
+
+    def apply_windowing(self, attention, inputs):  # pylint: disable=unused-argument
+        positions = torch.arange(attention.shape[1], device=attention.device).unsqueeze(0)
+        attention, self.win_idx = self._apply_windowing(attention, self.win_idx, positions)
+        return attention
+
+    def apply_forward_attention(self, alignment):
+        return self._apply_forward_attention(alignment, self.alpha, self.u)
+
+    def _get_location_attention(self, query, processed_inputs, attention_weights,
+                                attention_weights_cum):
+        attention_cat = torch.cat((attention_weights.unsqueeze(1),
+                                   attention_weights_cum.unsqueeze(1)),
                                   dim=1)
         processed_query = self.query_layer(query.unsqueeze(1))
         processed_attention_weights = self.location_layer(attention_cat)
@@ -275,73 +376,87 @@ class OriginalAttention(nn.Module):
             torch.tanh(processed_query + processed_attention_weights +
                        processed_inputs))
         energies = energies.squeeze(-1)
-        return energies, processed_query
+        return energies
 
-    def get_attention(self, query, processed_inputs):
+    def _get_attention(self, query, processed_inputs):
         processed_query = self.query_layer(query.unsqueeze(1))
         energies = self.v(torch.tanh(processed_query + processed_inputs))
         energies = energies.squeeze(-1)
-        return energies, processed_query
-
-    def apply_windowing(self, attention, inputs):
-        back_win = self.win_idx - self.win_back
-        front_win = self.win_idx + self.win_front
-        if back_win > 0:
-            attention[:, :back_win] = -float("inf")
-        if front_win < inputs.shape[1]:
-            attention[:, front_win:] = -float("inf")
+        return energies
+
+    def _apply_windowing(self, attention, win_idx, positions):
+        """``positions`` are the encoder steps of the attention values."""
+        back_win = (win_idx - self.win_back).unsqueeze(1)
+        front_win = (win_idx + self.win_front).unsqueeze(1)
+        attention = attention.masked_fill(
+            (positions < back_win) | (positions >= front_win), -float("inf"))
         # this is a trick to solve a special problem.
         # but it does not hurt.
-        if self.win_idx == -1:
-            attention[:, 0] = attention.max()
+        first_step = win_idx == -1
+        attention[:, 0] = torch.where(first_step, attention.max(1)[0], attention[:, 0])
         # Update the window
-        self.win_idx = torch.argmax(attention, 1).long()[0].item()
-        return attention
+        win_idx = positions.expand_as(attention).gather(
+            1, torch.argmax(attention, 1, keepdim=True)).squeeze(1)
+        return attention, win_idx
 
-    def apply_forward_attention(self, alignment):
+    def _apply_forward_attention(self, alignment, prev_alpha, u):
         # forward attention
         fwd_shifted_alpha = F.pad(
-            self.alpha[:, :-1].clone().to(alignment.device), (1, 0, 0, 0))
+            prev_alpha[:, :-1].clone().to(alignment.device), (1, 0, 0, 0))
         # compute transition potentials
-        alpha = ((1 - self.u) * self.alpha
-                 + self.u * fwd_shifted_alpha
+        alpha = ((1 - u) * prev_alpha
+                 + u * fwd_shifted_alpha
                  + 1e-8) * alignment
         # force incremental alignment
         if not self.training and self.forward_attn_mask:
-            _, n = fwd_shifted_alpha.max(1)
-            val, _ = alpha.max(1)
-            for b in range(alignment.shape[0]):
-                alpha[b, n[b] + 3:] = 0
-                alpha[b, :(
-                    n[b] - 1
-                )] = 0  # ignore all previous states to prevent repetition.
-                alpha[b,
-                      (n[b] - 2
-                       )] = 0.01 * val[b]  # smoothing factor for the prev step
+            T = alignment.shape[1]
+            positions = torch.arange(T, device=alignment.device).unsqueeze(0)
+            _, n = fwd_shifted_alpha.max(1, keepdim=True)
+            val, _ = alpha.max(1, keepdim=True)
+            # ignore all previous states to prevent repetition.
+            alpha = alpha.masked_fill((positions >= n + 3) | (positions < n - 1), 0)
+            # smoothing factor for the prev step.
+            # Negative indices wrap around as in python indexing.
+            alpha = torch.where(positions == (n - 2) % T, 0.01 * val, alpha)
         # renormalize attention weights
         alpha = alpha / alpha.sum(dim=1, keepdim=True)
         return alpha
 
-    def forward(self, query, inputs, processed_inputs, mask):
-        """
+    def step(self, query, inputs, processed_inputs, mask: Optional[torch.Tensor],
+             attention_weights, attention_weights_cum, alpha, u, win_idx
+             ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Functional attention step with explicit states.
+
         shapes:
             query: B x D_attn_rnn
             inputs: B x T_en x D_en
             processed_inputs:: B x T_en x D_attn
             mask: B x T_en
+            attention_weights, attention_weights_cum, alpha: B x T_en
+            u: B x 1
+            win_idx: B
+            context: B x D_en
+
+        Returns the context and the updated attention_weights,
+        attention_weights_cum, alpha, u and win_idx.
         """
+        if self.local_attention and not self.training:
+            if inputs.shape[1] > self.local_win_back + self.local_win_front:
+                return self._local_step(query, inputs, processed_inputs, mask,
+                                        attention_weights, attention_weights_cum,
+                                        alpha, u, win_idx)
         if self.location_attention:
-            attention, _ = self.get_location_attention(
-                query, processed_inputs)
+            attention = self._get_location_attention(
+                query, processed_inputs, attention_weights, attention_weights_cum)
         else:
-            attention, _ = self.get_attention(
-                query, processed_inputs)
+            attention = self._get_attention(query, processed_inputs)
         # apply masking
         if mask is not None:
-            attention.data.masked_fill_(~mask, self._mask_value)
+            attention = attention.masked_fill(~mask, self._mask_value)
         # apply windowing - only in eval mode
         if not self.training and self.windowing:
-            attention = self.apply_windowing(attention, inputs)
+            positions = torch.arange(attention.shape[1], device=attention.device).unsqueeze(0)
+            attention, win_idx = self._apply_windowing(attention, win_idx, positions)
 
         # normalize attention values
         if self.norm == "softmax":
@@ -354,21 +469,105 @@ class OriginalAttention(nn.Module):
             raise ValueError("Unknown value for attention norm type")
 
         if self.location_attention:
-            self.update_location_attention(alignment)
+            attention_weights_cum = attention_weights_cum + alignment
 
         # apply forward attention if enabled
         if self.forward_attn:
-            alignment = self.apply_forward_attention(alignment)
-            self.alpha = alignment
+            alignment = self._apply_forward_attention(alignment, alpha, u)
+            alpha = alignment
 
         context = torch.bmm(alignment.unsqueeze(1), inputs)
         context = context.squeeze(1)
-        self.attention_weights = alignment
 
         # compute transition agent
         if self.forward_attn and self.trans_agent:
             ta_input = torch.cat([context, query.squeeze(1)], dim=-1)
-            self.u = torch.sigmoid(self.ta(ta_input))
+            u = torch.sigmoid(self.ta(ta_input))
+        return context, alignment, attention_weights_cum, alpha, u, win_idx
+
+    def _local_step(self, query, inputs, processed_inputs, mask: Optional[torch.Tensor],
+                    attention_weights, attention_weights_cum, alpha, u, win_idx
+                    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        """``step()`` restricted to a window of encoder steps around the
+        previous alignment peak ``win_idx``."""
+        B, T = attention_weights.shape
+        W = self.local_win_back + self.local_win_front
+        # window start, kept inside the input
+        start = (win_idx.clamp(min=0) - self.local_win_back).clamp(0, T - W)
+        # B x W
+        positions = start.unsqueeze(1) + torch.arange(W, device=inputs.device).unsqueeze(0)
+        local_processed_inputs = processed_inputs.gather(
+            1, positions.unsqueeze(2).expand(-1, -1, processed_inputs.shape[2]))
+        processed_query = self.query_layer(query.unsqueeze(1))
+        if self.location_attention:
+            # location features of the window need the neighbouring steps,
+            # which are zero outside of the input as with conv padding.
+            conv = self.location_layer.location_conv1d
+            pad = (conv.kernel_size[0] - 1) // 2
+            conv_positions = start.unsqueeze(1) - pad + torch.arange(
+                W + 2 * pad, device=inputs.device).unsqueeze(0)
+            valid = ((conv_positions >= 0) & (conv_positions < T)).float()
+            conv_positions = conv_positions.clamp(0, T - 1)
+            attention_cat = torch.stack(
+                (attention_weights.gather(1, conv_positions) * valid,
+                 attention_weights_cum.gather(1, conv_positions) * valid), dim=1)
+            processed_attention_weights = self.location_layer.location_dense(
+                F.conv1d(attention_cat, conv.weight).transpose(1, 2))
+            attention = self.v(torch.tanh(processed_query + processed_attention_weights +
+                                          local_processed_inputs)).squeeze(-1)
+        else:
+            attention = self.v(torch.tanh(processed_query + local_processed_inputs)).squeeze(-1)
+        if mask is not None:
+            attention = attention.masked_fill(~mask.gather(1, positions), self._mask_value)
+        if self.windowing:
+            attention, win_idx = self._apply_windowing(attention, win_idx, positions)
+
+        if self.norm == "softmax":
+            alignment = torch.softmax(attention, dim=-1)
+        elif self.norm == "sigmoid":
+            alignment = torch.sigmoid(attention) / torch.sigmoid(
+                attention).sum(
+                    dim=1, keepdim=True)
+        else:
+            raise ValueError("Unknown value for attention norm type")
+
+        if self.location_attention:
+            attention_weights_cum = attention_weights_cum.scatter_add(1, positions, alignment)
+
+        if self.forward_attn:
+            alignment = self._apply_forward_attention(
+                attention_weights.new_zeros(B, T).scatter(1, positions, alignment), alpha, u)
+            alpha = alignment
+            local_alignment = alignment.gather(1, positions)
+        else:
+            local_alignment = alignment
+            alignment = attention_weights.new_zeros(B, T).scatter(1, positions, alignment)
+
+        context = torch.bmm(local_alignment.unsqueeze(1), inputs.gather(
+            1, positions.unsqueeze(2).expand(-1, -1, inputs.shape[2])))
+        context = context.squeeze(1)
+
+        if not self.windowing:
+            # move the window with the alignment peak
+            win_idx = positions.gather(1, torch.argmax(local_alignment, 1, keepdim=True)).squeeze(1)
+
+        if self.forward_attn and self.trans_agent:
+            ta_input = torch.cat([context, query.squeeze(1)], dim=-1)
+            u = torch.sigmoid(self.ta(ta_input))
+        return context, alignment, attention_weights_cum, alpha, u, win_idx
+
+    @torch.jit.unused
+    def forward(self, query, inputs, processed_inputs, mask):
+        """
+        shapes:
+            query: B x D_attn_rnn
+            inputs: B x T_en x D_en
+            processed_inputs:: B x T_en x D_attn
+            mask: B x T_en
+        """
+        outputs = self.step(query, inputs, processed_inputs, mask, *self.get_states())
+        context = outputs[0]
+        self.set_states(*outputs[1:])
         return context
 
 
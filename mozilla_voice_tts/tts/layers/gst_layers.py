@@ -2,6 +2,8 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from .common_layers import fold_batch_norm
+
 
 class GST(nn.Module):
     """Global Style Token Module for factorizing prosody in speech.
@@ -55,6 +57,12 @@ class ReferenceEncoder(nn.Module):
             hidden_size=embedding_dim // 2,
             batch_first=True)
 
+    def fold_batch_norm(self):
+        """Fold the batch norms into the convolutions for inference."""
+        for conv, bn in zip(self.convs, self.bns):
+            fold_batch_norm(conv, bn)
+        self.bns = nn.ModuleList([nn.Identity() for _ in self.bns])
+
     def forward(self, inputs):
         batch_size = inputs.size(0)
         x = inputs.view(batch_size, 1, -1, self.num_mel)
@@ -71,7 +79,9 @@ class ReferenceEncoder(nn.Module):
         x = x.contiguous().view(batch_size, post_conv_width, -1)
         # x: 3D tensor [batch_size, post_conv_width,
         #               num_channels*post_conv_height]
-        self.recurrence.flatten_parameters()
+        # quantized RNNs do not have flat weights
+        if hasattr(self.recurrence, 'flatten_parameters'):
+            self.recurrence.flatten_parameters()
         _, out = self.recurrence(x)
         # out: 3D tensor [seq_len==1, batch_size, encoding_size=128]
 
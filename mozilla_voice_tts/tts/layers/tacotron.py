@@ -1,7 +1,8 @@
 # coding: utf-8
 import torch
 from torch import nn
-from .common_layers import Prenet, init_attn
+from .common_layers import Prenet, init_attn, fold_batch_norm
+from ..utils.generic_utils import GrowingBuffer
 
 
 class BatchNormConv1d(nn.Module):
@@ -57,6 +58,11 @@ class BatchNormConv1d(nn.Module):
         torch.nn.init.xavier_uniform_(
             self.conv1d.weight, gain=torch.nn.init.calculate_gain(w_gain))
 
+    def fold_batch_norm(self):
+        """Fold the batch norm into the convolution for inference."""
+        fold_batch_norm(self.conv1d, self.bn)
+        self.bn = nn.Identity()
+
     def forward(self, x):
         x = self.padder(x)
         x = self.conv1d(x)
@@ -200,7 +206,9 @@ class CBHG(nn.Module):
             x = highway(x)
         # (B, T_in, hid_features*2)
         # TODO: replace GRU with convolution as in Deep Voice 3
-        self.gru.flatten_parameters()
+        # quantized RNNs do not have flat weights
+        if hasattr(self.gru, 'flatten_parameters'):
+            self.gru.flatten_parameters()
         outputs, _ = self.gru(x)
         return outputs
 
@@ -301,6 +309,9 @@ class Decoder(nn.Module):
         self.memory_size = memory_size if memory_size > 0 else r
         self.frame_channels = frame_channels
         self.separate_stopnet = separate_stopnet
+        # if false, inference only keeps the attended encoder step of each
+        # decoder step instead of the whole alignment.
+        self.record_alignments = True
         self.query_dim = 256
         # memory -> |Prenet| -> processed_memory
         prenet_dim = frame_channels * self.memory_size if self.use_memory_queue else frame_channels
@@ -350,7 +361,7 @@ class Decoder(nn.Module):
         memory = memory.transpose(0, 1)
         return memory
 
-    def _init_states(self, inputs):
+    def _init_states(self, inputs, processed_inputs=None):
         """
         Initialization of decoder states
         """
@@ -368,13 +379,19 @@ class Decoder(nn.Module):
         ]
         self.context_vec = inputs.data.new(B, self.in_channels).zero_()
         # cache attention inputs
-        self.processed_inputs = self.attention.preprocess_inputs(inputs)
+        if processed_inputs is None:
+            processed_inputs = self.attention.preprocess_inputs(inputs)
+        self.processed_inputs = processed_inputs
 
     def _parse_outputs(self, outputs, attentions, stop_tokens):
+        # lists of decoder steps or buffers
+        outputs, attentions, stop_tokens = [
+            x.get() if isinstance(x, GrowingBuffer) else torch.stack(x)
+            for x in (outputs, attentions, stop_tokens)]
         # Back to batch first
-        attentions = torch.stack(attentions).transpose(0, 1)
-        stop_tokens = torch.stack(stop_tokens).transpose(0, 1)
-        outputs = torch.stack(outputs).transpose(0, 1).contiguous()
+        attentions = attentions.transpose(0, 1)
+        stop_tokens = stop_tokens.transpose(0, 1)
+        outputs = outputs.transpose(0, 1).contiguous()
         outputs = outputs.view(
             outputs.size(0), -1, self.frame_channels)
         outputs = outputs.transpose(1, 2)
@@ -462,29 +479,32 @@ class Decoder(nn.Module):
             t += 1
         return self._parse_outputs(outputs, attentions, stop_tokens)
 
-    def inference(self, inputs):
+    def inference(self, inputs, processed_inputs=None):
         """
         Args:
             inputs: encoder outputs.
+            processed_inputs: ``attention.preprocess_inputs(inputs)`` if
+                it is already computed.
         Shapes:
             - inputs: batch x time x encoder_out_dim
+            - attentions: batch x time x encoder_time, or the attended
+              encoder steps batch x time if ``record_alignments`` is false.
         """
-        outputs = []
-        attentions = []
-        stop_tokens = []
+        outputs = GrowingBuffer()
+        attentions = GrowingBuffer()
+        stop_tokens = GrowingBuffer()
         t = 0
-        self._init_states(inputs)
-        self.attention.init_win_idx()
+        self._init_states(inputs, processed_inputs)
         self.attention.init_states(inputs)
         while True:
             if t > 0:
-                new_memory = outputs[-1]
+                new_memory = outputs.last()
                 self._update_memory_input(new_memory)
             output, stop_token, attention = self.decode(inputs, None)
             stop_token = torch.sigmoid(stop_token.data)
-            outputs += [output]
-            attentions += [attention]
-            stop_tokens += [stop_token]
+            outputs.append(output)
+            attentions.append(attention if self.record_alignments else attention.argmax(1))
+            stop_tokens.append(stop_token)
             t += 1
             if t > inputs.shape[1] / 4 and (stop_token > 0.6
                                             or attention[:, -1].item() > 0.6):
@@ -1,7 +1,10 @@
+from typing import List, NamedTuple, Optional, Tuple
+
 import torch
 from torch import nn
 from torch.nn import functional as F
-from .common_layers import init_attn, Prenet, Linear
+from .common_layers import init_attn, fold_batch_norm, Prenet, Linear, OriginalAttention
+from ..utils.generic_utils import GrowingBuffer
 
 # NOTE: linter has a problem with the current TF release
 #pylint: disable=no-value-for-parameter
@@ -36,6 +39,13 @@ class ConvBNBlock(nn.Module):
         else:
             self.activation = nn.Identity()
 
+    def fold_batch_norm(self):
+        """Fold the batch norm into the convolution and remove the dropout
+        for inference."""
+        fold_batch_norm(self.convolution1d, self.batch_normalization)
+        self.batch_normalization = nn.Identity()
+        self.dropout = nn.Identity()
+
     def forward(self, x):
         o = self.convolution1d(x)
         o = self.batch_normalization(o)
@@ -52,6 +62,7 @@ class Postnet(nn.Module):
 
     Shapes:
         - input: (B, C_in, T)
+        - mask: (B, 1, T)
         - output: (B, C_in, T)
     """
     def __init__(self, in_out_channels, num_convs=5):
@@ -65,10 +76,13 @@ class Postnet(nn.Module):
         self.convolutions.append(
             ConvBNBlock(512, in_out_channels, kernel_size=5, activation=None))
 
-    def forward(self, x):
+    def forward(self, x, mask=None):
         o = x
         for layer in self.convolutions:
             o = layer(o)
+            if mask is not None:
+                # keep the padding frames zero, as in unbatched inference
+                o = o * mask
         return o
 
 
@@ -104,18 +118,35 @@ class Encoder(nn.Module):
         o = nn.utils.rnn.pack_padded_sequence(o,
                                               input_lengths,
                                               batch_first=True)
-        self.lstm.flatten_parameters()
+        # quantized RNNs do not have flat weights
+        if hasattr(self.lstm, 'flatten_parameters'):
+            self.lstm.flatten_parameters()
         o, _ = self.lstm(o)
         o, _ = nn.utils.rnn.pad_packed_sequence(o, batch_first=True)
         return o
 
-    def inference(self, x):
+    def inference(self, x, input_lengths=None):
         o = x
+        if input_lengths is not None:
+            # padded batch - zero the padding after each conv so that it
+            # does not leak into the real time steps
+            mask = torch.arange(o.size(2), device=o.device)[None, :] < input_lengths[:, None]
+            mask = mask.unsqueeze(1).type_as(o)
         for layer in self.convolutions:
             o = layer(o)
+            if input_lengths is not None:
+                o = o * mask
         o = o.transpose(1, 2)
+        if input_lengths is not None:
+            # pack to keep the padding out of the backward LSTM
+            o = nn.utils.rnn.pack_padded_sequence(o,
+                                                  input_lengths.cpu(),
+                                                  batch_first=True,
+                                                  enforce_sorted=False)
         # self.lstm.flatten_parameters()
         o, _ = self.lstm(o)
+        if input_lengths is not None:
+            o, _ = nn.utils.rnn.pad_packed_sequence(o, batch_first=True)
         return o
 
 
@@ -204,6 +235,21 @@ class Decoder(nn.Module):
                    bias=True,
                    init_gain='sigmoid'))
         self.memory_truncated = None
+        self.scripted_step = None
+        # if false, inference only keeps the attended encoder step of each
+        # decoder step instead of the whole alignment.
+        self.record_alignments = True
+
+    def script_step(self):
+        """Compile the decoder step with TorchScript. ``forward()`` and
+        ``inference()`` run the compiled decoder loops afterwards. Call it
+        after moving the model to its device. Only the original attention is
+        supported."""
+        assert isinstance(self.attention, OriginalAttention), \
+            " [!] Only the original attention can be compiled."
+        # not registered as a submodule to keep the state dict unchanged.
+        # It shares its parameters with the decoder.
+        object.__setattr__(self, 'scripted_step', torch.jit.script(DecoderStep(self)))
 
     def set_r(self, new_r):
         self.r = new_r
@@ -214,7 +260,7 @@ class Decoder(nn.Module):
             B, self.frame_channels * self.r)
         return memory
 
-    def _init_states(self, inputs, mask, keep_states=False):
+    def _init_states(self, inputs, mask, keep_states=False, processed_inputs=None):
         B = inputs.size(0)
         # T = inputs.size(1)
         if not keep_states:
@@ -229,7 +275,9 @@ class Decoder(nn.Module):
             self.context = torch.zeros(1, device=inputs.device).repeat(
                 B, self.encoder_embedding_dim)
         self.inputs = inputs
-        self.processed_inputs = self.attention.preprocess_inputs(inputs)
+        if processed_inputs is None:
+            processed_inputs = self.attention.preprocess_inputs(inputs)
+        self.processed_inputs = processed_inputs
         self.mask = mask
 
     def _reshape_memory(self, memory):
@@ -244,13 +292,22 @@ class Decoder(nn.Module):
         return memory
 
     def _parse_outputs(self, outputs, stop_tokens, alignments):
-        alignments = torch.stack(alignments).transpose(0, 1)
-        stop_tokens = torch.stack(stop_tokens).transpose(0, 1)
-        outputs = torch.stack(outputs).transpose(0, 1).contiguous()
+        # lists of decoder steps or buffers
+        outputs, stop_tokens, alignments = [
+            x.get() if isinstance(x, GrowingBuffer) else torch.stack(x)
+            for x in (outputs, stop_tokens, alignments)]
+        alignments = alignments.transpose(0, 1)
+        stop_tokens = stop_tokens.transpose(0, 1)
+        outputs = outputs.transpose(0, 1).contiguous()
         outputs = outputs.view(outputs.size(0), -1, self.frame_channels)
         outputs = outputs.transpose(1, 2)
         return outputs, stop_tokens, alignments
 
+    def _get_states(self):
+        return DecoderStates(self.query, self.attention_rnn_cell_state,
+                             self.decoder_hidden, self.decoder_cell, self.context,
+                             *self.attention.get_states())
+
     def _update_memory(self, memory):
         if len(memory.shape) == 2:
             return memory[:, self.frame_channels * (self.r - 1):]
@@ -320,6 +377,15 @@ class Decoder(nn.Module):
         self._init_states(inputs, mask=mask)
         self.attention.init_states(inputs)
 
+        if self.scripted_step is not None:
+            self.scripted_step.train(self.training)
+            outputs, stop_tokens, alignments = self.scripted_step.teacher_forcing(
+                memories, self._get_states(), self.inputs, self.processed_inputs,
+                self.mask, self.r)
+            outputs, stop_tokens, alignments = self._parse_outputs(
+                outputs, stop_tokens, alignments)
+            return outputs, alignments, stop_tokens
+
         outputs, stop_tokens, alignments = [], [], []
         while len(outputs) < memories.size(0) - 1:
             memory = memories[len(outputs)]
@@ -332,46 +398,166 @@ class Decoder(nn.Module):
             outputs, stop_tokens, alignments)
         return outputs, alignments, stop_tokens
 
-    def inference(self, inputs):
+    def _select_states(self, idx):
+        """Keep only the decoder states of the given batch items."""
+        self.query = self.query[idx]
+        self.attention_rnn_cell_state = self.attention_rnn_cell_state[idx]
+        self.decoder_hidden = self.decoder_hidden[idx]
+        self.decoder_cell = self.decoder_cell[idx]
+        self.context = self.context[idx]
+        self.inputs = self.inputs[idx]
+        if self.processed_inputs is not None:
+            self.processed_inputs = self.processed_inputs[idx]
+        if self.mask is not None:
+            self.mask = self.mask[idx]
+        self.attention.select_states(idx)
+
+    def inference(self, inputs, mask=None, processed_inputs=None):
         r"""Decoder inference without teacher forcing and use
         Stopnet to stop decoder.
         Args:
             inputs: Encoder outputs.
+            mask: Attention mask for sequence padding. Needed for
+                padded batches.
+            processed_inputs: ``attention.preprocess_inputs(inputs)`` if
+                it is already computed.
 
         Shapes:
             - inputs: (B, T, D_out_enc)
             - outputs: (B, T_mel, D_mel)
-            - alignments: (B, T_in, T_out)
+            - alignments: (B, T_in, T_out), or the attended encoder steps
+              (B, T_out) if ``record_alignments`` is false.
             - stop_tokens: (B, T_out)
         """
+        if self.scripted_step is not None:
+            # batch items are decoded until all of them stop
+            memory = self.get_go_frame(inputs)
+            memory = self._update_memory(memory)
+            self._init_states(inputs, mask=mask, processed_inputs=processed_inputs)
+            self.attention.init_states(inputs)
+            self.scripted_step.train(self.training)
+            outputs, stop_tokens, alignments = self.scripted_step.inference(
+                memory, self._get_states(), self.inputs, self.processed_inputs,
+                self.mask, self.r, self.max_decoder_steps, self.stop_threshold,
+                self.record_alignments)
+            if len(outputs) == self.max_decoder_steps:
+                print("   | > Decoder stopped with 'max_decoder_steps")
+            outputs, stop_tokens, alignments = self._parse_outputs(
+                outputs, stop_tokens, alignments)
+            return outputs, alignments, stop_tokens
+        outputs, alignments, stop_tokens, _ = self.inference_batch(inputs, mask, processed_inputs)
+        return outputs, alignments, stop_tokens
+
+    def inference_batch(self, inputs, mask=None, processed_inputs=None):
+        r"""Batched decoder inference. Each item stops decoding on its own
+        stop token and is then removed from the batch so that finished items
+        do not cost any more compute.
+
+        Args:
+            inputs: Encoder outputs.
+            mask: Attention mask for sequence padding.
+            processed_inputs: ``attention.preprocess_inputs(inputs)`` if
+                it is already computed.
+
+        Shapes:
+            - inputs: (B, T, D_out_enc)
+            - mask: (B, T)
+            - outputs: (B, T_mel, D_mel)
+            - alignments: (B, T_in, T_out), or the attended encoder steps
+              (B, T_out) if ``record_alignments`` is false.
+            - stop_tokens: (B, T_out)
+            - output_lengths: (B, )
+        """
+        B = inputs.size(0)
         memory = self.get_go_frame(inputs)
         memory = self._update_memory(memory)
 
-        self._init_states(inputs, mask=None)
+        self._init_states(inputs, mask=mask, processed_inputs=processed_inputs)
         self.attention.init_states(inputs)
 
-        outputs, stop_tokens, alignments, t = [], [], [], 0
+        # batch indices of the items that are still decoding
+        active_idxs = torch.arange(B, device=inputs.device)
+        output_lengths = torch.zeros(B, dtype=torch.long, device=inputs.device)
+        outputs, stop_tokens, alignments = GrowingBuffer(), GrowingBuffer(), GrowingBuffer()
+        t = 0
         while True:
             memory = self.prenet(memory)
             decoder_output, alignment, stop_token = self.decode(memory)
             stop_token = torch.sigmoid(stop_token.data)
-            outputs += [decoder_output.squeeze(1)]
-            stop_tokens += [stop_token]
-            alignments += [alignment]
-
-            if stop_token > self.stop_threshold and t > inputs.shape[0] // 2:
+            if not self.record_alignments:
+                alignment = alignment.argmax(1)
+            output_lengths[active_idxs] = t + 1
+            # ignore the stop token at the first step
+            stop_flags = stop_token.squeeze(1) > self.stop_threshold
+            if t == 0:
+                stop_flags.fill_(False)
+
+            if active_idxs.size(0) < B:
+                # write the active items back into a full batch.
+                # Finished items get zero frames and stop tokens set.
+                outputs.append(decoder_output.new_zeros(B, decoder_output.size(1)).index_copy_(
+                    0, active_idxs, decoder_output))
+                stop_tokens.append(stop_token.new_ones(B, 1).index_copy_(
+                    0, active_idxs, stop_token))
+                alignments.append(alignment.new_zeros((B, ) + alignment.shape[1:]).index_copy_(
+                    0, active_idxs, alignment))
+            else:
+                outputs.append(decoder_output)
+                stop_tokens.append(stop_token)
+                alignments.append(alignment)
+
+            num_stopped = int(stop_flags.sum())
+            if num_stopped == active_idxs.size(0):
                 break
             if len(outputs) == self.max_decoder_steps:
                 print("   | > Decoder stopped with 'max_decoder_steps")
                 break
 
+            if num_stopped > 0:
+                keep_idxs = (~stop_flags).nonzero().squeeze(1)
+                active_idxs = active_idxs[keep_idxs]
+                decoder_output = decoder_output[keep_idxs]
+                self._select_states(keep_idxs)
             memory = self._update_memory(decoder_output)
             t += 1
 
         outputs, stop_tokens, alignments = self._parse_outputs(
             outputs, stop_tokens, alignments)
+        return outputs, alignments, stop_tokens, output_lengths * self.r
 
-        return outputs, alignments, stop_tokens
+    def inference_stream(self, inputs):
+        r"""Decoder inference as a generator that yields the output frames
+        of each decoder step as soon as they are computed. Uses the same
+        stopping criteria as ``inference()``.
+
+        Args:
+            inputs: Encoder outputs of a single sentence.
+
+        Shapes:
+            - inputs: (1, T, D_out_enc)
+            - outputs: (1, D_mel, r)
+        """
+        memory = self.get_go_frame(inputs)
+        memory = self._update_memory(memory)
+
+        self._init_states(inputs, mask=None)
+        self.attention.init_states(inputs)
+
+        t = 0
+        while True:
+            memory = self.prenet(memory)
+            decoder_output, _, stop_token = self.decode(memory)
+            stop_token = torch.sigmoid(stop_token.data)
+            yield decoder_output.view(-1, self.r, self.frame_channels).transpose(1, 2)
+
+            if stop_token > self.stop_threshold and t > 0:
+                break
+            if t + 1 == self.max_decoder_steps:
+                print("   | > Decoder stopped with 'max_decoder_steps")
+                break
+
+            memory = self._update_memory(decoder_output)
+            t += 1
 
     def inference_truncated(self, inputs):
         """
@@ -383,7 +569,6 @@ class Decoder(nn.Module):
         else:
             self._init_states(inputs, mask=None, keep_states=True)
 
-        self.attention.init_win_idx()
         self.attention.init_states(inputs)
         outputs, stop_tokens, alignments, t = [], [], [], 0
         while True:
@@ -421,3 +606,134 @@ class Decoder(nn.Module):
         stop_token = torch.sigmoid(stop_token.data)
         memory = decoder_output
         return decoder_output, stop_token, alignment
+
+
+class DecoderStates(NamedTuple):
+    """Recurrent states of the Tacotron2 decoder and its attention."""
+    query: torch.Tensor
+    attention_rnn_cell_state: torch.Tensor
+    decoder_hidden: torch.Tensor
+    decoder_cell: torch.Tensor
+    context: torch.Tensor
+    attention_weights: torch.Tensor
+    attention_weights_cum: torch.Tensor
+    alpha: torch.Tensor
+    u: torch.Tensor
+    win_idx: torch.Tensor
+
+
+class DecoderStep(nn.Module):
+    r"""Functional version of ``Decoder.decode()`` with the states passed
+    explicitly, so that it can be compiled with TorchScript together with
+    the teacher forcing and inference loops. It shares the layers of the
+    given decoder.
+
+    Args:
+        decoder (Decoder): decoder with the original attention.
+    """
+    __constants__ = ['frame_channels', 'separate_stopnet', 'p_attention_dropout',
+                     'p_decoder_dropout']
+
+    def __init__(self, decoder):
+        super(DecoderStep, self).__init__()
+        self.prenet = decoder.prenet
+        self.attention_rnn = decoder.attention_rnn
+        self.attention = decoder.attention
+        self.decoder_rnn = decoder.decoder_rnn
+        self.linear_projection = decoder.linear_projection
+        self.stopnet = decoder.stopnet
+        self.frame_channels = decoder.frame_channels
+        self.separate_stopnet = decoder.separate_stopnet
+        self.p_attention_dropout = decoder.p_attention_dropout
+        self.p_decoder_dropout = decoder.p_decoder_dropout
+
+    def forward(self, memory, states: DecoderStates, inputs, processed_inputs,
+                mask: Optional[torch.Tensor], r: int
+                ) -> Tuple[torch.Tensor, torch.Tensor, DecoderStates]:
+        """
+        shapes:
+            - memory: B x D_prenet, prenet outputs of the previous frame.
+            - decoder_output: B x (r * frame_channels)
+            - stop_token: B x 1, before the sigmoid.
+        """
+        query_input = torch.cat((memory, states.context), -1)
+        query, attention_rnn_cell_state = self.attention_rnn(
+            query_input, (states.query, states.attention_rnn_cell_state))
+        query = F.dropout(query, self.p_attention_dropout, self.training)
+        attention_rnn_cell_state = F.dropout(
+            attention_rnn_cell_state, self.p_attention_dropout, self.training)
+        context, attention_weights, attention_weights_cum, alpha, u, win_idx = self.attention.step(
+            query, inputs, processed_inputs, mask, states.attention_weights,
+            states.attention_weights_cum, states.alpha, states.u, states.win_idx)
+        decoder_rnn_input = torch.cat((query, context), -1)
+        decoder_hidden, decoder_cell = self.decoder_rnn(
+            decoder_rnn_input, (states.decoder_hidden, states.decoder_cell))
+        decoder_hidden = F.dropout(decoder_hidden, self.p_decoder_dropout, self.training)
+        decoder_hidden_context = torch.cat((decoder_hidden, context), dim=1)
+        decoder_output = self.linear_projection(decoder_hidden_context)
+        stopnet_input = torch.cat((decoder_hidden, decoder_output), dim=1)
+        if self.separate_stopnet:
+            stop_token = self.stopnet(stopnet_input.detach())
+        else:
+            stop_token = self.stopnet(stopnet_input)
+        decoder_output = decoder_output[:, :r * self.frame_channels]
+        states = DecoderStates(query, attention_rnn_cell_state, decoder_hidden,
+                               decoder_cell, context, attention_weights,
+                               attention_weights_cum, alpha, u, win_idx)
+        return decoder_output, stop_token, states
+
+    @torch.jit.export
+    def teacher_forcing(self, memories, states: DecoderStates, inputs, processed_inputs,
+                        mask: Optional[torch.Tensor], r: int
+                        ) -> Tuple[List[torch.Tensor], List[torch.Tensor], List[torch.Tensor]]:
+        """Teacher forcing loop of ``Decoder.forward()``.
+
+        shapes:
+            - memories: T_decoder x B x D_prenet, prenet outputs of the
+              go frame and the target frames.
+        """
+        outputs: List[torch.Tensor] = []
+        stop_tokens: List[torch.Tensor] = []
+        alignments: List[torch.Tensor] = []
+        for t in range(memories.size(0) - 1):
+            decoder_output, stop_token, states = self.forward(
+                memories[t], states, inputs, processed_inputs, mask, r)
+            outputs.append(decoder_output)
+            stop_tokens.append(stop_token.squeeze(1))
+            alignments.append(states.attention_weights)
+        return outputs, stop_tokens, alignments
+
+    @torch.jit.export
+    def inference(self, memory, states: DecoderStates, inputs, processed_inputs,
+                  mask: Optional[torch.Tensor], r: int, max_decoder_steps: int,
+                  stop_threshold: float, record_alignments: bool = True
+                  ) -> Tuple[List[torch.Tensor], List[torch.Tensor], List[torch.Tensor]]:
+        """Inference loop of ``Decoder.inference()``. Decodes until the stop
+        tokens of all the batch items are above the threshold. Only the
+        attended encoder steps are kept if ``record_alignments`` is false.
+
+        shapes:
+            - memory: B x frame_channels, the go frame.
+        """
+        outputs: List[torch.Tensor] = []
+        stop_tokens: List[torch.Tensor] = []
+        alignments: List[torch.Tensor] = []
+        t = 0
+        while True:
+            memory = self.prenet(memory)
+            decoder_output, stop_token, states = self.forward(
+                memory, states, inputs, processed_inputs, mask, r)
+            stop_token = torch.sigmoid(stop_token)
+            outputs.append(decoder_output)
+            stop_tokens.append(stop_token)
+            if record_alignments:
+                alignments.append(states.attention_weights)
+            else:
+                alignments.append(states.attention_weights.argmax(1))
+            if bool((stop_token > stop_threshold).all()) and t > 0:
+                break
+            if len(outputs) == max_decoder_steps:
+                break
+            memory = decoder_output[:, self.frame_channels * (r - 1):]
+            t += 1
+        return outputs, stop_tokens, alignments
@@ -143,10 +143,8 @@ class Tacotron(TacotronAbstract):
             return  decoder_outputs, postnet_outputs, alignments, stop_tokens, decoder_outputs_backward, alignments_backward
         return decoder_outputs, postnet_outputs, alignments, stop_tokens
 
-    @torch.no_grad()
-    def inference(self, characters, speaker_ids=None, style_mel=None, speaker_embeddings=None):
-        inputs = self.embedding(characters)
-        encoder_outputs = self.encoder(inputs)
+    def _add_conditioning(self, encoder_outputs, speaker_ids, style_mel, speaker_embeddings):
+        """Concatenate the GST and speaker embeddings to the encoder outputs."""
         if self.gst:
             # B x gst_dim
             encoder_outputs = self.compute_gst(encoder_outputs, style_mel)
@@ -158,8 +156,16 @@ class Tacotron(TacotronAbstract):
                 # B x 1 x speaker_embed_dim
                 speaker_embeddings = torch.unsqueeze(speaker_embeddings, 1)
             encoder_outputs = self._concat_speaker_embedding(encoder_outputs, speaker_embeddings)
+        return encoder_outputs
+
+    @torch.no_grad()
+    def inference(self, characters, speaker_ids=None, style_mel=None, speaker_embeddings=None):
+        encoder_outputs, processed_inputs = self.encode_cached(
+            characters,
+            lambda: self.encoder(self.embedding(characters)),
+            lambda outputs: self._add_conditioning(outputs, speaker_ids, style_mel, speaker_embeddings))
         decoder_outputs, alignments, stop_tokens = self.decoder.inference(
-            encoder_outputs)
+            encoder_outputs, processed_inputs=processed_inputs)
         postnet_outputs = self.postnet(decoder_outputs)
         postnet_outputs = self.last_linear(postnet_outputs)
         decoder_outputs = decoder_outputs.transpose(1, 2)
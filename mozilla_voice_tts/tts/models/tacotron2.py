@@ -137,11 +137,8 @@ class Tacotron2(TacotronAbstract):
             return  decoder_outputs, postnet_outputs, alignments, stop_tokens, decoder_outputs_backward, alignments_backward
         return decoder_outputs, postnet_outputs, alignments, stop_tokens
 
-    @torch.no_grad()
-    def inference(self, text, speaker_ids=None, style_mel=None, speaker_embeddings=None):
-        embedded_inputs = self.embedding(text).transpose(1, 2)
-        encoder_outputs = self.encoder.inference(embedded_inputs)
-
+    def _add_conditioning(self, encoder_outputs, speaker_ids, style_mel, speaker_embeddings):
+        """Concatenate the GST and speaker embeddings to the encoder outputs."""
         if self.gst:
             # B x gst_dim
             encoder_outputs = self.compute_gst(encoder_outputs, style_mel)
@@ -150,15 +147,104 @@ class Tacotron2(TacotronAbstract):
             if not self.embeddings_per_sample:
                 speaker_embeddings = self.speaker_embedding(speaker_ids)[:, None]
             encoder_outputs = self._concat_speaker_embedding(encoder_outputs, speaker_embeddings)
+        return encoder_outputs
+
+    @torch.no_grad()
+    def inference(self, text, speaker_ids=None, style_mel=None, speaker_embeddings=None):
+        encoder_outputs, processed_inputs = self.encode_cached(
+            text,
+            lambda: self.encoder.inference(self.embedding(text).transpose(1, 2)),
+            lambda outputs: self._add_conditioning(outputs, speaker_ids, style_mel, speaker_embeddings))
 
         decoder_outputs, alignments, stop_tokens = self.decoder.inference(
-            encoder_outputs)
+            encoder_outputs, processed_inputs=processed_inputs)
         postnet_outputs = self.postnet(decoder_outputs)
         postnet_outputs = decoder_outputs + postnet_outputs
         decoder_outputs, postnet_outputs, alignments = self.shape_outputs(
             decoder_outputs, postnet_outputs, alignments)
         return decoder_outputs, postnet_outputs, alignments, stop_tokens
 
+    @torch.no_grad()
+    def inference_batch(self, text, text_lengths, speaker_ids=None, style_mel=None, speaker_embeddings=None):
+        """Inference on a padded batch of sentences.
+
+        Shapes:
+            - text: (B, T_in)
+            - text_lengths: (B, )
+            - mel_lengths: (B, )
+        """
+        input_mask, _ = self.compute_masks(text_lengths, None)
+        embedded_inputs = self.embedding(text).transpose(1, 2)
+        encoder_outputs = self.encoder.inference(embedded_inputs, text_lengths)
+
+        encoder_outputs = self._add_conditioning(encoder_outputs, speaker_ids, style_mel, speaker_embeddings)
+
+        decoder_outputs, alignments, stop_tokens, mel_lengths = self.decoder.inference_batch(
+            encoder_outputs, input_mask)
+        # keep the padding frames out of the postnet convolutions
+        _, output_mask = self.compute_masks(text_lengths, mel_lengths)
+        output_mask = output_mask.unsqueeze(1).type_as(decoder_outputs)
+        decoder_outputs = decoder_outputs * output_mask
+        postnet_outputs = self.postnet(decoder_outputs, output_mask)
+        postnet_outputs = decoder_outputs + postnet_outputs
+        decoder_outputs, postnet_outputs, alignments = self.shape_outputs(
+            decoder_outputs, postnet_outputs, alignments)
+        return decoder_outputs, postnet_outputs, alignments, stop_tokens, mel_lengths
+
+    @torch.no_grad()
+    def inference_stream(self, text, chunk_size=16, speaker_ids=None, style_mel=None, speaker_embeddings=None):
+        """Inference as a generator that yields chunks of postnet outputs
+        while the decoder is still running.
+
+        The postnet is run on each chunk together with enough decoder frames
+        on both sides to cover its receptive field, so that the concatenated
+        chunks are identical to the postnet outputs of ``inference()``.
+
+        Args:
+            text (Tensor): character ids of a single sentence.
+            chunk_size (int): number of frames per yielded chunk. The last
+                chunk might be shorter.
+
+        Shapes:
+            - text: (1, T_in)
+            - outputs: (1, T_chunk, D_mel)
+        """
+        embedded_inputs = self.embedding(text).transpose(1, 2)
+        encoder_outputs = self.encoder.inference(embedded_inputs)
+
+        encoder_outputs = self._add_conditioning(encoder_outputs, speaker_ids, style_mel, speaker_embeddings)
+
+        # number of frames each postnet output depends on at either side
+        context = sum(layer.convolution1d.padding[0] for layer in self.postnet.convolutions)
+        # decoder frames starting at the global frame index `offset`
+        frames, offset, num_frames, num_yielded = [], 0, 0, 0
+        for decoder_output in self.decoder.inference_stream(encoder_outputs):
+            frames.append(decoder_output)
+            num_frames += decoder_output.size(2)
+            while num_frames - num_yielded >= chunk_size + context:
+                frames = [torch.cat(frames, 2)]
+                yield self._postnet_chunk(frames[0], offset, num_yielded, num_yielded + chunk_size, context)
+                num_yielded += chunk_size
+                # drop the frames that are not needed for the next chunks
+                drop = max(0, num_yielded - context - offset)
+                frames[0] = frames[0][:, :, drop:]
+                offset += drop
+        decoder_outputs = torch.cat(frames, 2)
+        while num_yielded < num_frames:
+            end = min(num_yielded + chunk_size, num_frames)
+            yield self._postnet_chunk(decoder_outputs, offset, num_yielded, end, context)
+            num_yielded = end
+
+    def _postnet_chunk(self, decoder_outputs, offset, start, end, context):
+        """Run the postnet on the frames [start, end) of the decoder outputs
+        that are available from the frame `offset` on."""
+        win_start = max(start - context, offset)
+        win_end = min(end + context, offset + decoder_outputs.size(2))
+        window = decoder_outputs[:, :, win_start - offset:win_end - offset]
+        postnet_outputs = window + self.postnet(window)
+        postnet_outputs = postnet_outputs[:, :, start - win_start:end - win_start]
+        return postnet_outputs.transpose(1, 2)
+
     def inference_truncated(self, text, speaker_ids=None, style_mel=None, speaker_embeddings=None):
         """
         Preserve model states for continuous inference
@@ -166,14 +252,7 @@ class Tacotron2(TacotronAbstract):
         embedded_inputs = self.embedding(text).transpose(1, 2)
         encoder_outputs = self.encoder.inference_truncated(embedded_inputs)
 
-        if self.gst:
-            # B x gst_dim
-            encoder_outputs = self.compute_gst(encoder_outputs, style_mel)
-
-        if self.num_speakers > 1:
-            if not self.embeddings_per_sample:
-                speaker_embeddings = self.speaker_embedding(speaker_ids)[:, None]
-            encoder_outputs = self._concat_speaker_embedding(encoder_outputs, speaker_embeddings)
+        encoder_outputs = self._add_conditioning(encoder_outputs, speaker_ids, style_mel, speaker_embeddings)
 
         mel_outputs, alignments, stop_tokens = self.decoder.inference_truncated(
             encoder_outputs)
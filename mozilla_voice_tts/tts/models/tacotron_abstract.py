@@ -3,6 +3,7 @@ from abc import ABC, abstractmethod
 
 import torch
 from torch import nn
+from torch.nn import functional as F
 
 from mozilla_voice_tts.tts.utils.generic_utils import sequence_mask
 
@@ -87,6 +88,11 @@ class TacotronAbstract(ABC, nn.Module):
         self.speaker_embeddings = None
         self.speaker_embeddings_projected = None
 
+        # StyleCache of the GST embeddings for inference, None disables it
+        self.style_cache = None
+        # EncoderCache of the encoder outputs for inference, None disables it
+        self.encoder_cache = None
+
         # additional layers
         self.decoder_backward = None
         self.coarse_decoder = None
@@ -119,6 +125,23 @@ class TacotronAbstract(ABC, nn.Module):
     def inference(self):
         pass
 
+    def freeze(self):
+        """Prepare the model for inference, like ``remove_weight_norm()`` of
+        the vocoders. Batch norms are folded into the layers before them,
+        dropout modules are removed and gradients are disabled. The model
+        can not be trained afterwards and its state dict changes, so load
+        checkpoints before. Call it before ``decoder.script_step()``."""
+        self.eval()
+        for module in list(self.modules()):
+            if module is not self and hasattr(module, 'fold_batch_norm'):
+                module.fold_batch_norm()
+        for module in list(self.modules()):
+            for name, child in list(module.named_children()):
+                if isinstance(child, nn.Dropout):
+                    setattr(module, name, nn.Identity())
+        self.requires_grad_(False)
+        return self
+
     #############################
     # COMMON COMPUTE FUNCTIONS
     #############################
@@ -163,6 +186,38 @@ class TacotronAbstract(ABC, nn.Module):
         decoder_outputs_backward = decoder_outputs_backward[:, :T, :]
         return decoder_outputs_backward, alignments_backward
 
+    def encode_cached(self, text, encode_fn, condition_fn):
+        """Encode a sentence with ``encode_fn`` and add the speaker and style
+        conditioning to the encoder outputs with ``condition_fn``.
+
+        With an ``encoder_cache``, the encoder outputs of single sentences
+        and their part of the processed attention inputs are reused and the
+        processed attention inputs are returned for the decoder. Otherwise
+        they are None and the decoder computes them.
+        """
+        if self.encoder_cache is None or self.training or text.size(0) != 1:
+            return condition_fn(encode_fn()), None
+        key = tuple(text[0].tolist())
+        attention = self.decoder.attention
+        cached = self.encoder_cache.get(key)
+        if cached is None:
+            encoder_outputs = encode_fn()
+            inputs = condition_fn(encoder_outputs)
+            # the attention inputs layer has no bias, so its outputs are the
+            # sum of the encoder part and the conditioning part
+            processed_inputs = attention.preprocess_inputs(
+                F.pad(encoder_outputs, (0, inputs.size(2) - encoder_outputs.size(2))))
+            self.encoder_cache.put(key, (encoder_outputs, processed_inputs))
+        else:
+            encoder_outputs, processed_inputs = cached
+            inputs = condition_fn(encoder_outputs)
+        encoder_dim = encoder_outputs.size(2)
+        if processed_inputs is not None and inputs.size(2) > encoder_dim:
+            # the conditioning is the same at all the encoder steps
+            conditioning = F.pad(inputs[:, :1, encoder_dim:], (encoder_dim, 0))
+            processed_inputs = processed_inputs + attention.preprocess_inputs(conditioning)
+        return inputs, processed_inputs
+
     #############################
     # EMBEDDING FUNCTIONS
     #############################
@@ -181,7 +236,18 @@ class TacotronAbstract(ABC, nn.Module):
 
     def compute_gst(self, inputs, style_input):
         """ Compute global style token """
-        device = inputs.device
+        if self.style_cache is not None and style_input is not None and not self.training:
+            gst_outputs = self.style_cache.get_or_compute(
+                self.style_cache.style_key(style_input),
+                lambda: self.compute_gst_embedding(style_input, inputs.device))
+        else:
+            gst_outputs = self.compute_gst_embedding(style_input, inputs.device)
+        inputs = self._concat_speaker_embedding(inputs, gst_outputs)
+        return inputs
+
+    def compute_gst_embedding(self, style_input, device):
+        """ Compute the global style token embedding of a mel spectrogram
+        or a dict of token weights """
         if isinstance(style_input, dict):
             query = torch.zeros(1, 1, self.gst_embedding_dim//2).to(device)
             _GST = torch.tanh(self.gst_layer.style_token_layer.style_tokens)
@@ -194,8 +260,7 @@ class TacotronAbstract(ABC, nn.Module):
             gst_outputs = torch.zeros(1, 1, self.gst_embedding_dim).to(device)
         else:
             gst_outputs = self.gst_layer(style_input) # pylint: disable=not-callable
-        inputs = self._concat_speaker_embedding(inputs, gst_outputs)
-        return inputs
+        return gst_outputs
 
     @staticmethod
     def _add_speaker_embedding(outputs, speaker_embeddings):
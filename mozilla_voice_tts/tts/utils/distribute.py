@@ -1,6 +1,7 @@
 # edited from https://github.com/fastai/imagenet-fast/blob/master/imagenet_nv/distributed.py
 import math
 
+import numpy as np
 import torch
 import torch.distributed as dist
 from torch._utils import _flatten_dense_tensors, _unflatten_dense_tensors
@@ -50,6 +51,104 @@ class DistributedSampler(Sampler):
         self.epoch = epoch
 
 
+def load_imbalance(work):
+    """Return how much longer than the average replica the slowest one
+    works per step, averaged over the steps.
+
+    Args:
+        work (array): work of each replica at each step, [steps, replicas].
+    """
+    work = np.asarray(work, dtype=np.float64)
+    if work.size == 0:
+        return 0.0
+    return float(np.mean(work.max(1) / np.maximum(work.mean(1), 1e-8) - 1))
+
+
+class BalancedDistributedSampler(Sampler):
+    """
+    Distributed sampler that shuffles every epoch and gives all the
+    replicas items of similar lengths at each step.
+
+    Items are sorted by length and shuffled within buckets of
+    ``bucket_size`` neighbours. Runs of ``batch_size * num_replicas``
+    neighbours make up a step, whose items are dealt to the replicas in
+    snake order of their lengths, and the steps are shuffled. All replicas
+    shuffle with the same seed, so call ``set_epoch()`` on each of them
+    before every epoch, and load batches of ``batch_size`` items.
+
+    Args:
+        lengths (list): number of frames of each dataset item.
+        batch_size (int): number of items per replica and step.
+        num_replicas (int): number of replicas. Defaults to the world size.
+        rank (int): rank of this replica. Defaults to the process rank.
+        shuffle (bool): shuffle the items and steps every epoch.
+        seed (int): random seed shared by the replicas.
+        bucket_size (int): number of items shuffled together. Defaults to
+            4 steps.
+    """
+
+    def __init__(self, lengths, batch_size, num_replicas=None, rank=None, shuffle=True, seed=0,
+                 bucket_size=None):
+        # pylint: disable=super-init-not-called
+        if num_replicas is None:
+            if not dist.is_available():
+                raise RuntimeError("Requires distributed package to be available")
+            num_replicas = dist.get_world_size()
+        if rank is None:
+            if not dist.is_available():
+                raise RuntimeError("Requires distributed package to be available")
+            rank = dist.get_rank()
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.shuffle = shuffle
+        self.seed = seed
+        self.bucket_size = bucket_size or 4 * batch_size * num_replicas
+        self.epoch = 0
+        self.step_size = batch_size * num_replicas
+        self.num_steps = int(math.ceil(len(self.lengths) * 1.0 / self.step_size))
+        self.num_samples = self.num_steps * batch_size
+        # replica of each position of a step sorted by length, in snake
+        # order: 0, 1, .., n - 1, n - 1, .., 1, 0, 0, 1, ..
+        positions = np.arange(self.step_size)
+        block, offset = positions // num_replicas, positions % num_replicas
+        self.replica_of_position = np.where(block % 2 == 0, offset, num_replicas - 1 - offset)
+
+    def make_steps(self):
+        """Return the items of every step of the current epoch,
+        [steps, replicas, batch_size]."""
+        rng = np.random.RandomState(self.seed + self.epoch)
+        indices = np.argsort(self.lengths, kind='stable')
+        if self.shuffle:
+            for start in range(0, len(indices), self.bucket_size):
+                rng.shuffle(indices[start:start + self.bucket_size])
+        # add extra samples to make it evenly divisible
+        indices = np.resize(indices, self.num_steps * self.step_size)
+        steps = indices.reshape(self.num_steps, self.step_size)
+        order = np.argsort(self.lengths[steps], axis=1, kind='stable')
+        steps = np.take_along_axis(steps, order, axis=1)
+        if self.shuffle:
+            steps = steps[rng.permutation(self.num_steps)]
+        return np.stack([steps[:, self.replica_of_position == replica]
+                         for replica in range(self.num_replicas)], axis=1)
+
+    def __iter__(self):
+        return iter(self.make_steps()[:, self.rank].reshape(-1).tolist())
+
+    def __len__(self):
+        return self.num_samples
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def stats(self):
+        """Return the load imbalance of the replicas for the current epoch,
+        measured in padded frames per step."""
+        lengths = self.lengths[self.make_steps()]
+        return {'imbalance': load_imbalance(lengths.max(2) * self.batch_size)}
+
+
 def reduce_tensor(tensor, num_gpus):
     rt = tensor.clone()
     dist.all_reduce(rt, op=dist.reduce_op.SUM)
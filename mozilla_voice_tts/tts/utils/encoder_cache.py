@@ -0,0 +1,72 @@
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+def _num_bytes(value):
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, (tuple, list)):
+        return sum(_num_bytes(item) for item in value)
+    return 0
+
+
+class EncoderCache(object):
+    """LRU cache of the encoder outputs of sentences for inference, keyed
+    by their symbol ids.
+
+    Requests that repeat a sentence with another speaker or style, or are
+    retried, skip the embedding, the encoder and most of the attention
+    input projection. Set it as the ``encoder_cache`` of a model and clear
+    it when the weights change.
+
+    Args:
+        max_bytes (int): memory budget of the cached tensors.
+    """
+    def __init__(self, max_bytes=64 * 2**20):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached tensors of ``key`` or None."""
+        with self.lock:
+            if key not in self.items:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.items.move_to_end(key)
+            return self.items[key][0]
+
+    def put(self, key, value):
+        """Store a tensor or a tuple of tensors, evicting the least recently
+        used entries to stay within the budget."""
+        size = _num_bytes(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.items:
+                self.num_bytes -= self.items.pop(key)[1]
+            self.items[key] = (value, size)
+            self.num_bytes += size
+            while self.num_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.items.popitem(last=False)
+                self.num_bytes -= evicted_size
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.num_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / requests if requests else 0.0,
+                    'items': len(self.items),
+                    'bytes': self.num_bytes}
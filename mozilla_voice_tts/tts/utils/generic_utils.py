@@ -44,6 +44,40 @@ def sequence_mask(sequence_length, max_len=None):
     return seq_range_expand < seq_length_expand
 
 
+class GrowingBuffer(object):
+    """Time first tensor buffer for decoder outputs. Steps are written into
+    preallocated memory which doubles in size when it is full, instead of
+    being collected in a list and stacked at the end.
+
+    Args:
+        capacity (int): number of steps allocated at first.
+    """
+    def __init__(self, capacity=128):
+        self.capacity = capacity
+        self.data = None
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def append(self, x):
+        if self.data is None:
+            self.data = x.new_empty((self.capacity, ) + x.shape)
+        elif self.length == self.data.size(0):
+            data = x.new_empty((2 * self.length, ) + x.shape)
+            data[:self.length] = self.data
+            self.data = data
+        self.data[self.length] = x
+        self.length += 1
+
+    def last(self):
+        return self.data[self.length - 1]
+
+    def get(self):
+        """Return the steps written so far, T x ..."""
+        return self.data[:self.length]
+
+
 def setup_model(num_chars, num_speakers, c, speaker_embedding_dim=None):
     print(" > Using model: {}".format(c.model))
     MyModel = importlib.import_module('mozilla_voice_tts.tts.models.' + c.model.lower())
@@ -121,6 +155,7 @@ def check_config(c):
     check_argument('ref_level_db', c['audio'], restricted=True, val_type=int, min_val=0, max_val=1000)
     check_argument('power', c['audio'], restricted=True, val_type=float, min_val=1, max_val=5)
     check_argument('griffin_lim_iters', c['audio'], restricted=True, val_type=int, min_val=10, max_val=1000)
+    check_argument('griffin_lim_momentum', c['audio'], restricted=False, val_type=float, min_val=0, max_val=1)
 
     # vocabulary parameters
     check_argument('characters', c, restricted=False, val_type=dict)
@@ -144,6 +179,7 @@ def check_config(c):
 
     # training parameters
     check_argument('batch_size', c, restricted=True, val_type=int, min_val=1)
+    check_argument('batch_max_frames', c, restricted=False, val_type=int, min_val=0)
     check_argument('eval_batch_size', c, restricted=True, val_type=int, min_val=1)
     check_argument('r', c, restricted=True, val_type=int, min_val=1)
     check_argument('gradual_training', c, restricted=False, val_type=list)
@@ -205,6 +241,7 @@ def check_config(c):
     check_argument('batch_group_size', c, restricted=True, val_type=int, min_val=0)
     check_argument('min_seq_len', c, restricted=True, val_type=int, min_val=0)
     check_argument('max_seq_len', c, restricted=True, val_type=int, min_val=10)
+    check_argument('feature_store_path', c, restricted=False, val_type=str)
 
     # paths
     check_argument('output_path', c, restricted=True, val_type=str)
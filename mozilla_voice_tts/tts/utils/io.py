@@ -16,6 +16,16 @@ def load_checkpoint(model, checkpoint_path, amp=None, use_cuda=False):
     return model, state
 
 
+def load_state(checkpoint_path):
+    """Load a checkpoint to CPU memory. The packed weights of quantized
+    checkpoints need full unpickling."""
+    try:
+        return torch.load(checkpoint_path, map_location=torch.device('cpu'), weights_only=False)
+    except TypeError:
+        # torch versions without the weights_only argument
+        return torch.load(checkpoint_path, map_location=torch.device('cpu'))
+
+
 def save_model(model, optimizer, current_step, epoch, r, output_path, amp_state_dict=None, **kwargs):
     new_state_dict = model.state_dict()
     state = {
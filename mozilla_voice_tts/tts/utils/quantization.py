@@ -0,0 +1,37 @@
+import copy
+
+import torch
+from torch import nn
+
+# layers with int8 weights in quantized models
+QUANTIZED_LAYERS = {nn.Linear, nn.LSTM, nn.LSTMCell, nn.GRU, nn.GRUCell}
+
+
+def quantize_model(model):
+    """Return a frozen copy of a Tacotron model with the weights of its
+    linear and recurrent layers quantized to int8. Activations are quantized
+    on the fly, so no calibration data is needed. Quantized models run on
+    CPU only and can not be trained or compiled with ``script_step()``."""
+    model = copy.deepcopy(model).cpu().freeze()
+    return torch.quantization.quantize_dynamic(model, QUANTIZED_LAYERS, dtype=torch.qint8, inplace=True)
+
+
+def mel_distance(model, quantized_model, inputs):
+    """Mean absolute difference between the mel spectrograms of the fp32
+    and the quantized model for a single input sequence. Both models are
+    teacher forced with the decoder outputs of the fp32 model, so that the
+    outputs have the same length and errors do not add up over the
+    decoder steps.
+
+    Shapes:
+        - inputs: (1, T_in)
+    """
+    with torch.no_grad():
+        decoder_outputs, _, _, _ = model.inference(inputs)
+        input_lengths = torch.LongTensor([inputs.shape[1]])
+        mel_lengths = torch.LongTensor([decoder_outputs.shape[1]])
+        outputs = model(inputs, input_lengths, decoder_outputs, mel_lengths)
+        quantized_outputs = quantized_model(inputs, input_lengths, decoder_outputs, mel_lengths)
+    # Tacotron predicts linear spectrograms with the postnet
+    idx = 1 if model.postnet_output_dim == model.decoder_output_dim else 0
+    return (outputs[idx] - quantized_outputs[idx]).abs().mean().item()
@@ -0,0 +1,69 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+
+class StyleCache(object):
+    """LRU cache of the style conditioning of a model for inference.
+
+    It maps the content hash of a reference wav to its mel spectrogram and
+    a style input of ``compute_gst()``, a mel spectrogram or a dict of
+    token weights, to the final GST embedding. Repeated requests with the
+    same style skip loading the wav, computing its spectrogram and running
+    the reference encoder or the token attention. Set it as the
+    ``style_cache`` of a model and clear it when the weights change.
+
+    Args:
+        max_items (int): maximum number of cached entries.
+    """
+    def __init__(self, max_items=32):
+        self.max_items = max_items
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def wav_key(path, block_size=2**20):
+        """Key of a reference wav by the sha1 of its contents."""
+        sha = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                sha.update(block)
+        return 'wav:' + sha.hexdigest()
+
+    @staticmethod
+    def style_key(style_input):
+        """Key of a style input, a dict of token weights or a mel
+        spectrogram tensor."""
+        if isinstance(style_input, dict):
+            weights = {str(token): float(weight) for token, weight in style_input.items()}
+            return 'tokens:' + json.dumps(weights, sort_keys=True)
+        style_input = style_input.detach().cpu().contiguous()
+        sha = hashlib.sha1(style_input.numpy().tobytes())
+        return 'mel:{}:{}'.format(tuple(style_input.shape), sha.hexdigest())
+
+    def get_or_compute(self, key, compute_fn):
+        """Return the cached value of ``key``, or compute it with
+        ``compute_fn`` and store it."""
+        with self.lock:
+            if key in self.items:
+                self.hits += 1
+                self.items.move_to_end(key)
+                return self.items[key]
+        value = compute_fn()
+        with self.lock:
+            self.misses += 1
+            self.items[key] = value
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'items': len(self.items)}
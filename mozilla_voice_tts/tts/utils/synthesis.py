@@ -149,22 +149,20 @@ def embedding_to_torch(speaker_embedding, cuda=False):
     return speaker_embedding
 
 
-# TODO: perform GL with pytorch for batching
 def apply_griffin_lim(inputs, input_lens, CONFIG, ap):
-    '''Apply griffin-lim to each sample iterating throught the first dimension.
+    '''Apply batched griffin-lim to the samples of a batch.
     Args:
         inputs (Tensor or np.Array): Features to be converted by GL. First dimension is the batch size.
         input_lens (Tensor or np.Array): 1D array of sample lengths.
         CONFIG (Dict): TTS config.
         ap (AudioProcessor): TTS audio processor.
     '''
-    wavs = []
-    for idx, spec in enumerate(inputs):
-        wav_len = (input_lens[idx] * ap.hop_length) - ap.hop_length  # inverse librosa padding
-        wav = inv_spectrogram(spec, ap, CONFIG)
-        # assert len(wav) == wav_len, f" [!] wav lenght: {len(wav)} vs expected: {wav_len}"
-        wavs.append(wav[:wav_len])
-    return wavs
+    if isinstance(inputs, torch.Tensor):
+        inputs = inputs.detach().cpu().numpy()
+    specs = [spec[:int(input_lens[idx])].T for idx, spec in enumerate(inputs)]
+    if CONFIG.model.lower() in ["tacotron"]:
+        return ap.inv_spectrograms(specs)
+    return ap.inv_melspectrograms(specs)
 
 
 def synthesis(model,
@@ -190,7 +188,8 @@ def synthesis(model,
             ap (mozilla_voice_tts.tts.utils.audio.AudioProcessor): audio processor to process
                 model outputs.
             speaker_id (int): id of speaker
-            style_wav (str): Uses for style embedding of GST.
+            style_wav (str or dict): Uses for style embedding of GST. The
+                embedding is reused if the model has a ``style_cache``.
             truncated (bool): keep model states after inference. It can be used
                 for continuous inference at long texts.
             enable_eos_bos_chars (bool): enable special chars for end of sentence and start of sentence.
@@ -200,8 +199,12 @@ def synthesis(model,
     # GST processing
     style_mel = None
     if CONFIG.use_gst and style_wav is not None:
+        style_cache = getattr(model, 'style_cache', None)
         if isinstance(style_wav, dict):
             style_mel = style_wav
+        elif style_cache is not None:
+            style_mel = style_cache.get_or_compute(style_cache.wav_key(style_wav),
+                                                   lambda: compute_style_mel(style_wav, ap, cuda=use_cuda))
         else:
             style_mel = compute_style_mel(style_wav, ap, cuda=use_cuda)
     # preprocess the given text
@@ -4,6 +4,8 @@ import numpy as np
 import scipy.io.wavfile
 import scipy.signal
 import pyworld as pw
+import torch
+import torch.fft
 
 from mozilla_voice_tts.tts.utils.data import StandardScaler
 
@@ -30,6 +32,7 @@ class AudioProcessor(object):
                  stft_pad_mode='reflect',
                  clip_norm=True,
                  griffin_lim_iters=None,
+                 griffin_lim_momentum=0.0,
                  do_trim_silence=False,
                  trim_db=60,
                  do_sound_norm=False,
@@ -48,6 +51,7 @@ class AudioProcessor(object):
         self.power = power
         self.preemphasis = preemphasis
         self.griffin_lim_iters = griffin_lim_iters
+        self.griffin_lim_momentum = griffin_lim_momentum
         self.signal_norm = signal_norm
         self.symmetric_norm = symmetric_norm
         self.mel_fmin = mel_fmin or 0
@@ -170,7 +174,7 @@ class AudioProcessor(object):
         linear_std = stats['linear_std']
         stats_config = stats['audio_config']
         # check all audio parameters used for computing stats
-        skip_parameters = ['griffin_lim_iters', 'stats_path', 'do_trim_silence', 'ref_level_db', 'power']
+        skip_parameters = ['griffin_lim_iters', 'griffin_lim_momentum', 'stats_path', 'do_trim_silence', 'ref_level_db', 'power']
         for key in stats_config.keys():
             if key in skip_parameters:
                 continue
@@ -229,22 +233,30 @@ class AudioProcessor(object):
         return self._normalize(S)
 
     def inv_spectrogram(self, spectrogram):
-        """Converts spectrogram to waveform using librosa"""
-        S = self._denormalize(spectrogram)
-        S = self._db_to_amp(S)
-        # Reconstruct phase
-        if self.preemphasis != 0:
-            return self.apply_inv_preemphasis(self._griffin_lim(S**self.power))
-        return self._griffin_lim(S**self.power)
+        """Converts spectrogram to waveform using Griffin-Lim"""
+        return self.inv_spectrograms([spectrogram])[0]
 
     def inv_melspectrogram(self, mel_spectrogram):
-        '''Converts melspectrogram to waveform using librosa'''
-        D = self._denormalize(mel_spectrogram)
-        S = self._db_to_amp(D)
-        S = self._mel_to_linear(S)  # Convert back to linear
+        '''Converts melspectrogram to waveform using Griffin-Lim'''
+        return self.inv_melspectrograms([mel_spectrogram])[0]
+
+    def inv_spectrograms(self, spectrograms):
+        """Converts a list of spectrograms of different lengths to waveforms
+        with a single batched Griffin-Lim run."""
+        S = [self._db_to_amp(self._denormalize(spectrogram))**self.power for spectrogram in spectrograms]
+        return self._inv_preemphasis_batch(self.griffin_lim(S))
+
+    def inv_melspectrograms(self, mel_spectrograms):
+        """Converts a list of melspectrograms of different lengths to
+        waveforms with a single batched Griffin-Lim run."""
+        S = [self._mel_to_linear(self._db_to_amp(self._denormalize(mel_spectrogram)))**self.power
+             for mel_spectrogram in mel_spectrograms]
+        return self._inv_preemphasis_batch(self.griffin_lim(S))
+
+    def _inv_preemphasis_batch(self, wavs):
         if self.preemphasis != 0:
-            return self.apply_inv_preemphasis(self._griffin_lim(S**self.power))
-        return self._griffin_lim(S**self.power)
+            return [self.apply_inv_preemphasis(wav) for wav in wavs]
+        return wavs
 
     def out_linear_to_mel(self, linear_spec):
         S = self._denormalize(linear_spec)
@@ -268,15 +280,98 @@ class AudioProcessor(object):
         return librosa.istft(
             y, hop_length=self.hop_length, win_length=self.win_length)
 
-    def _griffin_lim(self, S):
-        angles = np.exp(2j * np.pi * np.random.rand(*S.shape))
-        S_complex = np.abs(S).astype(np.complex)
-        y = self._istft(S_complex * angles)
-        for _ in range(self.griffin_lim_iters):
-            angles = np.exp(1j * np.angle(self._stft(y)))
-            y = self._istft(S_complex * angles)
+    ### Griffin-Lim ###
+    def griffin_lim(self, spectrograms, num_iters=None, momentum=None):
+        """Reconstruct waveforms from a list of linear magnitude spectrograms
+        (C x T) of different lengths with batched Griffin-Lim in torch.
+
+        The spectrograms are padded to a batch and each item is masked to its
+        own length, so the result does not depend on the other items. With
+        ``momentum`` > 0 the fast Griffin-Lim algorithm of Perraudin et al.
+        is used, which converges in fewer iterations. librosa uses 0.99.
+
+        Returns:
+            list of waveforms of ``(T - 1) * hop_length`` samples.
+        """
+        num_iters = self.griffin_lim_iters if num_iters is None else num_iters
+        momentum = self.griffin_lim_momentum if momentum is None else momentum
+        lengths = [spectrogram.shape[1] for spectrogram in spectrograms]
+        S = torch.zeros(len(spectrograms), spectrograms[0].shape[0], max(lengths))
+        phases = torch.zeros(S.shape)
+        for idx, spectrogram in enumerate(spectrograms):
+            S[idx, :, :lengths[idx]] = torch.from_numpy(np.abs(spectrogram))
+            # random initial phases drawn per item, so they do not depend on the batch
+            phases[idx, :, :lengths[idx]] = torch.rand(spectrogram.shape)
+        with torch.no_grad():
+            wavs = self._griffin_lim(S, phases, torch.LongTensor(lengths), num_iters, momentum)
+        wavs = wavs.numpy()
+        return [wavs[idx, :(length - 1) * self.hop_length] for idx, length in enumerate(lengths)]
+
+    def _griffin_lim(self, S, phases, lengths, num_iters, momentum):
+        """S: B x C x T magnitudes, zero beyond ``lengths`` frames.
+        phases: B x C x T initial phases in [0, 1)."""
+        window = torch.hann_window(self.win_length, dtype=S.dtype)
+        # center the window in the FFT frame, as librosa does
+        left = (self.fft_size - self.win_length) // 2
+        window = torch.nn.functional.pad(window, (left, self.fft_size - self.win_length - left))
+        num_samples = (lengths - 1) * self.hop_length
+        # fixed for all the iterations
+        pad_index = self._stft_pad_index(num_samples, self.hop_length * (S.shape[2] - 1))
+        envelope = self._window_envelope(window, lengths, S.shape[2])
+        angles = torch.exp(2j * np.pi * phases)
+        y = self._istft_batch(S * angles, window, envelope, num_samples)
+        rebuilt_prev = None
+        for _ in range(num_iters):
+            rebuilt = self._stft_batch(y, window, pad_index)
+            angles = rebuilt
+            if momentum > 0 and rebuilt_prev is not None:
+                angles = rebuilt - (momentum / (1 + momentum)) * rebuilt_prev
+            rebuilt_prev = rebuilt
+            angles = angles / (angles.abs() + 1e-16)
+            y = self._istft_batch(S * angles, window, envelope, num_samples)
         return y
 
+    def _stft_pad_index(self, num_samples, max_samples):
+        """Index of the source sample of each position of the padded
+        waveforms, so that each item is padded at its own end like librosa.
+        ``max_samples`` points at an appended zero sample."""
+        pad = self.fft_size // 2
+        positions = torch.arange(max_samples + 2 * pad).unsqueeze(0) - pad
+        last = (num_samples - 1).clamp(min=0).unsqueeze(1)
+        if self.stft_pad_mode == 'reflect':
+            positions = positions.abs()
+            positions = torch.where(positions > last, 2 * last - positions, positions).abs()
+            return torch.min(positions, last)
+        return torch.where((positions < 0) | (positions > last), torch.full_like(positions, max_samples), positions)
+
+    def _window_envelope(self, window, lengths, num_frames):
+        """Overlap-added squared window of the first ``lengths`` frames of
+        each item, which normalizes the inverse STFT."""
+        frame_mask = (torch.arange(num_frames).unsqueeze(0) < lengths.unsqueeze(1)).to(window.dtype)
+        envelope = (window**2).unsqueeze(0).unsqueeze(2) * frame_mask.unsqueeze(1)
+        output_size = (1, self.fft_size + self.hop_length * (num_frames - 1))
+        envelope = torch.nn.functional.fold(envelope, output_size, (1, self.fft_size), stride=(1, self.hop_length))
+        return envelope.clamp(min=torch.finfo(envelope.dtype).tiny)
+
+    def _stft_batch(self, y, window, pad_index):
+        """STFT of a batch of waveforms (B x N) padded with ``pad_index``."""
+        y = torch.nn.functional.pad(y, (0, 1))
+        y_padded = torch.gather(y, 1, pad_index.expand(y.shape[0], -1))
+        return torch.stft(y_padded, self.fft_size, hop_length=self.hop_length, window=window,
+                          center=False, return_complex=True)
+
+    def _istft_batch(self, D, window, envelope, num_samples):
+        """Inverse STFT of a batch of spectrograms (B x C x T), zeroed past
+        the ``num_samples`` of each item."""
+        num_frames = D.shape[2]
+        frames = torch.fft.irfft(D, n=self.fft_size, dim=1) * window.unsqueeze(1)
+        output_size = (1, self.fft_size + self.hop_length * (num_frames - 1))
+        y = torch.nn.functional.fold(frames, output_size, (1, self.fft_size), stride=(1, self.hop_length))
+        pad = self.fft_size // 2
+        y = (y / envelope)[:, 0, 0, pad:pad + self.hop_length * (num_frames - 1)]
+        sample_mask = torch.arange(y.shape[1]).unsqueeze(0) < num_samples.unsqueeze(1)
+        return y * sample_mask
+
     def compute_stft_paddings(self, x, pad_sides=1):
         '''compute right padding (final frame) or both sides padding (first and final frames)
         '''
@@ -4,6 +4,7 @@ import torch
 import random
 import numpy as np
 from torch.utils.data import Dataset
+from torch.utils.data.sampler import Sampler
 from multiprocessing import Manager
 
 
@@ -64,9 +65,14 @@ class GANDataset(Dataset):
 
     def __getitem__(self, idx):
         """ Return different items for Generator and Discriminator and
-        cache acoustic features """
-        if self.return_segments:
+        cache acoustic features. ``idx`` is either an index, paired by
+        ``G_to_D_mappings``, or a ``(idx, idx2)`` pair from
+        ``GANPairSampler``. """
+        if isinstance(idx, (tuple, list)):
+            idx, idx2 = idx
+        else:
             idx2 = self.G_to_D_mappings[idx]
+        if self.return_segments:
             item1 = self.load_item(idx)
             item2 = self.load_item(idx2)
             return item1, item2
@@ -125,3 +131,35 @@ class GANDataset(Dataset):
         if self.use_noise_augment and self.is_training and self.return_segments:
             audio = audio + (1 / 32768) * torch.randn_like(audio)
         return (mel, audio)
+
+
+class GANPairSampler(Sampler):
+    """Sampler of ``(idx, idx2)`` pairs of ``GANDataset`` items for the
+    Generator and the Discriminator. The items are shuffled and paired again
+    every epoch, as ``GANDataset.shuffle_mapping()`` does, while the dataset
+    and its loader workers are kept for the whole training. Call
+    ``set_epoch()`` before every epoch.
+
+    Args:
+        num_items (int): number of dataset items.
+        shuffle (bool): shuffle the items every epoch.
+        seed (int): random seed.
+    """
+    def __init__(self, num_items, shuffle=True, seed=0):
+        # pylint: disable=super-init-not-called
+        self.num_items = num_items
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        rng = np.random.RandomState(self.seed + self.epoch)
+        indices = rng.permutation(self.num_items) if self.shuffle else np.arange(self.num_items)
+        mappings = rng.permutation(self.num_items)
+        return iter([(int(idx), int(mappings[idx])) for idx in indices])
+
+    def __len__(self):
+        return self.num_items
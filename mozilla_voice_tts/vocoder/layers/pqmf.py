@@ -1,20 +1,34 @@
 import numpy as np
 import torch
+import torch.fft
 import torch.nn.functional as F
 
 from scipy import signal as sig
 
+from mozilla_voice_tts.vocoder.utils.polyphase import polyphase_filters
+
 
 # adapted from
 # https://github.com/kan-bayashi/ParallelWaveGAN/tree/master/parallel_wavegan
 class PQMF(torch.nn.Module):
-    def __init__(self, N=4, taps=62, cutoff=0.15, beta=9.0):
+    """Pseudo-QMF filter bank.
+
+    Args:
+        mode (str): implementation of the filters. 'conv' runs the full rate
+            filters, 'polyphase' their polyphase components at the subband
+            rate, which skips the inserted zeros and decimated outputs, and
+            'fft' convolves in the frequency domain, which is fastest for
+            long signals. All of them give the same output.
+    """
+    def __init__(self, N=4, taps=62, cutoff=0.15, beta=9.0, mode='polyphase'):
         super(PQMF, self).__init__()
+        assert mode in ['conv', 'polyphase', 'fft'], " [!] Unknown PQMF mode: {}".format(mode)
 
         self.N = N
         self.taps = taps
         self.cutoff = cutoff
         self.beta = beta
+        self.mode = mode
 
         QMF = sig.firwin(taps + 1, cutoff, window=('kaiser', beta))
         H = np.zeros((N, len(QMF)))
@@ -28,6 +42,10 @@ class PQMF(torch.nn.Module):
 
             G[k] = 2 * QMF * np.cos(constant_factor - phase)
 
+        analysis_filter, analysis_padding, synthesis_filter, synthesis_padding = polyphase_filters(H, G, N, taps)
+        self.analysis_padding = list(analysis_padding)
+        self.synthesis_padding = list(synthesis_padding)
+
         H = torch.from_numpy(H[:, None, :]).float()
         G = torch.from_numpy(G[None, :, :]).float()
 
@@ -40,17 +58,74 @@ class PQMF(torch.nn.Module):
         self.register_buffer("updown_filter", updown_filter)
         self.N = N
 
+        # derived from H and G, so they are not saved in checkpoints
+        self.register_buffer("analysis_filter", torch.from_numpy(analysis_filter).float(), persistent=False)
+        self.register_buffer("synthesis_filter", torch.from_numpy(synthesis_filter).float(), persistent=False)
+
         self.pad_fn = torch.nn.ConstantPad1d(taps // 2, 0.0)
 
     def forward(self, x):
         return self.analysis(x)
 
     def analysis(self, x):
+        """
+        x : B x 1 x T
+        """
+        if self.mode == 'polyphase':
+            return self._analysis_polyphase(x)
+        if self.mode == 'fft':
+            return self._analysis_fft(x)
         return F.conv1d(x, self.H, padding=self.taps // 2, stride=self.N)
 
+    @torch.jit.export
     def synthesis(self, x):
+        """
+        x : B x N x T
+        """
+        if self.mode == 'polyphase':
+            return self._synthesis_polyphase(x)
+        if self.mode == 'fft':
+            return self._synthesis_fft(x)
         x = F.conv_transpose1d(x,
                                self.updown_filter * self.N,
                                stride=self.N)
         x = F.conv1d(x, self.G, padding=self.taps // 2)
         return x
+
+    def _analysis_polyphase(self, x):
+        num_frames = (x.shape[2] + self.N - 1) // self.N
+        x = F.pad(x, (0, num_frames * self.N - x.shape[2]))
+        # B x 1 x T -> B x N x T/N with the N phases of the signal
+        x = x.view(x.shape[0], num_frames, self.N).transpose(1, 2)
+        x = F.pad(x, self.analysis_padding)
+        return F.conv1d(x, self.analysis_filter)
+
+    def _synthesis_polyphase(self, x):
+        x = F.pad(x, self.synthesis_padding)
+        x = F.conv1d(x, self.synthesis_filter)
+        # interleave the N phases of the signal
+        return x.transpose(1, 2).reshape(x.shape[0], 1, -1)
+
+    def _fft_conv(self, x, filters):
+        """Cross-correlate each channel of ``x`` [B x C x T] with its filter
+        in ``filters`` [C x taps + 1] in the frequency domain. Same as
+        ``F.conv1d()`` with groups=C and the padding of the filter bank."""
+        num_samples = x.shape[2]
+        fft_size = 1
+        while fft_size < num_samples + self.taps:
+            fft_size *= 2
+        X = torch.fft.rfft(x, n=fft_size)
+        # flip the filters to turn the convolution into a correlation
+        W = torch.fft.rfft(torch.flip(filters, [1]), n=fft_size)
+        y = torch.fft.irfft(X * W, n=fft_size)
+        start = self.taps - self.taps // 2
+        return y[:, :, start:start + num_samples]
+
+    def _analysis_fft(self, x):
+        return self._fft_conv(x, self.H[:, 0])[:, :, ::self.N]
+
+    def _synthesis_fft(self, x):
+        # insert zeros between the samples of the subbands
+        upsampled = x.new_zeros(x.shape[0], self.N, x.shape[2] * self.N)
+        upsampled[:, :, ::self.N] = x * self.N
+        return self._fft_conv(upsampled, self.G[0]).sum(1, keepdim=True)
@@ -1,3 +1,6 @@
+import math
+
+import numpy as np
 import torch
 from torch import nn
 from torch.nn.utils import weight_norm
@@ -77,16 +80,95 @@ class MelganGenerator(nn.Module):
         ]
         self.layers = nn.Sequential(*layers)
 
+        # output samples per input frame
+        self.upsample_scale = int(np.prod(upsample_factors))
+        # number of input frames each output sample depends on at either side
+        receptive_field = base_padding
+        hop_length = 1
+        for upsample_factor in upsample_factors:
+            # transposed convolutions see one input sample at either side
+            receptive_field += 1 / hop_length
+            hop_length *= upsample_factor
+            res_dilations = sum(res_kernel**idx for idx in range(num_res_blocks))
+            receptive_field += (res_kernel - 1) // 2 * res_dilations / hop_length
+        receptive_field += base_padding / hop_length
+        self.context_frames = int(math.ceil(receptive_field))
+
     def forward(self, c):
         return self.layers(c)
 
-    def inference(self, c):
+    def _inference_window(self, c):
+        return self.layers(c)
+
+    def inference(self, c, chunk_size=None):
+        """
+            c: (B, C, T).
+            chunk_size: if set, the input is processed in chunks of this
+                many frames with ``context_frames`` frames of context at
+                either side. The output is the same as without chunking, but
+                the memory used for intermediate activations depends on the
+                chunk size instead of the input length.
+        """
+        if chunk_size is not None:
+            return torch.cat(list(self.inference_stream([c], chunk_size)), 2)
         c = c.to(self.layers[1].weight.device)
         c = torch.nn.functional.pad(
             c,
             (self.inference_padding, self.inference_padding),
             'replicate')
-        return self.layers(c)
+        return self._inference_window(c)
+
+    @torch.no_grad()
+    def inference_stream(self, c_chunks, chunk_size=32):
+        """Vocode a stream of feature chunks as they come in, e.g. from
+        ``Tacotron2.inference_stream()``.
+
+        Features are vocoded in windows of ``chunk_size`` frames plus
+        ``context_frames`` frames at either side. The context covers the
+        receptive field of the model and is trimmed from the outputs, so the
+        concatenated waveform chunks match ``inference()`` on the whole
+        feature sequence.
+
+        Args:
+            c_chunks (iterable): feature chunks of shape (B, C, T_chunk).
+            chunk_size (int): number of frames vocoded per output chunk.
+
+        Yields:
+            Tensor: waveform chunks of shape (B, 1, chunk_size * upsample_scale).
+            The last chunk might be shorter.
+        """
+        pad = self.inference_padding
+        # features starting at the global frame index `offset`
+        c, offset, num_yielded = None, 0, 0
+        for c_chunk in c_chunks:
+            c_chunk = c_chunk.to(self.layers[1].weight.device)
+            if c is None:
+                c = torch.nn.functional.pad(c_chunk, (pad, 0), 'replicate')
+            else:
+                c = torch.cat([c, c_chunk], 2)
+            while offset + c.size(2) - num_yielded >= chunk_size + self.context_frames:
+                yield self._inference_chunk(c, offset, num_yielded, num_yielded + chunk_size)
+                num_yielded += chunk_size
+                # drop the frames that are not needed for the next chunks
+                drop = max(0, num_yielded - self.context_frames - offset)
+                c = c[:, :, drop:]
+                offset += drop
+        if c is None:
+            return
+        c = torch.nn.functional.pad(c, (0, pad), 'replicate')
+        num_frames = offset + c.size(2)
+        while num_yielded < num_frames:
+            end = min(num_yielded + chunk_size, num_frames)
+            yield self._inference_chunk(c, offset, num_yielded, end)
+            num_yielded = end
+
+    def _inference_chunk(self, c, offset, start, end):
+        """Vocode the frames [start, end) of the features that are
+        available from the frame `offset` on."""
+        win_start = max(start - self.context_frames, offset)
+        win_end = min(end + self.context_frames, offset + c.size(2))
+        o = self._inference_window(c[:, :, win_start - offset:win_end - offset])
+        return o[:, :, (start - win_start) * self.upsample_scale:(end - win_start) * self.upsample_scale]
 
     def remove_weight_norm(self):
         for _, layer in enumerate(self.layers):
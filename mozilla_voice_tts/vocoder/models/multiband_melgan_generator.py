@@ -1,3 +1,5 @@
+import math
+
 import torch
 
 from mozilla_voice_tts.vocoder.models.melgan_generator import MelganGenerator
@@ -22,6 +24,9 @@ class MultibandMelganGenerator(MelganGenerator):
                              res_kernel=res_kernel,
                              num_res_blocks=num_res_blocks)
         self.pqmf_layer = PQMF(N=4, taps=62, cutoff=0.15, beta=9.0)
+        # account for the sub-band upsampling and the synthesis filter
+        self.upsample_scale *= self.pqmf_layer.N
+        self.context_frames += int(math.ceil((self.pqmf_layer.taps // 2) / self.upsample_scale))
 
     def pqmf_analysis(self, x):
         return self.pqmf_layer.analysis(x)
@@ -29,11 +34,9 @@ class MultibandMelganGenerator(MelganGenerator):
     def pqmf_synthesis(self, x):
         return self.pqmf_layer.synthesis(x)
 
+    def _inference_window(self, c):
+        return self.pqmf_synthesis(self.layers(c))
+
     @torch.no_grad()
-    def inference(self, cond_features):
-        cond_features = cond_features.to(self.layers[1].weight.device)
-        cond_features = torch.nn.functional.pad(
-            cond_features,
-            (self.inference_padding, self.inference_padding),
-            'replicate')
-        return self.pqmf_synthesis(self.layers(cond_features))
+    def inference(self, cond_features, chunk_size=None):
+        return super(MultibandMelganGenerator, self).inference(cond_features, chunk_size)
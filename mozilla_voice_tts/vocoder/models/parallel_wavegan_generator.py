@@ -87,6 +87,14 @@ class ParallelWaveganGenerator(torch.nn.Module):
         if use_weight_norm:
             self.apply_weight_norm()
 
+        # number of input frames each output sample depends on at either side
+        receptive_field = (self.receptive_field_size - 1) // 2 / self.upsample_scale
+        hop_length = 1
+        for upsample_factor in upsample_factors:
+            hop_length *= upsample_factor
+            receptive_field += upsample_factor / hop_length
+        self.context_frames = int(math.ceil(receptive_field))
+
     def forward(self, c):
         """
             c: (B, C ,T').
@@ -95,7 +103,9 @@ class ParallelWaveganGenerator(torch.nn.Module):
         # random noise
         x = torch.randn([c.shape[0], 1, c.shape[2] * self.upsample_scale])
         x = x.to(self.first_conv.bias.device)
+        return self._forward(x, c)
 
+    def _forward(self, x, c):
         # perform upsampling
         if c is not None and self.upsample_net is not None:
             c = self.upsample_net(c)
@@ -118,11 +128,35 @@ class ParallelWaveganGenerator(torch.nn.Module):
         return x
 
     @torch.no_grad()
-    def inference(self, c):
+    def inference(self, c, chunk_size=None):
+        """
+            c: (B, C ,T').
+            chunk_size: if set, the input is processed in chunks of this
+                many frames with ``context_frames`` frames of context at
+                either side. The output is the same as without chunking for
+                the same input noise, but the memory used for intermediate
+                activations depends on the chunk size instead of the input
+                length.
+            o: Output tensor (B, out_channels, T)
+        """
         c = c.to(self.first_conv.weight.device)
         c = torch.nn.functional.pad(
             c, (self.inference_padding, self.inference_padding), 'replicate')
-        return self.forward(c)
+        if chunk_size is None:
+            return self.forward(c)
+
+        # draw the noise for the whole output so that it does not depend on the chunks
+        x = torch.randn([c.shape[0], 1, c.shape[2] * self.upsample_scale])
+        x = x.to(self.first_conv.bias.device)
+        outputs = []
+        for start in range(0, c.shape[2], chunk_size):
+            end = min(start + chunk_size, c.shape[2])
+            win_start = max(start - self.context_frames, 0)
+            win_end = min(end + self.context_frames, c.shape[2])
+            o = self._forward(x[:, :, win_start * self.upsample_scale:win_end * self.upsample_scale],
+                              c[:, :, win_start:win_end])
+            outputs.append(o[:, :, (start - win_start) * self.upsample_scale:(end - win_start) * self.upsample_scale])
+        return torch.cat(outputs, 2)
 
     def remove_weight_norm(self):
         def _remove_weight_norm(m):
@@ -154,5 +188,5 @@ class ParallelWaveganGenerator(torch.nn.Module):
 
     @property
     def receptive_field_size(self):
-        return self._get_receptive_field_size(self.layers, self.stacks,
+        return self._get_receptive_field_size(self.num_res_blocks, self.stacks,
                                               self.kernel_size)
@@ -3,15 +3,27 @@ import tensorflow as tf
 
 from scipy import signal as sig
 
+from mozilla_voice_tts.vocoder.utils.polyphase import polyphase_filters
+
 
 class PQMF(tf.keras.layers.Layer):
-    def __init__(self, N=4, taps=62, cutoff=0.15, beta=9.0):
+    """Pseudo-QMF filter bank.
+
+    Args:
+        mode (str): implementation of the filters. 'conv' runs the full rate
+            filters, 'polyphase' their polyphase components at the subband
+            rate and 'fft' convolves in the frequency domain. All of them
+            give the same output.
+    """
+    def __init__(self, N=4, taps=62, cutoff=0.15, beta=9.0, mode='polyphase'):
         super(PQMF, self).__init__()
+        assert mode in ['conv', 'polyphase', 'fft'], " [!] Unknown PQMF mode: {}".format(mode)
         # define filter coefficient
         self.N = N
         self.taps = taps
         self.cutoff = cutoff
         self.beta = beta
+        self.mode = mode
 
         QMF = sig.firwin(taps + 1, cutoff, window=('kaiser', beta))
         H = np.zeros((N, len(QMF)))
@@ -25,6 +37,15 @@ class PQMF(tf.keras.layers.Layer):
 
             G[k] = 2 * QMF * np.cos(constant_factor - phase)
 
+        analysis_filter, self.analysis_padding, synthesis_filter, self.synthesis_padding = \
+            polyphase_filters(H, G, N, taps)
+        # [N, N, K] -> [filter_width, in_channels, out_channels]
+        self.analysis_filter = np.transpose(analysis_filter, (2, 1, 0)).astype('float32')
+        self.synthesis_filter = np.transpose(synthesis_filter, (2, 1, 0)).astype('float32')
+        # flipped filters for the FFT convolution
+        self.H_flipped = H[:, ::-1].astype('float32')
+        self.G_flipped = G[:, ::-1].astype('float32')
+
         # [N, 1, taps + 1] == [filter_width, in_channels, out_channels]
         self.H = np.transpose(H[:, None, :], (2, 1, 0)).astype('float32')
         self.G = np.transpose(G[None, :, :], (2, 1, 0)).astype('float32')
@@ -39,6 +60,10 @@ class PQMF(tf.keras.layers.Layer):
         """
         x : B x 1 x T
         """
+        if self.mode == 'polyphase':
+            return self._analysis_polyphase(x)
+        if self.mode == 'fft':
+            return self._analysis_fft(x)
         x = tf.transpose(x, perm=[0, 2, 1])
         x = tf.pad(x, [[0, 0], [self.taps // 2, self.taps // 2], [0, 0]], constant_values=0.0)
         x = tf.nn.conv1d(x, self.H, stride=1, padding='VALID')
@@ -53,6 +78,10 @@ class PQMF(tf.keras.layers.Layer):
         """
         x : B x D x T
         """
+        if self.mode == 'polyphase':
+            return self._synthesis_polyphase(x)
+        if self.mode == 'fft':
+            return self._synthesis_fft(x)
         x = tf.transpose(x, perm=[0, 2, 1])
         x = tf.nn.conv1d_transpose(
             x,
@@ -64,3 +93,47 @@ class PQMF(tf.keras.layers.Layer):
         x = tf.nn.conv1d(x, self.G, stride=1, padding="VALID")
         x = tf.transpose(x, perm=[0, 2, 1])
         return x
+
+    def _analysis_polyphase(self, x):
+        num_samples = tf.shape(x)[2]
+        num_frames = (num_samples + self.N - 1) // self.N
+        x = tf.pad(x, [[0, 0], [0, 0], [0, num_frames * self.N - num_samples]], constant_values=0.0)
+        # B x 1 x T -> B x T/N x N with the N phases of the signal
+        x = tf.reshape(x, [tf.shape(x)[0], num_frames, self.N])
+        x = tf.pad(x, [[0, 0], list(self.analysis_padding), [0, 0]], constant_values=0.0)
+        x = tf.nn.conv1d(x, self.analysis_filter, stride=1, padding='VALID')
+        # the strided convolution of the 'conv' mode drops a partial last frame
+        x = x[:, :num_samples // self.N]
+        return tf.transpose(x, perm=[0, 2, 1])
+
+    def _synthesis_polyphase(self, x):
+        x = tf.transpose(x, perm=[0, 2, 1])
+        x = tf.pad(x, [[0, 0], list(self.synthesis_padding), [0, 0]], constant_values=0.0)
+        x = tf.nn.conv1d(x, self.synthesis_filter, stride=1, padding='VALID')
+        # interleave the N phases of the signal
+        x = tf.reshape(x, [tf.shape(x)[0], -1, 1])
+        return tf.transpose(x, perm=[0, 2, 1])
+
+    def _fft_conv(self, x, filters):
+        """Cross-correlate each channel of ``x`` [B x C x T] with its filter
+        in ``filters`` [C x taps + 1], flipped, in the frequency domain."""
+        num_samples = tf.shape(x)[2]
+        fft_size = tf.cast(2 ** tf.math.ceil(tf.math.log(tf.cast(num_samples + self.taps, tf.float32))
+                                             / tf.math.log(2.0)), tf.int32)
+        # float32 FFTs of TF lose precision on long signals
+        X = tf.signal.rfft(tf.cast(x, tf.float64), fft_length=[fft_size])
+        W = tf.signal.rfft(tf.cast(filters, tf.float64), fft_length=[fft_size])
+        y = tf.cast(tf.signal.irfft(X * W, fft_length=[fft_size]), x.dtype)
+        start = self.taps - self.taps // 2
+        return y[:, :, start:start + num_samples]
+
+    def _analysis_fft(self, x):
+        num_frames = tf.shape(x)[2] // self.N
+        return self._fft_conv(x, self.H_flipped)[:, :, :num_frames * self.N:self.N]
+
+    def _synthesis_fft(self, x):
+        # insert zeros between the samples of the subbands
+        x = tf.stack([x * self.N] + [tf.zeros_like(x)] * (self.N - 1), axis=-1)
+        x = tf.reshape(x, [tf.shape(x)[0], self.N, -1])
+        x = self._fft_conv(x, self.G_flipped)
+        return tf.reduce_sum(x, axis=1, keepdims=True)
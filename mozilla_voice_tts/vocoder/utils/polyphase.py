@@ -0,0 +1,44 @@
+import numpy as np
+
+
+def polyphase_filters(H, G, N, taps):
+    """Split the analysis filters ``H`` [N x taps + 1] and the synthesis
+    filters ``G`` [N x taps + 1] into their ``N`` polyphase components, so
+    that analysis and synthesis run at the subband rate without the
+    decimated outputs or the inserted zeros of the full rate filters.
+
+    Returns:
+        analysis_filter [N x N x K]: maps the N phases of the signal to the
+            N subbands.
+        analysis_padding (tuple): left and right padding of the phases.
+        synthesis_filter [N x N x K]: maps the N subbands to the N phases
+            of the signal.
+        synthesis_padding (tuple): left and right padding of the subbands.
+    """
+    pad = taps // 2
+    # analysis: y_k[m] = sum_j H_k[j] x[mN + j - pad], with j - pad = iN + r
+    analysis_taps = {}
+    for j in range(taps + 1):
+        i, r = divmod(j - pad, N)
+        analysis_taps[(r, i)] = j
+    # synthesis: x[mN + r] = N sum_j G_k[j] y_k[m + i], with j = iN - r + pad
+    synthesis_taps = {}
+    for j in range(taps + 1):
+        for r in range(N):
+            if (j - pad + r) % N == 0:
+                synthesis_taps[(r, (j - pad + r) // N)] = j
+
+    def _filter(filter_taps, coeffs, transpose):
+        offsets = [i for _, i in filter_taps]
+        min_offset, max_offset = min(offsets), max(offsets)
+        poly = np.zeros((N, N, max_offset - min_offset + 1))
+        for (r, i), j in filter_taps.items():
+            if transpose:
+                poly[r, :, i - min_offset] = coeffs[:, j]
+            else:
+                poly[:, r, i - min_offset] = coeffs[:, j]
+        return poly, (-min_offset, max_offset)
+
+    analysis_filter, analysis_padding = _filter(analysis_taps, H, transpose=False)
+    synthesis_filter, synthesis_padding = _filter(synthesis_taps, N * G, transpose=True)
+    return analysis_filter, analysis_padding, synthesis_filter, synthesis_padding
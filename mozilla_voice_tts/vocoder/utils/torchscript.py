@@ -0,0 +1,82 @@
+import zipfile
+from typing import Optional
+
+import torch
+from torch import nn
+from torch.nn import functional as F
+
+
+class MelganInference(nn.Module):
+    """Inference graph of a MelGAN or multi-band MelGAN generator that can
+    be compiled with TorchScript. The input is padded with
+    ``inference_padding`` frames at either side and the output is trimmed
+    back, so that it has ``upsample_scale`` samples per input frame.
+
+    Args:
+        model (MelganGenerator): generator with weight norm removed.
+        inference_padding (int): number of frames of replicate padding.
+    """
+    __constants__ = ['inference_padding', 'upsample_scale', 'context_frames', 'multiband']
+
+    def __init__(self, model, inference_padding=2):
+        super(MelganInference, self).__init__()
+        self.layers = model.layers
+        self.multiband = hasattr(model, 'pqmf_layer')
+        self.pqmf_layer = model.pqmf_layer if self.multiband else None
+        self.inference_padding = inference_padding
+        self.upsample_scale = model.upsample_scale
+        self.context_frames = model.context_frames
+
+    def _inference_window(self, c):
+        o = self.layers(c)
+        if self.multiband:
+            o = self.pqmf_layer.synthesis(o)
+        return o
+
+    def forward(self, c):
+        return self.inference(c, None)
+
+    @torch.jit.export
+    def inference(self, c, chunk_size: Optional[int] = None):
+        """
+            c: (B, C, T).
+            chunk_size: if set, the input is processed in chunks of this
+                many frames with ``context_frames`` frames of context at
+                either side, as in ``MelganGenerator.inference()``.
+        """
+        pad = self.inference_padding
+        c = F.pad(c, (pad, pad), 'replicate')
+        num_frames = c.size(2)
+        if chunk_size is None:
+            o = self._inference_window(c)
+            return o[:, :, pad * self.upsample_scale:(num_frames - pad) * self.upsample_scale]
+        outputs = []
+        for start in range(pad, num_frames - pad, chunk_size):
+            end = min(start + chunk_size, num_frames - pad)
+            win_start = max(start - self.context_frames, 0)
+            win_end = min(end + self.context_frames, num_frames)
+            o = self._inference_window(c[:, :, win_start:win_end])
+            outputs.append(o[:, :, (start - win_start) * self.upsample_scale:(end - win_start) * self.upsample_scale])
+        return torch.cat(outputs, 2)
+
+
+def export_melgan(model, inference_padding=2):
+    """Return a frozen TorchScript module of a MelGAN or multi-band MelGAN
+    generator for inference. Weight norm is removed from ``model``. The
+    module has an ``inference(c, chunk_size=None)`` method and can be
+    saved with ``torch.jit.save()`` and loaded without the model code."""
+    model.remove_weight_norm()
+    model.eval()
+    module = torch.jit.script(MelganInference(model, inference_padding).eval())
+    if hasattr(torch.jit, 'freeze'):
+        # inline the weights as constants, which enables more optimizations
+        module = torch.jit.freeze(module, preserved_attrs=['inference'])
+    return module
+
+
+def is_torchscript(path):
+    """Check if a file is a TorchScript module rather than a checkpoint."""
+    if not zipfile.is_zipfile(path):
+        return False
+    with zipfile.ZipFile(path) as archive:
+        return any('/code/' in name for name in archive.namelist())
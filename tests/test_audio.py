@@ -1,6 +1,9 @@
 import os
 import unittest
 
+import numpy as np
+import torch
+
 from tests import get_tests_input_path, get_tests_output_path, get_tests_path
 
 from mozilla_voice_tts.utils.audio import AudioProcessor
@@ -174,3 +177,24 @@ class TestAudio(unittest.TestCase):
         mel_norm = ap.melspectrogram(wav)
         mel_denorm = ap._denormalize(mel_norm)
         assert abs(mel_reference - mel_denorm).max() < 1e-4
+
+    def test_griffin_lim(self):
+        wav = self.ap.load_wav(WAV_FILE)
+        S = np.abs(self.ap._stft(wav.astype(np.float32)))
+
+        def spectral_convergence(wav_):
+            S_ = np.abs(self.ap._stft(wav_.astype(np.float32)))
+            return np.linalg.norm(S_ - S) / np.linalg.norm(S)
+
+        # items of a batch are masked to their own length
+        torch.manual_seed(0)
+        wav_single = self.ap.griffin_lim([S[:, :100]], num_iters=10)[0]
+        torch.manual_seed(0)
+        wavs_batch = self.ap.griffin_lim([S[:, :100], S], num_iters=10)
+        assert len(wavs_batch[0]) == 99 * self.ap.hop_length
+        assert len(wavs_batch[1]) == (S.shape[1] - 1) * self.ap.hop_length
+        assert np.allclose(wavs_batch[0], wav_single, atol=1e-4)
+        # fast griffin-lim converges in fewer iterations
+        wav_plain = self.ap.griffin_lim([S], num_iters=20, momentum=0.0)[0]
+        wav_fast = self.ap.griffin_lim([S], num_iters=20, momentum=0.99)[0]
+        assert spectral_convergence(wav_fast) < spectral_convergence(wav_plain) < 0.3
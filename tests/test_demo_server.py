@@ -1,14 +1,29 @@
 import os
+import shutil
+import threading
+import time
 import unittest
+import urllib.request
+
+import numpy as np
+import torch
+from flask import Flask
 
 from tests import get_tests_input_path, get_tests_output_path
 
+from mozilla_voice_tts.server.batch_scheduler import BatchScheduler, PipelineScheduler
+from mozilla_voice_tts.server.metrics import MetricsRegistry
+from mozilla_voice_tts.server.prefork import PreforkServer
+from mozilla_voice_tts.server.synthesis_cache import SynthesisCache
 from mozilla_voice_tts.server.synthesizer import Synthesizer
 from mozilla_voice_tts.tts.utils.generic_utils import setup_model
 from mozilla_voice_tts.tts.utils.io import save_checkpoint
 from mozilla_voice_tts.tts.utils.text.symbols import (make_symbols, phonemes,
                                                       symbols)
 from mozilla_voice_tts.utils.io import load_config
+from mozilla_voice_tts.vocoder.models.melgan_generator import MelganGenerator
+from mozilla_voice_tts.vocoder.utils.generic_utils import setup_generator
+from mozilla_voice_tts.vocoder.utils.torchscript import export_melgan
 
 
 class DemoServerTest(unittest.TestCase):
@@ -34,6 +49,440 @@ class DemoServerTest(unittest.TestCase):
         synthesizer = Synthesizer(config)
         synthesizer.tts("Better this test works!!")
 
+    def test_tts_quantized(self):
+        self._create_random_model()
+        config = load_config(os.path.join(get_tests_input_path(), 'server_config.json'))
+        tts_root_path = get_tests_output_path()
+        config['tts_checkpoint'] = os.path.join(tts_root_path, config['tts_checkpoint'])
+        config['tts_config'] = os.path.join(tts_root_path, config['tts_config'])
+        config['quantize_tts'] = True
+        synthesizer = Synthesizer(config)
+        synthesizer.tts_model.decoder.max_decoder_steps = 50
+        synthesizer.tts("Better this test works!!")
+        # load a quantized checkpoint
+        quantized_checkpoint = os.path.join(tts_root_path, 'quantized_checkpoint.pth.tar')
+        torch.save({'model': synthesizer.tts_model.state_dict(), 'r': 1, 'quantized': True},
+                   quantized_checkpoint)
+        config['tts_checkpoint'] = quantized_checkpoint
+        config['quantize_tts'] = False
+        synthesizer = Synthesizer(config)
+        synthesizer.tts_model.decoder.max_decoder_steps = 50
+        synthesizer.tts("Better this test works!!")
+        os.remove(quantized_checkpoint)
+
+    def test_tts_batch(self):
+        self._create_random_model()
+        config = load_config(os.path.join(get_tests_input_path(), 'server_config.json'))
+        tts_root_path = get_tests_output_path()
+        config['tts_checkpoint'] = os.path.join(tts_root_path, config['tts_checkpoint'])
+        config['tts_config'] = os.path.join(tts_root_path, config['tts_config'])
+        synthesizer = Synthesizer(config)
+        synthesizer.tts_model.decoder.max_decoder_steps = 50
+        wavs = synthesizer.tts_batch(["Better this test works!!", "Hello."])
+        assert len(wavs) == 2
+        with self.assertRaises(ValueError):
+            synthesizer.tts_batch(["Better this test works!!", "Hello."], [None, 0])
+
+    def test_tts_stream(self):
+        self._create_random_model()
+        config = load_config(os.path.join(get_tests_input_path(), 'server_config.json'))
+        tts_root_path = get_tests_output_path()
+        config['tts_checkpoint'] = os.path.join(tts_root_path, config['tts_checkpoint'])
+        config['tts_config'] = os.path.join(tts_root_path, config['tts_config'])
+        synthesizer = Synthesizer(config)
+        synthesizer.tts_model.decoder.max_decoder_steps = 50
+        chunks = list(synthesizer.tts_stream("Better this test works!! Hello."))
+        assert len(chunks[0]) == 44
+        assert chunks[0][:4] == b'RIFF' and chunks[0][8:12] == b'WAVE'
+        # header + (audio + silence) per sentence
+        assert len(chunks) == 5
+        assert all(len(chunk) % 2 == 0 for chunk in chunks[1:])
+        # a stream is in progress until it ends or the client disconnects
+        stream = synthesizer.tts_stream("Better this test works!! Hello.")
+        next(stream)
+        assert 'tts_requests_in_progress 1.0' in synthesizer.metrics.expose()
+        stream.close()
+        metrics = synthesizer.metrics.expose()
+        assert 'tts_requests_in_progress 0.0' in metrics
+        assert 'tts_requests_total 2.0' in metrics
+
+    def test_tts_stream_incremental(self):
+        self._create_random_model()
+        config = load_config(os.path.join(get_tests_input_path(), 'server_config.json'))
+        tts_root_path = get_tests_output_path()
+        config['tts_checkpoint'] = os.path.join(tts_root_path, config['tts_checkpoint'])
+        config['tts_config'] = os.path.join(tts_root_path, config['tts_config'])
+        config['stream_chunk_size'] = 8
+        synthesizer = Synthesizer(config)
+        synthesizer.tts_model.decoder.max_decoder_steps = 50
+        synthesizer.tts_model.decoder.stop_threshold = 1.0
+        synthesizer.vocoder_model = MelganGenerator(in_channels=synthesizer.ap.num_mels)
+        synthesizer.vocoder_model.remove_weight_norm()
+        synthesizer.vocoder_model.inference_padding = 0
+        synthesizer.vocoder_model.eval()
+        chunks = list(synthesizer.tts_stream("Better this test works!!"))
+        assert len(chunks[0]) == 44
+        # header + several audio chunks + silence
+        assert len(chunks) > 3
+        assert len(chunks[1]) == 8 * synthesizer.vocoder_model.upsample_scale * 2
+
+    def test_tts_torchscript_vocoder(self):
+        self._create_random_model()
+        config = load_config(os.path.join(get_tests_input_path(), 'server_config.json'))
+        tts_root_path = get_tests_output_path()
+        config['tts_checkpoint'] = os.path.join(tts_root_path, config['tts_checkpoint'])
+        config['tts_config'] = os.path.join(tts_root_path, config['tts_config'])
+        tts_config = load_config(config['tts_config'])
+        vocoder_path = os.path.join(get_tests_output_path(), 'vocoder_torchscript.pt')
+        vocoder_model = MelganGenerator(in_channels=tts_config.audio['num_mels'])
+        torch.jit.save(export_melgan(vocoder_model), vocoder_path)
+        # the exported vocoder is loaded without its config
+        config['vocoder_checkpoint'] = vocoder_path
+        config['vocoder_config'] = None
+        synthesizer = Synthesizer(config)
+        synthesizer.tts_model.decoder.max_decoder_steps = 50
+        assert isinstance(synthesizer.vocoder_model, torch.jit.ScriptModule)
+        synthesizer.share_memory()
+        synthesizer.tts("Better this test works!!")
+        os.remove(vocoder_path)
+
+    def test_tts_torchscript_vocoder_matches_eager(self):
+        self._create_random_model()
+        config = load_config(os.path.join(get_tests_input_path(), 'server_config.json'))
+        tts_root_path = get_tests_output_path()
+        config['tts_checkpoint'] = os.path.join(tts_root_path, config['tts_checkpoint'])
+        config['tts_config'] = os.path.join(tts_root_path, config['tts_config'])
+        vocoder_config_path = os.path.join(get_tests_input_path(), 'test_vocoder_multiband_melgan_config.json')
+        vocoder_model = setup_generator(load_config(vocoder_config_path))
+        checkpoint_path = os.path.join(get_tests_output_path(), 'vocoder_checkpoint.pth.tar')
+        torch.save({'model': vocoder_model.state_dict()}, checkpoint_path)
+        vocoder_path = os.path.join(get_tests_output_path(), 'vocoder_torchscript.pt')
+        torch.jit.save(export_melgan(vocoder_model), vocoder_path)
+        mel = torch.rand(40, load_config(vocoder_config_path).audio['num_mels'])
+        wavs = []
+        for vocoder_checkpoint, vocoder_config in [(checkpoint_path, vocoder_config_path), (vocoder_path, None)]:
+            config['vocoder_checkpoint'] = vocoder_checkpoint
+            config['vocoder_config'] = vocoder_config
+            synthesizer = Synthesizer(config)
+            wavs.append(synthesizer._vocode([mel])[0])  # pylint: disable=protected-access
+        assert isinstance(synthesizer.vocoder_model, torch.jit.ScriptModule)
+        assert wavs[0].shape == wavs[1].shape
+        assert np.allclose(wavs[0], wavs[1], atol=1e-5)
+        os.remove(checkpoint_path)
+        os.remove(vocoder_path)
+
+    def test_batch_scheduler(self):
+        """Check that each request only gets back its own results"""
+        batch_sizes = []
+
+        def synthesize_fn(sentences, speaker_ids):
+            batch_sizes.append(len(sentences))
+            return [sen.upper() for sen in sentences]
+
+        scheduler = BatchScheduler(synthesize_fn, max_batch_size=4, max_wait_ms=50)
+        requests = [["a", "b"], ["c"], ["d", "e", "f"]]
+        results = [None] * len(requests)
+
+        def _request(idx):
+            results[idx] = scheduler.synthesize(requests[idx])
+
+        threads = [threading.Thread(target=_request, args=(idx, )) for idx in range(len(requests))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        scheduler.close()
+        for sens, result in zip(requests, results):
+            assert result == [sen.upper() for sen in sens]
+        assert max(batch_sizes) <= 4
+        assert sum(batch_sizes) == 6
+
+    def test_batch_scheduler_speaker_ids(self):
+        """Check that sentences with and without a speaker id are not
+        batched together"""
+        batches = []
+
+        def synthesize_fn(sentences, speaker_ids):
+            batches.append(speaker_ids)
+            return sentences
+
+        scheduler = BatchScheduler(synthesize_fn, max_batch_size=8, max_wait_ms=200)
+        futures = [scheduler.submit(sen, speaker_id) for sen, speaker_id in zip("abcd", [None, 0, None, 1])]
+        results = [future.result() for future in futures]
+        scheduler.close()
+        assert results == list("abcd")
+        for speaker_ids in batches:
+            assert all(speaker_id is None for speaker_id in speaker_ids) or None not in speaker_ids
+
+    def test_tts_cache(self):
+        self._create_random_model()
+        config = load_config(os.path.join(get_tests_input_path(), 'server_config.json'))
+        tts_root_path = get_tests_output_path()
+        config['tts_checkpoint'] = os.path.join(tts_root_path, config['tts_checkpoint'])
+        config['tts_config'] = os.path.join(tts_root_path, config['tts_config'])
+        config['cache_size'] = 2
+        synthesizer = Synthesizer(config)
+        synthesizer.tts_model.decoder.max_decoder_steps = 50
+        wav = synthesizer.tts("Better this test works!!").getvalue()
+        assert synthesizer.tts("Better this  test works!!").getvalue() == wav
+        assert synthesizer.cache.stats()['memory_hits'] == 1
+
+    def test_tts_encoder_cache(self):
+        self._create_random_model()
+        config = load_config(os.path.join(get_tests_input_path(), 'server_config.json'))
+        tts_root_path = get_tests_output_path()
+        config['tts_checkpoint'] = os.path.join(tts_root_path, config['tts_checkpoint'])
+        config['tts_config'] = os.path.join(tts_root_path, config['tts_config'])
+        config['encoder_cache_mb'] = 1
+        synthesizer = Synthesizer(config)
+        synthesizer.tts_model.decoder.max_decoder_steps = 50
+        synthesizer.tts("Better this test works!!")
+        synthesizer.tts("Better this test works!!")
+        assert synthesizer.tts_model.encoder_cache.stats()['hits'] == 1
+        assert 'tts_encoder_cache_hits_total 1.0' in synthesizer.metrics.expose()
+
+    def test_tts_style_cache(self):
+        self._create_random_model()
+        config = load_config(os.path.join(get_tests_input_path(), 'server_config.json'))
+        tts_root_path = get_tests_output_path()
+        config['tts_checkpoint'] = os.path.join(tts_root_path, config['tts_checkpoint'])
+        config['tts_config'] = os.path.join(tts_root_path, config['tts_config'])
+        config['style_wav'] = os.path.join(get_tests_input_path(), 'example_1.wav')
+        config['style_cache_size'] = 4
+        synthesizer = Synthesizer(config)
+        assert synthesizer.tts_config.use_gst
+        synthesizer.tts_model.decoder.max_decoder_steps = 50
+        synthesizer.tts("Better this test works!!")
+        synthesizer.tts("Better this test works!!")
+        # the wav mel and the GST embedding are computed once
+        assert synthesizer.tts_model.style_cache.stats() == {'hits': 2, 'misses': 2, 'items': 2}
+        assert 'tts_style_cache_hits_total 2.0' in synthesizer.metrics.expose()
+
+    def test_metrics(self):
+        self._create_random_model()
+        config = load_config(os.path.join(get_tests_input_path(), 'server_config.json'))
+        tts_root_path = get_tests_output_path()
+        config['tts_checkpoint'] = os.path.join(tts_root_path, config['tts_checkpoint'])
+        config['tts_config'] = os.path.join(tts_root_path, config['tts_config'])
+        synthesizer = Synthesizer(config)
+        synthesizer.tts_model.decoder.max_decoder_steps = 50
+        synthesizer.tts("Better this test works!! Hello.")
+        metrics = synthesizer.metrics.expose()
+        for stage in ['text_cleaning', 'encoder', 'decoder', 'postnet', 'vocoder', 'silence_trim', 'wav_encoding']:
+            assert f'tts_stage_duration_seconds_count{{stage="{stage}"}} ' in metrics
+        # nested calls of the decoder are timed once per sentence
+        assert 'tts_stage_duration_seconds_count{stage="decoder"} 2.0' in metrics
+        assert 'tts_requests_total 1.0' in metrics
+        assert 'tts_decoder_steps_count 2.0' in metrics
+        assert 'tts_real_time_factor_bucket{le="+Inf"} 1.0' in metrics
+        assert 'tts_batch_queue_depth 0.0' in metrics
+
+    def test_histogram(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram('latency_seconds', 'Latency.', label_name='stage', buckets=(0.1, 1.0))
+        histogram.observe(0.05, 'a')
+        histogram.observe(0.5, 'a')
+        histogram.observe(5.0, 'a')
+        lines = registry.expose().splitlines()
+        assert lines[:2] == ['# HELP latency_seconds Latency.', '# TYPE latency_seconds histogram']
+        assert lines[2:] == ['latency_seconds_bucket{stage="a",le="0.1"} 1.0',
+                             'latency_seconds_bucket{stage="a",le="1.0"} 2.0',
+                             'latency_seconds_bucket{stage="a",le="+Inf"} 3.0',
+                             'latency_seconds_sum{stage="a"} 5.55',
+                             'latency_seconds_count{stage="a"} 3.0']
+
+    def test_shared_metrics(self):
+        metrics_dir = os.path.join(get_tests_output_path(), 'shared_metrics')
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir)
+
+        def _create_registry():
+            registry = MetricsRegistry()
+            counter = registry.counter('requests_total', 'Requests.')
+            gauge = registry.gauge('requests_in_progress', 'Requests running.')
+            histogram = registry.histogram('latency_seconds', 'Latency.', buckets=(0.1, 1.0))
+            return registry, counter, gauge, histogram
+
+        read_fd, write_fd = os.pipe()
+        ready_read_fd, ready_write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # another worker, running until the pipe is closed
+            registry, counter, gauge, histogram = _create_registry()
+            counter.inc(2)
+            gauge.inc()
+            histogram.observe(0.5)
+            registry.share(metrics_dir)
+            os.write(ready_write_fd, b'1')
+            os.close(write_fd)
+            os.read(read_fd, 1)
+            os._exit(0)
+        os.close(read_fd)
+        os.close(ready_write_fd)
+        try:
+            registry, counter, gauge, histogram = _create_registry()
+            counter.inc()
+            gauge.set(0)
+            histogram.observe(0.05)
+            registry.shared_dir = metrics_dir
+            # wait for the first snapshot of the other worker
+            os.read(ready_read_fd, 1)
+            os.close(ready_read_fd)
+            metrics = registry.expose()
+            assert 'requests_total 3.0' in metrics
+            assert 'requests_in_progress 1.0' in metrics
+            assert 'latency_seconds_bucket{le="0.1"} 1.0' in metrics
+            assert 'latency_seconds_bucket{le="1.0"} 2.0' in metrics
+            assert 'latency_seconds_count 2.0' in metrics
+        finally:
+            os.close(write_fd)
+            os.waitpid(pid, 0)
+        # the counters of a worker that exited are kept, its gauges are not
+        metrics = registry.expose()
+        assert 'requests_total 3.0' in metrics
+        assert 'requests_in_progress 0.0' in metrics
+        shutil.rmtree(metrics_dir)
+
+    def test_share_memory(self):
+        self._create_random_model()
+        config = load_config(os.path.join(get_tests_input_path(), 'server_config.json'))
+        tts_root_path = get_tests_output_path()
+        config['tts_checkpoint'] = os.path.join(tts_root_path, config['tts_checkpoint'])
+        config['tts_config'] = os.path.join(tts_root_path, config['tts_config'])
+        synthesizer = Synthesizer(config)
+        synthesizer.share_memory()
+        assert all(param.is_shared() for param in synthesizer.tts_model.parameters())
+
+    def test_prefork_server(self):
+        app = Flask(__name__)
+        counter = {'forks': 0}
+
+        @app.route('/')
+        def _index():
+            return f"{os.getpid()} {torch.get_num_threads()} {counter['forks']}"
+
+        def _post_fork():
+            counter['forks'] += 1
+
+        server = PreforkServer(app, '127.0.0.1', 0, num_workers=2, num_threads=1, post_fork_fn=_post_fork)
+        server.start()
+        try:
+            pids = set()
+            for _ in range(20):
+                with urllib.request.urlopen(f'http://127.0.0.1:{server.port}/') as response:
+                    pid, num_threads, forks = response.read().decode().split()
+                pids.add(int(pid))
+                assert int(num_threads) == 1
+                assert int(forks) == 1
+            assert pids <= set(server.worker_pids)
+            assert os.getpid() not in pids
+        finally:
+            server.stop()
+        assert not server.worker_pids
+
+    def test_synthesis_cache(self):
+        cache_dir = os.path.join(get_tests_output_path(), 'synthesis_cache')
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        calls = []
+
+        def _compute(value):
+            calls.append(value)
+            return value
+
+        cache = SynthesisCache(max_items=2, cache_dir=cache_dir, max_disk_bytes=20)
+        key_a = SynthesisCache.make_key(" Hello  world. ", "model")
+        assert key_a == SynthesisCache.make_key("Hello world.", "model")
+        assert key_a != SynthesisCache.make_key("Hello world.", "model", speaker_id=1)
+        assert key_a != SynthesisCache.make_key("Hello world.", "other_model")
+        assert cache.get_or_compute(key_a, lambda: _compute(b'a' * 8)) == b'a' * 8
+        assert cache.get_or_compute(key_a, lambda: _compute(b'x')) == b'a' * 8
+        assert len(calls) == 1
+        stats = cache.stats()
+        assert stats['misses'] == 1 and stats['memory_hits'] == 1
+        # a new cache finds the result on disk
+        cache = SynthesisCache(max_items=2, cache_dir=cache_dir, max_disk_bytes=20)
+        assert cache.get_or_compute(key_a, lambda: _compute(b'x')) == b'a' * 8
+        assert cache.stats()['disk_hits'] == 1
+        # the least recently used files are evicted from disk
+        for idx in range(3):
+            cache.get_or_compute(str(idx), lambda idx=idx: _compute(bytes([idx]) * 8))
+        assert cache.stats()['disk_bytes'] <= 20
+        assert len(os.listdir(cache_dir)) == 2
+        assert len(cache.memory) == 2
+        shutil.rmtree(cache_dir)
+
+    def test_synthesis_cache_coalescing(self):
+        """Check that concurrent identical requests run a single synthesis"""
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def _compute():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return b'wav'
+
+        cache = SynthesisCache(max_items=2)
+        results = [None] * 4
+
+        def _request(idx):
+            results[idx] = cache.get_or_compute("key", _compute)
+
+        threads = [threading.Thread(target=_request, args=(0, ))]
+        threads[0].start()
+        started.wait()
+        threads += [threading.Thread(target=_request, args=(idx, )) for idx in range(1, 4)]
+        for thread in threads[1:]:
+            thread.start()
+        while cache.stats()['coalesced'] < 3:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert results == [b'wav'] * 4
+        assert len(calls) == 1
+
+    def test_pipeline_scheduler(self):
+        """Check that the two stages overlap and results keep their order"""
+        def acoustic_fn(sentences, speaker_ids):
+            time.sleep(0.1)
+            if "fail" in sentences:
+                raise RuntimeError("acoustic model failed")
+            return [sen.upper() for sen in sentences]
+
+        def vocoder_fn(outputs):
+            time.sleep(0.1)
+            return [out + "!" for out in outputs]
+
+        scheduler = PipelineScheduler(acoustic_fn, vocoder_fn, queue_size=1,
+                                      acoustic_threads=1, vocoder_threads=1)
+        start_time = time.time()
+        results = scheduler.synthesize(["a", "b", "c", "d"])
+        elapsed = time.time() - start_time
+        assert results == ["A!", "B!", "C!", "D!"]
+        # 0.8s when the stages run one after the other
+        assert elapsed < 0.7, elapsed
+        future = scheduler.submit("fail")
+        with self.assertRaises(RuntimeError):
+            future.result()
+        scheduler.close()
+
+    def test_tts_pipeline(self):
+        self._create_random_model()
+        config = load_config(os.path.join(get_tests_input_path(), 'server_config.json'))
+        tts_root_path = get_tests_output_path()
+        config['tts_checkpoint'] = os.path.join(tts_root_path, config['tts_checkpoint'])
+        config['tts_config'] = os.path.join(tts_root_path, config['tts_config'])
+        config['use_pipeline'] = True
+        synthesizer = Synthesizer(config)
+        synthesizer.tts_model.decoder.max_decoder_steps = 50
+        assert isinstance(synthesizer.batch_scheduler, PipelineScheduler)
+        synthesizer.tts("Better this test works!! Hello.")
+        chunks = list(synthesizer.tts_stream("Better this test works!! Hello."))
+        assert len(chunks) == 5
+        synthesizer.batch_scheduler.close()
+
     def test_split_into_sentences(self):
         """Check demo server sentences split as expected"""
         print("\n > Testing demo server sentence splitting")
@@ -1,6 +1,7 @@
 import unittest
 import torch as T
 
+from mozilla_voice_tts.tts.layers.common_layers import OriginalAttention
 from mozilla_voice_tts.tts.layers.tacotron import Prenet, CBHG, Decoder, Encoder
 from mozilla_voice_tts.tts.layers.losses import L1LossMasked
 from mozilla_voice_tts.tts.utils.generic_utils import sequence_mask
@@ -83,6 +84,73 @@ class EncoderTests(unittest.TestCase):
         assert output.shape[2] == 256  # 128 * 2 BiRNN
 
 
+class OriginalAttentionTests(unittest.TestCase):
+    def test_batch_windowing(self):  #pylint: disable=no-self-use
+        """Windowed and masked forward attention give the same results for each item of a batch"""
+        layer = OriginalAttention(query_dim=16, embedding_dim=8, attention_dim=8,
+                                  location_attention=True,
+                                  attention_location_n_filters=4,
+                                  attention_location_kernel_size=3,
+                                  windowing=True, norm='softmax',
+                                  forward_attn=True, trans_agent=True,
+                                  forward_attn_mask=True)
+        layer.eval()
+        dummy_inputs = T.rand(3, 13, 8)
+        dummy_queries = T.rand(20, 3, 16)
+
+        layer.init_states(dummy_inputs)
+        processed_inputs = layer.preprocess_inputs(dummy_inputs)
+        contexts = [layer(query, dummy_inputs, processed_inputs, None) for query in dummy_queries]
+        win_idx = layer.win_idx
+
+        for b in range(3):
+            inputs = dummy_inputs[b:b + 1]
+            layer.init_states(inputs)
+            processed_inputs = layer.preprocess_inputs(inputs)
+            for t, query in enumerate(dummy_queries):
+                context = layer(query[b:b + 1], inputs, processed_inputs, None)
+                assert T.allclose(context[0], contexts[t][b], atol=1e-6)
+            assert layer.win_idx[0] == win_idx[b]
+
+    def test_local_window(self):  #pylint: disable=no-self-use
+        """Local attention with the window of attention windowing gives the
+        same results as windowing over the full input"""
+        layer = OriginalAttention(query_dim=16, embedding_dim=8, attention_dim=8,
+                                  location_attention=True,
+                                  attention_location_n_filters=4,
+                                  attention_location_kernel_size=5,
+                                  windowing=True, norm='softmax',
+                                  forward_attn=False, trans_agent=False,
+                                  forward_attn_mask=False)
+        layer.eval()
+        dummy_inputs = T.rand(3, 30, 8)
+        dummy_queries = T.rand(20, 3, 16)
+        mask = sequence_mask(T.LongTensor([30, 24, 17]))
+        processed_inputs = layer.preprocess_inputs(dummy_inputs)
+
+        layer.init_states(dummy_inputs)
+        contexts, alignments = [], []
+        for query in dummy_queries:
+            contexts.append(layer(query, dummy_inputs, processed_inputs, mask))
+            alignments.append(layer.attention_weights)
+
+        layer.set_local_window(layer.win_back, layer.win_front)
+        layer.init_states(dummy_inputs)
+        for t, query in enumerate(dummy_queries):
+            context = layer(query, dummy_inputs, processed_inputs, mask)
+            assert T.allclose(context, contexts[t], atol=1e-6)
+            assert T.allclose(layer.attention_weights, alignments[t], atol=1e-6)
+
+        # without windowing, attention is limited to the local window
+        layer.windowing = False
+        layer.set_local_window(2, 4)
+        layer.init_states(dummy_inputs)
+        for query in dummy_queries:
+            layer(query, dummy_inputs, processed_inputs, mask)
+            assert ((layer.attention_weights > 0).sum(1) <= 6).all()
+            assert T.allclose(layer.attention_weights.sum(1), T.ones(3))
+
+
 class L1LossMaskedTests(unittest.TestCase):
     def test_in_out(self):  #pylint: disable=no-self-use
         # test input == target
@@ -8,7 +8,11 @@ from tests import get_tests_input_path, get_tests_output_path
 from torch.utils.data import DataLoader
 
 from mozilla_voice_tts.tts.datasets import TTSDataset
+from mozilla_voice_tts.tts.datasets.feature_store import FeatureStore
+from mozilla_voice_tts.tts.datasets.phoneme_cache import INDEX_FILE, PhonemeCache
 from mozilla_voice_tts.tts.datasets.preprocess import ljspeech
+from mozilla_voice_tts.tts.datasets.sampler import BatchGroupSampler, BucketBatchSampler
+from mozilla_voice_tts.tts.utils.distribute import BalancedDistributedSampler, load_imbalance
 from mozilla_voice_tts.utils.audio import AudioProcessor
 from mozilla_voice_tts.utils.io import load_config
 
@@ -32,7 +36,7 @@ class TestTTSDataset(unittest.TestCase):
         self.max_loader_iter = 4
         self.ap = AudioProcessor(**c.audio)
 
-    def _create_dataloader(self, batch_size, r, bgs):
+    def _create_dataloader(self, batch_size, r, bgs, feature_store_path=None):
         items = ljspeech(c.data_path, 'metadata.csv')
         dataset = TTSDataset.MyDataset(
             r,
@@ -44,7 +48,8 @@ class TestTTSDataset(unittest.TestCase):
             batch_group_size=bgs,
             min_seq_len=c.min_seq_len,
             max_seq_len=float("inf"),
-            use_phonemes=False)
+            use_phonemes=False,
+            feature_store_path=feature_store_path)
         dataloader = DataLoader(
             dataset,
             batch_size=batch_size,
@@ -89,6 +94,154 @@ class TestTTSDataset(unittest.TestCase):
                     assert mel_input.max() <= self.ap.max_norm
                     assert mel_input.min() >= 0
 
+    def test_feature_store(self):
+        if ok_ljspeech:
+            store_path = os.path.join(OUTPATH, 'feature_store')
+            wav_files = [item[1] for item in ljspeech(c.data_path, 'metadata.csv')]
+            # small shards to test several of them
+            store = FeatureStore.build(store_path, wav_files, self.ap, compute_linear_spec=True,
+                                       max_shard_bytes=2**16)
+            assert len(store) == len(wav_files)
+            assert FeatureStore.is_up_to_date(store_path, self.ap, True, wav_files)
+            mel, linear = store.load(wav_files[0])
+            assert not mel.flags.owndata
+            dataloader, _ = self._create_dataloader(2, c.r, 0)
+            store_dataloader, _ = self._create_dataloader(2, c.r, 0, feature_store_path=store_path)
+            for i, (data, store_data) in enumerate(zip(dataloader, store_dataloader)):
+                if i == self.max_loader_iter:
+                    break
+                assert data[7] == store_data[7]
+                for idx in [3, 4, 5, 6]:
+                    assert torch.allclose(data[idx], store_data[idx])
+            # the store is rejected after changing the audio parameters
+            audio_config = dict(c.audio)
+            audio_config['hop_length'] = self.ap.hop_length // 2
+            audio_config['win_length'] = self.ap.win_length
+            ap = AudioProcessor(**audio_config)
+            assert not FeatureStore.is_up_to_date(store_path, ap, True)
+            with self.assertRaises(RuntimeError):
+                store.check(ap)
+            shutil.rmtree(store_path)
+
+    def test_feature_store_same_file_names(self):
+        # files of the same name in different speaker folders, as in VCTK
+        store_path = os.path.join(OUTPATH, 'feature_store_speakers')
+        wav_files = []
+        for speaker, seconds in [('p225', 1.0), ('p226', 0.5)]:
+            os.makedirs(os.path.join(OUTPATH, speaker), exist_ok=True)
+            wav_file = os.path.join(OUTPATH, speaker, '001.wav')
+            wav = self.ap.load_wav(os.path.join(get_tests_input_path(), 'example_1.wav'))
+            self.ap.save_wav(wav[:int(seconds * self.ap.sample_rate)], wav_file)
+            wav_files.append(wav_file)
+        store = FeatureStore.build(store_path, wav_files, self.ap)
+        assert len(store) == 2
+        for wav_file in wav_files:
+            mel, _ = store.load(wav_file)
+            expected = self.ap.melspectrogram(self.ap.load_wav(wav_file)).astype(np.float32)
+            assert mel.shape == expected.shape
+            assert np.allclose(mel, expected, atol=1e-5)
+        shutil.rmtree(store_path)
+        for wav_file in wav_files:
+            shutil.rmtree(os.path.dirname(wav_file))
+
+    def test_phoneme_cache(self):
+        cache_path = os.path.join(OUTPATH, 'phoneme_cache')
+        shutil.rmtree(cache_path, ignore_errors=True)
+        cache = PhonemeCache(cache_path)
+        key = PhonemeCache.make_key("Hello, world!", c.text_cleaner, 'en-us')
+        # keys depend on the cleaned text and the language
+        assert key == PhonemeCache.make_key("Hello,   world!", c.text_cleaner, 'en-us')
+        assert key != PhonemeCache.make_key("Hello, world!", c.text_cleaner, 'en-gb')
+        assert PhonemeCache.make_keys(["Hello, world!", "Hi."], c.text_cleaner, 'en-us') == \
+            [key, PhonemeCache.make_key("Hi.", c.text_cleaner, 'en-us')]
+        assert cache.get(key) is None
+        cache.put(key, [3, 1, 4, 1, 5])
+        cache.put(key, [9, 9])
+        # entries added by another process are found
+        cache_2 = PhonemeCache(cache_path)
+        assert list(cache_2.get(key)) == [3, 1, 4, 1, 5]
+        key_2 = PhonemeCache.make_key("Another sentence.", c.text_cleaner, 'en-us')
+        cache_2.put(key_2, [2, 7])
+        assert list(cache.get(key_2)) == [2, 7]
+        assert len(cache) == 2
+        # a partially written index record is ignored
+        with open(os.path.join(cache_path, INDEX_FILE), 'ab') as f:
+            f.write(b'\0' * 7)
+        assert len(PhonemeCache(cache_path)) == 2
+        if ok_ljspeech:
+            # the dataset reads cached phonemes without running the phonemizer
+            items = ljspeech(c.data_path, 'metadata.csv')
+            for text, _, _ in items:
+                cache.put(PhonemeCache.make_key(text, c.text_cleaner, 'en-us'), [len(text)])
+            dataset = TTSDataset.MyDataset(
+                c.r, c.text_cleaner, compute_linear_spec=False, ap=self.ap, meta_data=items,
+                use_phonemes=True, phoneme_cache_path=cache_path, phoneme_language='en-us')
+            text, _, _ = dataset.items[0]
+            assert list(dataset.load_data(0)['text']) == [len(text)]
+            # the keys follow the sorted items
+            assert dataset.phoneme_keys[-1] == PhonemeCache.make_key(dataset.items[-1][0], c.text_cleaner, 'en-us')
+        shutil.rmtree(cache_path)
+
+    def test_bucket_batch_sampler(self):
+        lengths = np.random.randint(50, 1000, 500)
+        sampler = BucketBatchSampler(lengths, max_frames=4000, max_batch_size=16, bucket_size=64)
+        batches = list(sampler)
+        assert sorted(sum(batches, [])) == list(range(len(lengths)))
+        for batch in batches:
+            assert len(batch) <= 16
+            assert len(batch) == 1 or len(batch) * lengths[batch].max() <= 4000
+        # fewer padding frames than batches of random items
+        assert sampler.stats()['padding_ratio'] < 0.1
+        # the same order for the same epoch, another one for the next epoch
+        assert list(BucketBatchSampler(lengths, 4000, 16, 64)) == batches
+        sampler.set_epoch(1)
+        assert list(sampler) != batches
+        # replicas get disjoint batches of the same number
+        replicas = [BucketBatchSampler(lengths, 4000, 16, 64, num_replicas=3, rank=rank) for rank in range(3)]
+        assert len(set(len(replica) for replica in replicas)) == 1
+        replica_batches = [batch for replica in replicas for batch in replica]
+        assert sum(len(batch) for batch in replica_batches) >= len(lengths)
+        assert set(sum(replica_batches, [])) == set(range(len(lengths)))
+        assert replicas[0].stats()['imbalance'] < 0.2
+        if ok_ljspeech:
+            _, dataset = self._create_dataloader(1, 1, 0)
+            mel_lengths = dataset.compute_mel_lengths()
+            for idx in range(4):
+                assert mel_lengths[idx] == dataset.collate_fn([dataset[idx]])[5][0]
+
+    def test_batch_group_sampler(self):
+        sampler = BatchGroupSampler(50, 8)
+        indices = list(sampler)
+        assert sorted(indices) == list(range(50))
+        # items stay in their groups and the remainder in place
+        for start in range(0, 48, 8):
+            assert sorted(indices[start:start + 8]) == list(range(start, start + 8))
+        assert indices[48:] == [48, 49]
+        sampler.set_epoch(1)
+        assert list(sampler) != indices
+        assert list(BatchGroupSampler(50, 0)) == list(range(50))
+
+    def test_balanced_distributed_sampler(self):
+        rng = np.random.RandomState(0)
+        lengths = rng.randint(50, 1000, 500)
+        replicas = [BalancedDistributedSampler(lengths, 16, num_replicas=3, rank=rank) for rank in range(3)]
+        indices = [list(replica) for replica in replicas]
+        assert len(set(len(replica_indices) for replica_indices in indices)) == 1
+        assert len(indices[0]) == len(replicas[0])
+        assert len(indices[0]) % 16 == 0
+        assert set(sum(indices, [])) == set(range(len(lengths)))
+        # the same order for the same epoch, another one for the next epoch
+        assert list(BalancedDistributedSampler(lengths, 16, num_replicas=3, rank=0)) == indices[0]
+        replicas[0].set_epoch(1)
+        assert list(replicas[0]) != indices[0]
+        # batches of the same step are closer in length than with strided
+        # sharding of the shuffled items
+        order = rng.permutation(len(lengths))
+        strided = np.resize(order, 11 * 48).reshape(11, 16, 3).transpose(0, 2, 1)
+        strided_imbalance = load_imbalance(lengths[strided].max(2) * 16)
+        assert replicas[0].stats()['imbalance'] < strided_imbalance
+        assert load_imbalance([[2, 2], [1, 3]]) == 0.25
+
     def test_batch_group_shuffle(self):
         if ok_ljspeech:
             dataloader, dataset = self._create_dataloader(2, c.r, 16)
@@ -8,6 +8,9 @@ from torch import nn, optim
 
 from mozilla_voice_tts.tts.layers.losses import MSELossMasked
 from mozilla_voice_tts.tts.models.tacotron2 import Tacotron2
+from mozilla_voice_tts.tts.utils.encoder_cache import EncoderCache
+from mozilla_voice_tts.tts.utils.quantization import mel_distance, quantize_model
+from mozilla_voice_tts.tts.utils.style_cache import StyleCache
 from mozilla_voice_tts.utils.io import load_config
 from mozilla_voice_tts.utils.audio import AudioProcessor
 
@@ -238,3 +241,156 @@ class TacotronGSTTrainTest(unittest.TestCase):
             ), "param {} {} with shape {} not updated!! \n{}\n{}".format(
                 name, count, param.shape, param, param_ref)
             count += 1
+
+
+class TacotronInferenceTest(unittest.TestCase):
+    #pylint: disable=no-self-use
+    def test_inference_batch(self):
+        input_lengths = torch.LongTensor([24, 17, 9, 5]).to(device)
+        input_dummy = torch.randint(1, 24, (4, 24)).long().to(device)
+        for idx, input_length in enumerate(input_lengths):
+            input_dummy[idx, input_length:] = 0
+        model = Tacotron2(num_chars=24, r=c.r, num_speakers=0).to(device)
+        model.eval()
+        model.decoder.max_decoder_steps = 50
+        # set the stop threshold so that half of the batch stops after the second step
+        model.decoder.stop_threshold = 1.0
+        _, _, _, stop_tokens, _ = model.inference_batch(input_dummy, input_lengths)
+        model.decoder.stop_threshold = stop_tokens[:, 1, 0].median().item()
+        _, postnet_outputs, _, stop_tokens, mel_lengths = model.inference_batch(input_dummy, input_lengths)
+        assert mel_lengths.min() == 2 * c.r
+        assert mel_lengths.max() > 2 * c.r
+        assert postnet_outputs.shape[1] == mel_lengths.max()
+        assert stop_tokens.shape[1] * c.r == mel_lengths.max()
+        # each item of the batch matches the unbatched inference
+        for idx, input_length in enumerate(input_lengths):
+            _, postnet_output, _, _ = model.inference(input_dummy[idx:idx + 1, :input_length])
+            assert postnet_output.shape[1] == mel_lengths[idx]
+            assert torch.allclose(postnet_output[0], postnet_outputs[idx, :mel_lengths[idx]], atol=1e-5)
+            assert (postnet_outputs[idx, mel_lengths[idx]:] == 0).all()
+
+    def test_inference_stream(self):
+        input_dummy = torch.randint(1, 24, (1, 24)).long().to(device)
+        model = Tacotron2(num_chars=24, r=c.r, num_speakers=0).to(device)
+        model.eval()
+        model.decoder.max_decoder_steps = 50
+        _, postnet_outputs, _, _ = model.inference(input_dummy)
+        for chunk_size in [1, 7, 32]:
+            chunks = list(model.inference_stream(input_dummy, chunk_size=chunk_size))
+            assert all(chunk.shape[1] == chunk_size for chunk in chunks[:-1])
+            assert torch.allclose(torch.cat(chunks, 1), postnet_outputs, atol=1e-5)
+
+    def test_scripted_decoder_step(self):
+        input_dummy = torch.randint(1, 24, (2, 24)).long().to(device)
+        input_lengths = torch.LongTensor([24, 15]).to(device)
+        mel_spec = torch.rand(2, 30, c.audio['num_mels']).to(device)
+        mel_lengths = torch.LongTensor([30, 22]).to(device)
+        model = Tacotron2(num_chars=24, r=c.r, num_speakers=0, forward_attn=True).to(device)
+        model.eval()
+        model.decoder.max_decoder_steps = 50
+        ref_outputs = model(input_dummy, input_lengths, mel_spec, mel_lengths)
+        ref_inf_outputs = model.inference(input_dummy[:1])
+        model.decoder.script_step()
+        outputs = model(input_dummy, input_lengths, mel_spec, mel_lengths)
+        inf_outputs = model.inference(input_dummy[:1])
+        for ref_output, output in zip(ref_outputs + ref_inf_outputs, outputs + inf_outputs):
+            assert ref_output.shape == output.shape
+            assert torch.allclose(ref_output, output, atol=1e-5)
+        # state dict is not changed by the compiled step
+        assert model.state_dict().keys() == Tacotron2(num_chars=24, r=c.r, num_speakers=0).state_dict().keys()
+
+    def test_inference_without_alignments(self):
+        input_dummy = torch.randint(1, 24, (2, 24)).long().to(device)
+        input_lengths = torch.LongTensor([24, 15]).to(device)
+        model = Tacotron2(num_chars=24, r=c.r, num_speakers=0).to(device)
+        model.eval()
+        # decode long enough to grow the output buffers
+        model.decoder.stop_threshold = 1.0
+        model.decoder.max_decoder_steps = 300
+        ref_outputs = model.inference_batch(input_dummy, input_lengths)
+        model.decoder.record_alignments = False
+        outputs = model.inference_batch(input_dummy, input_lengths)
+        assert outputs[2].shape == ref_outputs[2].shape[:2]
+        assert (outputs[2] == ref_outputs[2].argmax(-1)).all()
+        for idx in [0, 1, 3, 4]:
+            assert torch.allclose(ref_outputs[idx], outputs[idx])
+
+    def test_style_cache(self):
+        input_dummy = torch.randint(1, 24, (1, 24)).long().to(device)
+        style_mel = torch.rand(1, 30, c.audio['num_mels']).to(device)
+        style_tokens = {'0': 0.3, '3': -0.1}
+        model = Tacotron2(num_chars=24, r=c.r, num_speakers=0, gst=True).to(device)
+        model.eval()
+        model.decoder.max_decoder_steps = 50
+        ref_outputs = [model.inference(input_dummy, style_mel=style)[1] for style in [style_mel, style_tokens]]
+        model.style_cache = StyleCache()
+        for _ in range(2):
+            outputs = [model.inference(input_dummy, style_mel=style)[1] for style in [style_mel, style_tokens]]
+            for ref_output, output in zip(ref_outputs, outputs):
+                assert torch.allclose(ref_output, output)
+        assert model.style_cache.stats() == {'hits': 2, 'misses': 2, 'items': 2}
+        # another style is another entry
+        model.inference(input_dummy, style_mel=style_mel + 0.1)
+        assert model.style_cache.stats()['misses'] == 3
+        assert StyleCache.wav_key(WAV_FILE) == StyleCache.wav_key(WAV_FILE)
+
+    def test_encoder_cache(self):
+        input_dummy = torch.randint(1, 24, (1, 24)).long().to(device)
+        style_mel = torch.rand(1, 30, c.audio['num_mels']).to(device)
+        speaker_ids = [torch.LongTensor([i]).to(device) for i in range(2)]
+        model = Tacotron2(num_chars=24, r=c.r, num_speakers=5, gst=True).to(device)
+        model.eval()
+        model.decoder.max_decoder_steps = 50
+        ref_outputs = [model.inference(input_dummy, speaker_ids=speaker_id, style_mel=style_mel)[1]
+                       for speaker_id in speaker_ids]
+        model.encoder_cache = EncoderCache()
+        for _ in range(2):
+            outputs = [model.inference(input_dummy, speaker_ids=speaker_id, style_mel=style_mel)[1]
+                       for speaker_id in speaker_ids]
+            for ref_output, output in zip(ref_outputs, outputs):
+                assert torch.allclose(ref_output, output, atol=1e-5)
+        stats = model.encoder_cache.stats()
+        assert stats['hits'] == 3 and stats['misses'] == 1 and stats['items'] == 1
+        # the least recently used sentences are evicted to fit the budget
+        model.encoder_cache = EncoderCache(max_bytes=stats['bytes'])
+        for text in [input_dummy, input_dummy.flip(1), input_dummy]:
+            model.inference(text, speaker_ids=speaker_ids[0], style_mel=style_mel)
+        assert model.encoder_cache.stats()['misses'] == 3
+        assert model.encoder_cache.stats()['items'] == 1
+
+    def test_quantized_inference(self):
+        input_dummy = torch.randint(1, 24, (1, 24)).long()
+        model = Tacotron2(num_chars=24, r=c.r, num_speakers=0)
+        model.eval()
+        model.decoder.max_decoder_steps = 50
+        quantized_model = quantize_model(model)
+        assert mel_distance(model, quantized_model, input_dummy) < 0.01
+        # quantized checkpoints are loaded into quantized layers
+        quantized_model_2 = quantize_model(Tacotron2(num_chars=24, r=c.r, num_speakers=0))
+        quantized_model_2.load_state_dict(quantized_model.state_dict())
+        quantized_model_2.decoder.max_decoder_steps = 50
+        for output, output_2 in zip(quantized_model.inference(input_dummy),
+                                    quantized_model_2.inference(input_dummy)):
+            assert torch.allclose(output, output_2)
+
+    def test_freeze(self):
+        input_dummy = torch.randint(1, 24, (2, 24)).long().to(device)
+        input_lengths = torch.LongTensor([24, 15]).to(device)
+        mel_spec = torch.rand(2, 30, c.audio['num_mels']).to(device)
+        mel_lengths = torch.LongTensor([30, 22]).to(device)
+        model = Tacotron2(num_chars=24, r=c.r, num_speakers=0, prenet_type='bn', gst=True).to(device)
+        for module in model.modules():
+            if isinstance(module, nn.modules.batchnorm._BatchNorm):  # pylint: disable=protected-access
+                module.running_mean.uniform_(-0.5, 0.5)
+                module.running_var.uniform_(0.5, 2.0)
+        model.eval()
+        model.decoder.max_decoder_steps = 50
+        ref_outputs = model(input_dummy, input_lengths, mel_spec, mel_lengths)
+        ref_inf_outputs = model.inference(input_dummy[:1], style_mel=mel_spec[:1])
+        model.freeze()
+        assert not any(isinstance(module, (nn.Dropout, nn.modules.batchnorm._BatchNorm))  # pylint: disable=protected-access
+                       for module in model.modules())
+        outputs = model(input_dummy, input_lengths, mel_spec, mel_lengths)
+        inf_outputs = model.inference(input_dummy[:1], style_mel=mel_spec[:1])
+        for ref_output, output in zip(ref_outputs + ref_inf_outputs, outputs + inf_outputs):
+            assert torch.allclose(ref_output, output, atol=1e-5)
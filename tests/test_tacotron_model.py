@@ -8,6 +8,7 @@ from torch import nn, optim
 
 from mozilla_voice_tts.tts.layers.losses import L1LossMasked
 from mozilla_voice_tts.tts.models.tacotron import Tacotron
+from mozilla_voice_tts.tts.utils.encoder_cache import EncoderCache
 from mozilla_voice_tts.utils.io import load_config
 from mozilla_voice_tts.utils.audio import AudioProcessor
 
@@ -284,3 +285,46 @@ class TacotronGSTTrainTest(unittest.TestCase):
             ), "param {} with shape {} not updated!! \n{}\n{}".format(
                 count, param.shape, param, param_ref)
             count += 1
+
+
+class TacotronFreezeTest(unittest.TestCase):
+    @staticmethod
+    def test_freeze():
+        input_dummy = torch.randint(1, 24, (2, 24)).long().to(device)
+        input_lengths = torch.LongTensor([24, 15]).to(device)
+        mel_spec = torch.rand(2, 30, c.audio['num_mels']).to(device)
+        mel_lengths = torch.LongTensor([30, 22]).to(device)
+        model = Tacotron(num_chars=24, r=c.r, num_speakers=0,
+                         postnet_output_dim=c.audio['fft_size'],
+                         decoder_output_dim=c.audio['num_mels'],
+                         memory_size=c.memory_size).to(device)
+        for module in model.modules():
+            if isinstance(module, nn.BatchNorm1d):
+                module.running_mean.uniform_(-0.5, 0.5)
+                module.running_var.uniform_(0.5, 2.0)
+        model.eval()
+        ref_outputs = model(input_dummy, input_lengths, mel_spec, mel_lengths)
+        model.freeze()
+        assert not any(isinstance(module, nn.BatchNorm1d) for module in model.modules())
+        outputs = model(input_dummy, input_lengths, mel_spec, mel_lengths)
+        for ref_output, output in zip(ref_outputs, outputs):
+            assert torch.allclose(ref_output, output, atol=1e-5)
+
+
+class TacotronEncoderCacheTest(unittest.TestCase):
+    @staticmethod
+    def test_encoder_cache():
+        input_dummy = torch.randint(1, 24, (1, 24)).long().to(device)
+        model = Tacotron(num_chars=24, r=c.r, num_speakers=5,
+                         postnet_output_dim=c.audio['fft_size'],
+                         decoder_output_dim=c.audio['num_mels'],
+                         memory_size=c.memory_size).to(device)
+        model.eval()
+        model.decoder.max_decoder_steps = 50
+        speaker_ids = [torch.LongTensor([i]).to(device) for i in range(2)]
+        ref_outputs = [model.inference(input_dummy, speaker_ids=speaker_id)[1] for speaker_id in speaker_ids]
+        model.encoder_cache = EncoderCache()
+        outputs = [model.inference(input_dummy, speaker_ids=speaker_id)[1] for speaker_id in speaker_ids]
+        for ref_output, output in zip(ref_outputs, outputs):
+            assert torch.allclose(ref_output, output, atol=1e-5)
+        assert model.encoder_cache.stats()['hits'] == 1
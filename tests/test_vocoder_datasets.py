@@ -6,7 +6,7 @@ from torch.utils.data import DataLoader
 
 from mozilla_voice_tts.utils.audio import AudioProcessor
 from mozilla_voice_tts.utils.io import load_config
-from mozilla_voice_tts.vocoder.datasets.gan_dataset import GANDataset
+from mozilla_voice_tts.vocoder.datasets.gan_dataset import GANDataset, GANPairSampler
 from mozilla_voice_tts.vocoder.datasets.preprocess import load_wav_data
 
 file_path = os.path.dirname(os.path.realpath(__file__))
@@ -93,3 +93,24 @@ def test_parametrized_gan_dataset():
     for param in params:
         print(param)
         gan_dataset_case(*param)
+
+
+def test_gan_pair_sampler():
+    sampler = GANPairSampler(50)
+    pairs = list(sampler)
+    assert len(pairs) == len(sampler) == 50
+    # every item is used once for G and once for D
+    assert sorted(idx for idx, _ in pairs) == list(range(50))
+    assert sorted(idx2 for _, idx2 in pairs) == list(range(50))
+    # the same pairs for the same epoch, others for the next epoch
+    assert list(GANPairSampler(50)) == pairs
+    sampler.set_epoch(1)
+    assert sorted(list(sampler)) != sorted(pairs)
+    if ok_ljspeech:
+        ap = AudioProcessor(**C.audio)
+        _, train_items = load_wav_data(test_data_path, 10)
+        dataset = GANDataset(ap, train_items, seq_len=ap.hop_length * 10, hop_len=ap.hop_length,
+                             pad_short=2000, conv_pad=0)
+        loader = DataLoader(dataset, batch_size=2, sampler=GANPairSampler(len(dataset)))
+        item1, item2 = next(iter(loader))
+        assert item1[0].shape == item2[0].shape == (2, ap.num_mels, 10)
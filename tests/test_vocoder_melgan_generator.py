@@ -1,7 +1,11 @@
+import io
+
 import numpy as np
 import torch
 
 from mozilla_voice_tts.vocoder.models.melgan_generator import MelganGenerator
+from mozilla_voice_tts.vocoder.models.multiband_melgan_generator import MultibandMelganGenerator
+from mozilla_voice_tts.vocoder.utils.torchscript import export_melgan
 
 def test_melgan_generator():
     model = MelganGenerator()
@@ -11,3 +15,46 @@ def test_melgan_generator():
     assert np.all(output.shape == (4, 1, 64 * 256))
     output = model.inference(dummy_input)
     assert np.all(output.shape == (4, 1, (64 + 4) * 256))
+
+
+def test_melgan_generator_inference_stream():
+    for model in [MelganGenerator(), MultibandMelganGenerator()]:
+        model.remove_weight_norm()
+        model.eval()
+        dummy_input = torch.rand((2, 80, 50))
+        output = model.inference(dummy_input)
+        # feed the features in irregular chunks, as a decoder would
+        c_chunks = [dummy_input[:, :, idx:idx + 3] for idx in range(0, 50, 3)]
+        wav_chunks = list(model.inference_stream(c_chunks, chunk_size=8))
+        assert all(wav_chunk.shape[2] == 8 * 256 for wav_chunk in wav_chunks[:-1])
+        assert torch.allclose(torch.cat(wav_chunks, 2), output, atol=1e-5)
+
+
+def test_melgan_generator_chunked_inference():
+    for model in [MelganGenerator(), MultibandMelganGenerator()]:
+        model.remove_weight_norm()
+        model.eval()
+        dummy_input = torch.rand((2, 80, 50))
+        output = model.inference(dummy_input)
+        for chunk_size in [1, 8, 64]:
+            output_chunked = model.inference(dummy_input, chunk_size=chunk_size)
+            assert output_chunked.shape == output.shape
+            assert torch.allclose(output_chunked, output, atol=1e-5)
+
+
+def test_melgan_generator_torchscript():
+    for model in [MelganGenerator(), MultibandMelganGenerator()]:
+        model.eval()
+        dummy_input = torch.rand((2, 80, 50))
+        output = model.inference(dummy_input)
+        scripted_model = export_melgan(model, inference_padding=2)
+        buffer = io.BytesIO()
+        torch.jit.save(scripted_model, buffer)
+        buffer.seek(0)
+        scripted_model = torch.jit.load(buffer)
+        # the padding is trimmed from the output of the exported model
+        output_scripted = scripted_model.inference(dummy_input)
+        assert output_scripted.shape == (2, 1, 50 * 256)
+        assert torch.allclose(output_scripted, output[:, :, 2 * 256:-2 * 256], atol=1e-5)
+        output_chunked = scripted_model.inference(dummy_input, chunk_size=8)
+        assert torch.allclose(output_chunked, output_scripted, atol=1e-5)
@@ -25,3 +25,27 @@ def test_pwgan_generator():
     model.remove_weight_norm()
     output = model.inference(dummy_c)
     assert np.all(output.shape == (2, 1, (5 + 4) * 256))
+
+
+def test_pwgan_generator_chunked_inference():
+    # narrow layers with the default receptive field to keep the test fast
+    model = ParallelWaveganGenerator(res_channels=16, gate_channels=32, skip_channels=16,
+                                     upsample_factors=[4, 4, 4, 4])
+    model.remove_weight_norm()
+    model.eval()
+    dummy_c = torch.rand((2, 80, 160))
+    torch.manual_seed(1)
+    output = model.inference(dummy_c)
+    for chunk_size in [3, 8, 16]:
+        # the input is several times longer than a chunk with its context,
+        # so chunks away from the edges are cut from the middle of the input
+        assert dummy_c.shape[2] > 3 * (chunk_size + 2 * model.context_frames)
+        # use the same input noise
+        torch.manual_seed(1)
+        output_chunked = model.inference(dummy_c, chunk_size=chunk_size)
+        assert output_chunked.shape == output.shape
+        assert torch.allclose(output_chunked, output, atol=1e-6)
+    # chunks without enough context differ from the full inference
+    model.context_frames = 1
+    torch.manual_seed(1)
+    assert not torch.allclose(model.inference(dummy_c, chunk_size=16), output, atol=1e-6)
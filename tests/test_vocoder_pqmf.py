@@ -25,3 +25,18 @@ def test_pqmf():
     print(w2_.min())
     print(w2_.mean())
     sf.write('pqmf_output.wav', w2_.flatten().detach(), sr)
+
+
+def test_pqmf_modes():
+    layer = PQMF(N=4, taps=62, cutoff=0.15, beta=9.0, mode='conv')
+    for num_samples in [1024, 1027]:
+        x = torch.randn(2, 1, num_samples)
+        subbands = torch.randn(2, 4, num_samples // 4)
+        analysis_output = layer.analysis(x)
+        synthesis_output = layer.synthesis(subbands)
+        for mode in ['polyphase', 'fft']:
+            layer_mode = PQMF(N=4, taps=62, cutoff=0.15, beta=9.0, mode=mode)
+            assert torch.allclose(layer_mode.analysis(x), analysis_output, atol=1e-5)
+            assert torch.allclose(layer_mode.synthesis(subbands), synthesis_output, atol=1e-5)
+            # the polyphase filters are derived, so checkpoints do not change
+            assert layer_mode.state_dict().keys() == layer.state_dict().keys()
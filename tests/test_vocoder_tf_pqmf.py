@@ -1,4 +1,6 @@
 import os
+
+import numpy as np
 import tensorflow as tf
 
 import soundfile as sf
@@ -26,3 +28,16 @@ def test_pqmf():
     print(w2_.min())
     print(w2_.mean())
     sf.write('tf_pqmf_output.wav', w2_.flatten(), sr)
+
+
+def test_pqmf_modes():
+    layer = PQMF(N=4, taps=62, cutoff=0.15, beta=9.0, mode='conv')
+    for num_samples in [1024, 1027]:
+        x = tf.random.normal((2, 1, num_samples))
+        subbands = tf.random.normal((2, 4, num_samples // 4))
+        analysis_output = layer.analysis(x).numpy()
+        synthesis_output = layer.synthesis(subbands).numpy()
+        for mode in ['polyphase', 'fft']:
+            layer_mode = PQMF(N=4, taps=62, cutoff=0.15, beta=9.0, mode=mode)
+            assert np.allclose(layer_mode.analysis(x).numpy(), analysis_output, atol=1e-5)
+            assert np.allclose(layer_mode.synthesis(subbands).numpy(), synthesis_output, atol=1e-5)